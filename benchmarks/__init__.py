@@ -0,0 +1 @@
+"""Benchmark suite: synthetic frame generation and per-stage timings."""
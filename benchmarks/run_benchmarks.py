@@ -0,0 +1,283 @@
+"""Per-stage pipeline benchmarks on synthetic frames.
+
+Usage:
+    python benchmarks/run_benchmarks.py run --output bench.json [--frames 5 --width 800 --height 600 ...]
+    python benchmarks/run_benchmarks.py compare baseline.json bench.json [--threshold 0.1]
+
+`run` generates synthetic frames for each requested depth format, times every
+pipeline stage per frame plus the whole `PipelineOrchestrator.process_single_frame`,
+times cold starts of fresh interpreters (case "startup"), and writes per-stage
+statistics (seconds) as JSON. `compare` reports the median ratio per stage and
+exits with status 1 when any stage regressed beyond the threshold.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+# Ensure project root is on sys.path for 'pipeline' imports
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import DEPTH_FORMATS, generate_frames
+from pipeline.annotation_service import AnnotationService
+from pipeline.augmentation_service import AugmentationService
+from pipeline.config_service import ConfigService
+from pipeline.data_models import PipelineConfig, ProcessedFrameData
+from pipeline.file_service import FileService
+from pipeline.hha_service import HHAService
+from pipeline.inpainting_service import InpaintingService
+from pipeline.pipeline_orchestrator import PipelineOrchestrator
+
+RESULTS_VERSION = 1
+STAGES = (
+    "load_raw_data",
+    "inpainting",
+    "annotation_mask",
+    "augmentation",
+    "hha",
+    "save_processed_data",
+    "end_to_end",
+)
+# Cold-start commands, each run in a fresh interpreter from the project root
+STARTUP_COMMANDS = {
+    "main_help": ["main.py", "--help"],
+    "import_pipeline": ["-c", "import pipeline.pipeline_orchestrator"],
+}
+
+
+def _timed(func: Callable[[], object]) -> tuple:
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "median_s": statistics.median(ordered),
+        "mean_s": statistics.fmean(ordered),
+        "min_s": ordered[0],
+        "p90_s": ordered[min(len(ordered) - 1, int(round(0.9 * (len(ordered) - 1))))],
+        "samples": len(ordered),
+    }
+
+
+def benchmark_case(config: PipelineConfig, raw_dir: Path, run_dir: Path, warmup: int) -> Dict[str, dict]:
+    """Time each stage on every frame under `raw_dir`; the first `warmup` frames are not recorded."""
+    file_service = FileService()
+    inpainting = InpaintingService()
+    annotation = AnnotationService()
+    augmentation = AugmentationService()
+    hha_service = HHAService()
+    orchestrator = PipelineOrchestrator(
+        config=config,
+        file_service=file_service,
+        inpainting_service=inpainting,
+        annotation_service=annotation,
+        augmentation_service=augmentation,
+        hha_service=hha_service,
+        run_dir=run_dir,
+    )
+    K = config.cameras.depth_camera_matrix.to_numpy_array().astype(np.float32)
+
+    timings: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    frames = file_service.discover_frames(str(raw_dir))
+    for number, frame_id in enumerate(frames):
+        sample: Dict[str, float] = {}
+        raw, sample["load_raw_data"] = _timed(lambda: file_service.load_raw_data(frame_id))
+        depth_m, sample["inpainting"] = _timed(
+            lambda: inpainting.apply(raw.depth_map_mm, config.inpainting.method, config.inpainting)
+        )
+        mask, sample["annotation_mask"] = _timed(
+            lambda: annotation.convert_polygons_to_mask(raw.polygons, raw.rgb_image.shape[:2])
+        )
+        aug, sample["augmentation"] = _timed(
+            lambda: augmentation.apply(raw.rgb_image, depth_m, mask, config.augmentation)
+        )
+        hha, sample["hha"] = _timed(lambda: hha_service.convert(aug["depth"].astype(np.float32), K))
+        processed = ProcessedFrameData(
+            identifier=frame_id,
+            rgb_image=aug["rgb"],
+            depth_map_filled_m=aug["depth"],
+            hha_image=hha,
+            segmentation_mask=aug["mask"],
+        )
+        # Include the flush so background writes are measured, not just queued
+        _, sample["save_processed_data"] = _timed(
+            lambda: (file_service.save_processed_data(processed, run_dir), file_service.flush())
+        )
+        _, sample["end_to_end"] = _timed(
+            lambda: (orchestrator.process_single_frame(frame_id), file_service.flush())
+        )
+        if number >= warmup:
+            for stage, seconds in sample.items():
+                timings[stage].append(seconds)
+
+    file_service.close()
+    return {stage: _summary(samples) for stage, samples in timings.items() if samples}
+
+
+def benchmark_startup(runs: int) -> Dict[str, dict]:
+    """Wall time of each `STARTUP_COMMANDS` entry, interpreter start-up included."""
+    timings: Dict[str, List[float]] = {name: [] for name in STARTUP_COMMANDS}
+    for _ in range(runs):
+        for name, command in STARTUP_COMMANDS.items():
+            _, seconds = _timed(
+                lambda: subprocess.run([sys.executable, *command], cwd=PROJECT_ROOT, check=True, capture_output=True)
+            )
+            timings[name].append(seconds)
+    return {name: _summary(samples) for name, samples in timings.items()}
+
+
+def run(args: argparse.Namespace) -> None:
+    config = ConfigService().load_config(args.config)
+    # Measure the computation itself, not cache hits
+    config.cache.enabled = False
+    config.execution.workers = 1
+    if args.method is not None:
+        config.inpainting.method = args.method
+
+    formats = DEPTH_FORMATS if args.depth_format == "both" else (args.depth_format,)
+    cases: Dict[str, dict] = {}
+    with tempfile.TemporaryDirectory(prefix="hha_bench_", dir=args.workdir) as tmp:
+        for depth_format in formats:
+            raw_dir = Path(tmp) / depth_format / "raw"
+            generate_frames(
+                raw_dir,
+                count=args.frames + args.warmup,
+                width=args.width,
+                height=args.height,
+                hole_fraction=args.hole_fraction,
+                polygons=args.polygons,
+                depth_format=depth_format,
+                seed=args.seed,
+            )
+            logging.info("Benchmarking %s depth files", depth_format)
+            cases[depth_format] = benchmark_case(config, raw_dir, Path(tmp) / depth_format / "out", args.warmup)
+    if args.startup_runs > 0:
+        logging.info("Benchmarking cold starts")
+        cases["startup"] = benchmark_startup(args.startup_runs)
+
+    results = {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+        },
+        "parameters": {
+            "frames": args.frames,
+            "warmup": args.warmup,
+            "width": args.width,
+            "height": args.height,
+            "hole_fraction": args.hole_fraction,
+            "polygons": args.polygons,
+            "seed": args.seed,
+            "startup_runs": args.startup_runs,
+            "inpainting_method": config.inpainting.method,
+        },
+        "cases": cases,
+    }
+
+    out_path = Path(args.output)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+    for case, stages in cases.items():
+        print(f"[{case}]")
+        for stage, stats in stages.items():
+            print(f"  {stage:<22} median {stats['median_s'] * 1000:9.1f} ms   p90 {stats['p90_s'] * 1000:9.1f} ms")
+    print(f"Results written to {out_path}")
+
+
+def compare(args: argparse.Namespace) -> int:
+    baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+    current = json.loads(Path(args.current).read_text(encoding="utf-8"))
+    if baseline.get("parameters") != current.get("parameters"):
+        print("warning: benchmark parameters differ between the two result files")
+
+    regressions = 0
+    for case, stages in current["cases"].items():
+        base_stages = baseline["cases"].get(case, {})
+        print(f"[{case}]")
+        for stage, stats in stages.items():
+            base = base_stages.get(stage)
+            if base is None:
+                print(f"  {stage:<22} (no baseline)")
+                continue
+            ratio = stats["median_s"] / base["median_s"] if base["median_s"] > 0 else float("inf")
+            delta = stats["median_s"] - base["median_s"]
+            regressed = ratio > 1.0 + args.threshold and delta > args.min_delta
+            regressions += regressed
+            flag = "REGRESSION" if regressed else ""
+            print(
+                f"  {stage:<22} {base['median_s'] * 1000:9.1f} -> {stats['median_s'] * 1000:9.1f} ms"
+                f"  x{ratio:5.2f}  {flag}"
+            )
+
+    if regressions:
+        print(f"{regressions} stage(s) regressed by more than {args.threshold:.0%}")
+        return 1
+    print("No regressions")
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Per-stage benchmarks of the RGB/Depth -> HHA pipeline")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="Generate synthetic frames and time every stage")
+    run_parser.add_argument("--output", required=True, help="Path to the JSON results file")
+    run_parser.add_argument(
+        "--config", default=str(PROJECT_ROOT / "configs" / "config_example.yaml"), help="Pipeline config to benchmark"
+    )
+    run_parser.add_argument("--frames", type=int, default=5, help="Timed frames per depth format")
+    run_parser.add_argument("--warmup", type=int, default=1, help="Untimed frames processed first")
+    run_parser.add_argument("--width", type=int, default=800)
+    run_parser.add_argument("--height", type=int, default=600)
+    run_parser.add_argument("--hole-fraction", type=float, default=0.1, help="Fraction of missing depth pixels")
+    run_parser.add_argument("--polygons", type=int, default=8, help="Annotated polygons per frame")
+    run_parser.add_argument("--depth-format", choices=(*DEPTH_FORMATS, "both"), default="both")
+    run_parser.add_argument("--method", default=None, help="Override inpainting.method from the config")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--startup-runs", type=int, default=5, help="Cold starts timed per command (0 = skip)")
+    run_parser.add_argument("--workdir", default=None, help="Directory for temporary synthetic data")
+
+    cmp_parser = sub.add_parser("compare", help="Compare results against a stored baseline")
+    cmp_parser.add_argument("baseline", help="Baseline JSON results")
+    cmp_parser.add_argument("current", help="Current JSON results")
+    cmp_parser.add_argument("--threshold", type=float, default=0.1, help="Allowed relative slowdown of the median")
+    cmp_parser.add_argument(
+        "--min-delta", type=float, default=0.002, help="Ignore slowdowns smaller than this many seconds"
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
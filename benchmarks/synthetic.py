@@ -0,0 +1,114 @@
+"""Synthetic raw frames laid out like `data/raw` for benchmarking.
+
+Frames follow the naming `FileService.discover_frames` expects:
+    rgb/rgb_frame_<id>_png.rf.<hash>.jpg
+    depth/depth_data_<id>.txt           (grid or sparse 'row,column,depth' triples)
+    annotations/rgb_frame_<id>_png.rf.<hash>.txt
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import List
+
+import cv2
+import numpy as np
+
+DEPTH_FORMATS = ("grid", "triples")
+
+
+def synthetic_depth_mm(height: int, width: int, hole_fraction: float, rng: np.random.Generator) -> np.ndarray:
+    """A tilted floor plane with a few boxes, in millimeters, with holes set to 0.
+
+    Roughly half of the missing pixels form large blobs (occlusions, reflective
+    surfaces) and the rest is speckle noise.
+    """
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    depth = 1500.0 + 2.0 * yy + 0.5 * xx
+    for _ in range(4):
+        y0, x0 = rng.integers(0, height // 2), rng.integers(0, width // 2)
+        h, w = rng.integers(height // 8, height // 3), rng.integers(width // 8, width // 3)
+        depth[y0:y0 + h, x0:x0 + w] -= rng.uniform(200.0, 600.0)
+
+    holes = np.zeros((height, width), dtype=np.uint8)
+    target = int(hole_fraction * height * width)
+    # Large blobs until about half of the target is covered
+    while int(holes.sum()) < target // 2:
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        axes = (int(rng.integers(5, max(6, width // 12))), int(rng.integers(5, max(6, height // 12))))
+        cv2.ellipse(holes, center, axes, float(rng.uniform(0, 180)), 0, 360, 1, -1)
+    speckle = rng.random((height, width)) < max(0.0, hole_fraction - holes.mean())
+    invalid = holes.astype(bool) | speckle
+
+    depth = np.round(depth)
+    depth[invalid] = 0
+    return depth
+
+
+def synthetic_polygons(count: int, vertices: int, rng: np.random.Generator) -> List[np.ndarray]:
+    """Random star-shaped polygons in normalized [0, 1] coordinates."""
+    polygons = []
+    for _ in range(count):
+        center = rng.uniform(0.15, 0.85, size=2)
+        angles = np.sort(rng.uniform(0.0, 2.0 * np.pi, size=vertices))
+        radii = rng.uniform(0.03, 0.15, size=vertices)
+        coords = center + np.stack([np.cos(angles), np.sin(angles)], axis=1) * radii[:, None]
+        polygons.append(np.clip(coords, 0.0, 1.0))
+    return polygons
+
+
+def write_depth_txt(path: Path, depth_mm: np.ndarray, depth_format: str) -> None:
+    if depth_format == "grid":
+        np.savetxt(path, depth_mm, fmt="%d")
+    elif depth_format == "triples":
+        rows, cols = np.nonzero(depth_mm)
+        height, width = depth_mm.shape
+        triples = np.stack([rows, cols, depth_mm[rows, cols].astype(np.int64)], axis=1)
+        header = f"Width: {width}\nHeight: {height}\nrow,column,depth_value"
+        np.savetxt(path, triples, fmt="%d", delimiter=",", header=header, comments="")
+    else:
+        raise ValueError(f"Unsupported depth format: {depth_format}")
+
+
+def generate_frames(
+    root: Path,
+    count: int,
+    width: int = 800,
+    height: int = 600,
+    hole_fraction: float = 0.1,
+    polygons: int = 8,
+    polygon_vertices: int = 40,
+    depth_format: str = "grid",
+    seed: int = 0,
+) -> None:
+    """Write `count` synthetic frames under `root`/{rgb,depth,annotations}.
+
+    Args:
+        root: Output raw directory.
+        count: Number of frames.
+        width: Image width in pixels.
+        height: Image height in pixels.
+        hole_fraction: Approximate fraction of missing depth pixels.
+        polygons: Annotated polygons per frame.
+        polygon_vertices: Vertices per polygon.
+        depth_format: 'grid' or 'triples'.
+        seed: Random seed; identical arguments produce identical files.
+    """
+    rng = np.random.default_rng(seed)
+    for sub in ("rgb", "depth", "annotations"):
+        (root / sub).mkdir(parents=True, exist_ok=True)
+
+    for index in range(count):
+        frame_id = f"bench_{index:06d}"
+        stem = f"rgb_frame_{frame_id}_png.rf.{index:032x}"
+
+        rgb = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (9, 9), 0)
+        cv2.imwrite(str(root / "rgb" / f"{stem}.jpg"), rgb)
+
+        depth_mm = synthetic_depth_mm(height, width, hole_fraction, rng)
+        write_depth_txt(root / "depth" / f"depth_data_{frame_id}.txt", depth_mm, depth_format)
+
+        with open(root / "annotations" / f"{stem}.txt", "w", encoding="utf-8") as f:
+            for polygon in synthetic_polygons(polygons, polygon_vertices, rng):
+                class_id = int(rng.integers(1, 6))
+                f.write(f"{class_id} " + " ".join(f"{v:.6f}" for v in polygon.reshape(-1)) + "\n")
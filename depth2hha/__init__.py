@@ -1,18 +1,25 @@
 from __future__ import annotations
 
-"""Local adapter to third_party Depth2HHA-python.
+"""HHA encoders exposed to `pipeline.hha_service.HHAService`.
 
 Exposes a simple `convert(depth_map_m: np.ndarray, camera_matrix: np.ndarray) -> np.ndarray`
-API expected by `pipeline.hha_service.HHAService`.
+API, and `convert_batch` for (B, H, W) stacks, backed by the built-in vectorized
+implementation in `depth2hha.native`.
+`convert_reference` keeps the adapter to third_party Depth2HHA-python for
+cross-checking results.
 """
 
+from functools import lru_cache
 from pathlib import Path
 import sys
-from typing import Any
+from typing import Any, Optional, Tuple, Union
 
 import numpy as np
 
+from .native import compute_hha, compute_hha_batch
 
+
+@lru_cache(maxsize=None)
 def _import_backend() -> Any:
     root = Path(__file__).resolve().parents[1]
     tp_path = root / "third_party" / "Depth2HHA-python"
@@ -24,7 +31,54 @@ def _import_backend() -> Any:
     return getHHA
 
 
-def convert(depth_map_m: np.ndarray, camera_matrix: np.ndarray) -> np.ndarray:
+def convert(
+    depth_map_m: np.ndarray,
+    camera_matrix: np.ndarray,
+    band_rows: Optional[int] = None,
+    gravity: Optional[np.ndarray] = None,
+    gravity_init: Optional[np.ndarray] = None,
+    return_gravity: bool = False,
+) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+    """Compute an HxWx3 uint8 HHA image (BGR order) with the native engine.
+
+    `band_rows` trades full-frame scratch buffers for band-sized ones. `gravity`
+    skips the per-frame gravity estimate, `gravity_init` warm-starts it and
+    `return_gravity` also returns the direction used (see `native.compute_hha`).
+    """
+    return compute_hha(
+        depth_map_m,
+        camera_matrix,
+        gravity=gravity,
+        band_rows=band_rows,
+        gravity_init=gravity_init,
+        return_gravity=return_gravity,
+    )
+
+
+def convert_batch(
+    depth_maps_m: np.ndarray,
+    camera_matrix: np.ndarray,
+    band_rows: Optional[int] = None,
+    gravity: Optional[np.ndarray] = None,
+    gravity_init: Optional[np.ndarray] = None,
+    return_gravity: bool = False,
+) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+    """Compute (B, H, W, 3) uint8 HHA images for a (B, H, W) stack of depth maps.
+
+    Options are as for `convert`; `gravity`/`gravity_init` may also hold one vector
+    per frame (see `native.compute_hha_batch`).
+    """
+    return compute_hha_batch(
+        depth_maps_m,
+        camera_matrix,
+        gravity=gravity,
+        band_rows=band_rows,
+        gravity_init=gravity_init,
+        return_gravity=return_gravity,
+    )
+
+
+def convert_reference(depth_map_m: np.ndarray, camera_matrix: np.ndarray) -> np.ndarray:
     backend = _import_backend()
     # RD (raw depth) can be same as D when not available
     D = depth_map_m.astype(np.float32)
@@ -34,5 +88,3 @@ def convert(depth_map_m: np.ndarray, camera_matrix: np.ndarray) -> np.ndarray:
     # The backend returns HHA as 3-channel uint8 BGR suitable for saving/displaying.
     # Our pipeline expects a float32 array; keep uint8 here and let caller scale if needed.
     return hha_bgr_u8
-
-
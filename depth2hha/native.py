@@ -0,0 +1,436 @@
+from __future__ import annotations
+
+"""Vectorized HHA encoder following Gupta et al. (ECCV 2014).
+
+Numerically mirrors the third_party Depth2HHA-python `getHHA` reference:
+  - Normals come from a local least-squares plane fit in inverse depth, solved for
+    every pixel at once from box-filtered moment images (unnormalized box filter,
+    i.e. integral-image sums over a (2r+1)x(2r+1) window).
+  - Gravity is estimated with the same alternating "walls vs floors" scheme
+    (45 deg, then 15 deg thresholds), each step being a weighted 3x3 least-squares
+    problem solved in closed form by `eigh`.
+  - Height is measured along the gravity direction directly, so the point cloud is
+    never rotated.
+
+Per-(intrinsics, shape) ray grids are cached, so back-projection is a multiply.
+Full-size moment and window-sum buffers are reused across frames of the same
+shape (per thread), and the per-pixel solves run over blocks of rows so their
+temporaries stay cache-sized. With `band_rows` the moments and window sums are
+instead computed band by band (with a halo of `radius` rows), which cuts their
+footprint from 2 x 9 full-frame float64 planes to two band-sized ones; box sums
+then accumulate from a different starting row, so results may differ from the
+full-frame path by floating-point rounding.
+
+Missing pixels (depth <= 0 or non-finite) are excluded from all fits and encode as
+0 in the disparity and height channels.
+"""
+
+from functools import lru_cache
+import threading
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+# Window radii used by the reference: small support for the encoded angle,
+# large support for the (smoother) normals used to estimate gravity.
+ANGLE_NORMAL_RADIUS = 3
+GRAVITY_NORMAL_RADIUS = 10
+# The gravity fit sums over all normals, so solving for every second pixel of the
+# heavily overlapping 21x21 windows changes it negligibly at a quarter of the cost.
+GRAVITY_NORMAL_STRIDE = 2
+# (angle threshold in degrees, iterations) for each gravity refinement stage
+GRAVITY_SCHEDULE: Tuple[Tuple[float, int], ...] = ((45.0, 5), (15.0, 5))
+# Warm starts from a nearby estimate skip the coarse stage
+WARM_GRAVITY_SCHEDULE = GRAVITY_SCHEDULE[-1:]
+# Rows processed together by the per-pixel solve/encode loops
+BLOCK_ROWS = 32
+
+_workspaces = threading.local()
+
+
+@lru_cache(maxsize=16)
+def _ray_grid(intrinsics: Tuple[float, float, float, float], shape: Tuple[int, int]) -> Tuple[np.ndarray, ...]:
+    """Return per-pixel ray slopes and their products for (fx, fy, cx, cy) and (H, W).
+
+    Pixel coordinates are 1-based to match the MATLAB-derived reference.
+    """
+    fx, fy, cx, cy = intrinsics
+    height, width = shape
+    u_row = (np.arange(1, width + 1, dtype=np.float64) - cx) / fx
+    v_col = (np.arange(1, height + 1, dtype=np.float64) - cy) / fy
+    u = np.ascontiguousarray(np.broadcast_to(u_row[None, :], shape))
+    v = np.ascontiguousarray(np.broadcast_to(v_col[:, None], shape))
+    grids = (u, v, u * u, u * v, v * v)
+    for g in grids:
+        g.setflags(write=False)
+    return grids
+
+
+def _intrinsics_key(camera_matrix: np.ndarray) -> Tuple[float, float, float, float]:
+    K = np.asarray(camera_matrix, dtype=np.float64)
+    return (float(K[0, 0]), float(K[1, 1]), float(K[0, 2]), float(K[1, 2]))
+
+
+def _workspace(shape: Tuple[int, int], name: str = "frame", min_rows: bool = False) -> Dict[str, np.ndarray]:
+    """Per-thread scratch buffers for one (frame or band) shape, reused across calls.
+
+    With `min_rows` any buffer with at least shape[0] rows (and the same width) is
+    reused; callers then slice the rows they need.
+    """
+    ws = getattr(_workspaces, name, None)
+    if ws is not None and min_rows:
+        rows, width = ws["moments"].shape[1:]
+        if rows >= shape[0] and width == shape[1]:
+            return ws
+    if ws is None or ws["moments"].shape[1:] != shape:
+        ws = {
+            "moments": np.empty((9,) + shape, dtype=np.float64),
+            "sums": np.empty((9,) + shape, dtype=np.float64),
+        }
+        setattr(_workspaces, name, ws)
+    return ws
+
+
+def _row_blocks(height: int, rows: int = BLOCK_ROWS) -> Iterator[slice]:
+    for start in range(0, height, rows):
+        yield slice(start, min(start + rows, height))
+
+
+def moment_images(
+    z_cm: np.ndarray,
+    valid: np.ndarray,
+    rays: Tuple[np.ndarray, ...],
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Stack the per-pixel terms of the inverse-depth plane fit into a (9, H, W) array.
+
+    Fitting n . (X/Z, Y/Z, 1) = 1/Z over a window only needs window sums of
+    u^2, uv, u, v^2, v, 1 (the normal matrix) and u/Z, v/Z, 1/Z (the right-hand
+    side), where (u, v) are the ray slopes; missing pixels contribute zeros.
+    """
+    u, v, uu, uv, vv = rays
+    moments = np.empty((9,) + z_cm.shape, dtype=np.float64) if out is None else out
+    w = moments[5]
+    w[...] = valid
+    for i, ray_term in enumerate((uu, uv, u, vv, v)):
+        np.multiply(ray_term, w, out=moments[i])
+    inv_z = moments[8]
+    inv_z.fill(0.0)
+    np.divide(1.0, z_cm, out=inv_z, where=valid)
+    np.multiply(u, inv_z, out=moments[6])
+    np.multiply(v, inv_z, out=moments[7])
+    return moments
+
+
+def window_sums(moments: np.ndarray, radius: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Unnormalized (2r+1)x(2r+1) box sums of each moment plane (reflect-101 borders)."""
+    size = 2 * radius + 1
+    sums = np.empty_like(moments) if out is None else out
+    for i in range(moments.shape[0]):
+        cv2.boxFilter(
+            moments[i], -1, (size, size), dst=sums[i], normalize=False, borderType=cv2.BORDER_REFLECT_101
+        )
+    return sums
+
+
+def solve_normals(
+    sums: np.ndarray,
+    z_cm: np.ndarray,
+    rays: Tuple[np.ndarray, ...],
+    stride: int = 1,
+) -> np.ndarray:
+    """Solve the per-pixel plane fits from window sums into (3, H', W') unit normals.
+
+    With `stride > 1` only every `stride`-th pixel in each direction is solved.
+    Windows with fewer than three valid pixels (or a singular system) yield NaN.
+    """
+    step = (slice(None, None, stride), slice(None, None, stride))
+    sums = sums[(slice(None),) + step]
+    z_cm = z_cm[step]
+    u, v = rays[0][step], rays[1][step]
+    normals = np.empty((3,) + z_cm.shape, dtype=np.float64)
+    for rows in _row_blocks(z_cm.shape[0]):
+        _solve_block(sums[:, rows], z_cm[rows], u[rows], v[rows], normals[:, rows])
+    return normals
+
+
+def _solve_block(
+    sums: np.ndarray,
+    z_cm: np.ndarray,
+    u: np.ndarray,
+    v: np.ndarray,
+    out: np.ndarray,
+) -> None:
+    a, b, c, d, e, f, bx, by, bz = sums
+
+    # Solve the symmetric 3x3 system [[a b c], [b d e], [c e f]] n = (bx, by, bz)
+    # through its adjugate; the determinant only matters for its sign since n is
+    # normalized afterwards.
+    adj11 = d * f - e * e
+    adj12 = c * e - b * f
+    adj13 = b * e - c * d
+    adj22 = a * f - c * c
+    adj23 = b * c - a * e
+    adj33 = a * d - b * b
+    det = a * adj11 + b * adj12 + c * adj13
+
+    nx = adj11 * bx + adj12 * by + adj13 * bz
+    ny = adj12 * bx + adj22 * by + adj23 * bz
+    nz = adj13 * bx + adj23 * by + adj33 * bz
+
+    # Reorient as the reference does: first towards +z, then consistently with
+    # the viewing ray (X, Y, Z) = Z * (u, v, 1) of the unmasked point cloud.
+    sign = np.sign(det)
+    sign_z = np.sign(nz * sign)
+    sign_z[sign_z == 0] = 1
+    sign *= sign_z
+    sign_view = np.sign(z_cm * (nx * u + ny * v + nz) * sign)
+    sign_view[sign_view == 0] = 1
+    sign *= sign_view
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = sign / np.sqrt(nx * nx + ny * ny + nz * nz)
+    scale[(f < 2.5) | (det == 0)] = np.nan
+    np.multiply(nx, scale, out=out[0])
+    np.multiply(ny, scale, out=out[1])
+    np.multiply(nz, scale, out=out[2])
+
+
+def banded_normals(
+    z_cm: np.ndarray,
+    valid: np.ndarray,
+    rays: Tuple[np.ndarray, ...],
+    radius: int,
+    stride: int = 1,
+    band_rows: int = 64,
+) -> np.ndarray:
+    """`window_sums` + `solve_normals` over bands of rows, with band-sized buffers.
+
+    Each band is extended by `radius` rows on both sides so its window sums see the
+    same neighbours as a full-frame pass; only the image's own top and bottom rows
+    use reflected borders.
+    """
+    height, width = z_cm.shape
+    band_rows = max(stride, band_rows - band_rows % stride)
+    normals = np.empty((3, -(-height // stride), -(-width // stride)), dtype=np.float64)
+    ws = _workspace((min(height, band_rows + 2 * radius), width), name="band", min_rows=True)
+    for start in range(0, height, band_rows):
+        stop = min(start + band_rows, height)
+        slab = slice(max(0, start - radius), min(height, stop + radius))
+        rows = slab.stop - slab.start
+        moments = moment_images(
+            z_cm[slab], valid[slab], tuple(g[slab] for g in rays), out=ws["moments"][:, :rows]
+        )
+        sums = window_sums(moments, radius, out=ws["sums"][:, :rows])
+        inner = slice(start - slab.start, stop - slab.start)
+        band = solve_normals(sums[:, inner], z_cm[start:stop], tuple(g[start:stop] for g in rays), stride)
+        normals[:, start // stride:start // stride + band.shape[1]] = band
+    return normals
+
+
+def compute_normals(
+    z_cm: np.ndarray,
+    valid: np.ndarray,
+    camera_matrix: np.ndarray,
+    radius: int,
+    stride: int = 1,
+) -> np.ndarray:
+    """Estimate (3, H, W) unit normals of a depth map in cm from a (2r+1)^2 window."""
+    rays = _ray_grid(_intrinsics_key(camera_matrix), z_cm.shape)
+    sums = window_sums(moment_images(z_cm, valid, rays), radius)
+    return solve_normals(sums, z_cm, rays, stride=stride)
+
+
+def estimate_gravity(
+    normals: np.ndarray,
+    init: Optional[np.ndarray] = None,
+    schedule: Tuple[Tuple[float, int], ...] = GRAVITY_SCHEDULE,
+) -> np.ndarray:
+    """Estimate the gravity (up) direction in camera coordinates from (3, H, W) normals.
+
+    At each step, normals nearly parallel to the current estimate are treated as
+    floor-like and normals nearly perpendicular as wall-like; the new estimate is
+    the direction most parallel to the former and orthogonal to the latter, i.e.
+    the smallest-eigenvalue eigenvector of sum(walls n n^T) - sum(floors n n^T).
+    """
+    nn = normals.reshape(3, -1)
+    nn = nn[:, np.isfinite(nn).all(axis=0)].astype(np.float32)
+    y_dir = np.array([0.0, 1.0, 0.0]) if init is None else np.asarray(init, dtype=np.float64)
+    if nn.shape[1] == 0:
+        return y_dir
+
+    for thresh_deg, iterations in schedule:
+        cos_t = np.cos(np.deg2rad(thresh_deg))
+        sin_t = np.sin(np.deg2rad(thresh_deg))
+        prev_weights = None
+        for _ in range(int(iterations)):
+            sim = np.abs(y_dir.astype(np.float32) @ nn)
+            weights = (sim < sin_t).astype(np.float32) - (sim > cos_t)
+            # Same partition as the previous step -> same system -> same answer
+            if prev_weights is not None and np.array_equal(weights, prev_weights):
+                break
+            prev_weights = weights
+            A = ((nn * weights) @ nn.T).astype(np.float64)
+            _, vecs = np.linalg.eigh(A)
+            new_dir = vecs[:, 0]
+            y_dir = new_dir * (np.sign(new_dir[1]) or 1.0)
+    return y_dir
+
+
+def compute_hha(
+    depth_map_m: np.ndarray,
+    camera_matrix: np.ndarray,
+    gravity: Optional[np.ndarray] = None,
+    band_rows: Optional[int] = None,
+    gravity_init: Optional[np.ndarray] = None,
+    return_gravity: bool = False,
+    out: Optional[np.ndarray] = None,
+) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+    """Encode a metric depth map as an HxWx3 uint8 HHA image in BGR channel order.
+
+    Channels (B, G, R) = (angle with gravity + 38, height above lowest point in cm,
+    31000 / depth in cm), rounded and saturated to [0, 255] like the reference.
+
+    Args:
+        depth_map_m: Depth in meters (2D); values <= 0 or non-finite are missing.
+        camera_matrix: 3x3 pinhole intrinsics of the depth map.
+        gravity: Optional unit up-vector in camera coordinates; estimated from the
+            frame when omitted.
+        band_rows: When set, compute normals band by band (see `banded_normals`) to
+            bound scratch memory instead of using full-frame buffers.
+        gravity_init: Warm start for the estimate (ignored with `gravity`): only the
+            fine refinement stage runs, starting from this direction.
+        return_gravity: Also return the gravity direction that was used.
+        out: Optional HxWx3 uint8 array to write the HHA image into.
+
+    Returns:
+        The HHA image, or (HHA image, gravity) with `return_gravity`.
+    """
+    z_cm = np.multiply(depth_map_m, 100.0, dtype=np.float64)
+    valid = np.isfinite(z_cm) & (z_cm > 0)
+    z_cm[~valid] = 0.0
+    rays = _ray_grid(_intrinsics_key(camera_matrix), z_cm.shape)
+
+    schedule = GRAVITY_SCHEDULE if gravity_init is None else WARM_GRAVITY_SCHEDULE
+    if band_rows is not None:
+        if gravity is None:
+            gravity = estimate_gravity(
+                banded_normals(z_cm, valid, rays, GRAVITY_NORMAL_RADIUS, GRAVITY_NORMAL_STRIDE, band_rows),
+                init=gravity_init,
+                schedule=schedule,
+            )
+        normals = banded_normals(z_cm, valid, rays, ANGLE_NORMAL_RADIUS, 1, band_rows)
+    else:
+        ws = _workspace(z_cm.shape)
+        moments = moment_images(z_cm, valid, rays, out=ws["moments"])
+        if gravity is None:
+            sums = window_sums(moments, GRAVITY_NORMAL_RADIUS, out=ws["sums"])
+            gravity = estimate_gravity(
+                solve_normals(sums, z_cm, rays, stride=GRAVITY_NORMAL_STRIDE), init=gravity_init, schedule=schedule
+            )
+        sums = window_sums(moments, ANGLE_NORMAL_RADIUS, out=ws["sums"])
+        normals = solve_normals(sums, z_cm, rays)
+
+    gravity = np.asarray(gravity, dtype=np.float64)
+    hha = encode_hha(z_cm, valid, rays, normals, gravity, out=out)
+    return (hha, gravity) if return_gravity else hha
+
+
+def compute_hha_batch(
+    depth_maps_m: np.ndarray,
+    camera_matrix: np.ndarray,
+    gravity: Optional[np.ndarray] = None,
+    band_rows: Optional[int] = None,
+    gravity_init: Optional[np.ndarray] = None,
+    return_gravity: bool = False,
+) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+    """Encode a (B, H, W) stack of depth maps sharing one camera matrix.
+
+    Every frame is already vectorized over its pixels, so frames are processed in
+    turn: they share the cached ray grid and scratch workspace and are encoded
+    straight into one (B, H, W, 3) output. Stacking the moment planes of several
+    frames instead would multiply scratch memory without saving any work.
+
+    `gravity` and `gravity_init` are either one vector for all frames or one per
+    frame, shape (B, 3); with `return_gravity` the (B, 3) gravity vectors used are
+    returned as well. Results equal per-frame `compute_hha` calls.
+    """
+    depth_maps_m = np.asarray(depth_maps_m)
+    if depth_maps_m.ndim != 3:
+        raise ValueError("depth_maps_m must be a (B, H, W) stack")
+    count = depth_maps_m.shape[0]
+    gravities = _per_frame_vectors(gravity, count)
+    inits = _per_frame_vectors(gravity_init, count)
+
+    hha = np.empty(depth_maps_m.shape + (3,), dtype=np.uint8)
+    used = np.empty((count, 3), dtype=np.float64)
+    for index in range(count):
+        _, used[index] = compute_hha(
+            depth_maps_m[index],
+            camera_matrix,
+            gravity=gravities[index],
+            band_rows=band_rows,
+            gravity_init=inits[index],
+            return_gravity=True,
+            out=hha[index],
+        )
+    return (hha, used) if return_gravity else hha
+
+
+def _per_frame_vectors(vectors: Optional[np.ndarray], count: int) -> list:
+    if vectors is None:
+        return [None] * count
+    vectors = np.asarray(vectors, dtype=np.float64)
+    if vectors.ndim == 1:
+        return [vectors] * count
+    if vectors.shape != (count, 3):
+        raise ValueError(f"Expected one 3-vector or ({count}, 3) vectors, got shape {vectors.shape}")
+    return list(vectors)
+
+
+def encode_hha(
+    z_cm: np.ndarray,
+    valid: np.ndarray,
+    rays: Tuple[np.ndarray, ...],
+    normals: np.ndarray,
+    gravity: np.ndarray,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Pack disparity, height and angle into the reference's uint8 BGR layout (into `out` if given)."""
+    u, v = rays[0], rays[1]
+    gx, gy, gz = (float(g) for g in gravity)
+
+    def height_along_gravity(rows: slice) -> np.ndarray:
+        # Height above the camera along gravity (cm)
+        return -z_cm[rows] * (u[rows] * gx + v[rows] * gy + gz)
+
+    # Heights are measured from the lowest observed point; recomputing them per row
+    # block in both passes avoids full-frame temporaries.
+    y_min = np.inf
+    for rows in _row_blocks(z_cm.shape[0]):
+        block_valid = valid[rows]
+        if block_valid.any():
+            y_min = min(y_min, float(height_along_gravity(rows)[block_valid].min()))
+    if not np.isfinite(y_min):
+        y_min = 0.0
+    if y_min > -90:
+        y_min = -130.0
+
+    hha = np.empty(z_cm.shape + (3,), dtype=np.uint8) if out is None else out
+    for rows in _row_blocks(z_cm.shape[0]):
+        nx, ny, nz = normals[:, rows]
+        cos_angle = np.clip(nx * gx + ny * gy + nz * gz, -1.0, 1.0)
+        angle = np.degrees(np.arccos(cos_angle))
+        angle[np.isnan(angle)] = 180.0
+        block_valid = valid[rows]
+        disparity = 31000.0 / np.maximum(z_cm[rows], 100.0)
+
+        hha[rows, :, 0] = _to_u8(angle + 128.0 - 90.0)
+        hha[rows, :, 1] = _to_u8(np.where(block_valid, height_along_gravity(rows) - y_min, 0.0))
+        hha[rows, :, 2] = _to_u8(np.where(block_valid, disparity, 0.0))
+    return hha
+
+
+def _to_u8(channel: np.ndarray) -> np.ndarray:
+    return np.clip(np.rint(channel), 0, 255).astype(np.uint8)
@@ -1,41 +1,175 @@
 from __future__ import annotations
 
 import argparse
+import importlib
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
 
-from pipeline.config_service import ConfigService
-from pipeline.file_service import FileService
-from pipeline.inpainting_service import InpaintingService
-from pipeline.annotation_service import AnnotationService
-from pipeline.augmentation_service import AugmentationService
-from pipeline.hha_service import HHAService
-from pipeline.pipeline_orchestrator import PipelineOrchestrator
+_STARTED = time.perf_counter()
+
+# Everything a run imports before its first frame, dependencies first so that each
+# row of the start-up report only counts what it adds on top of the previous ones
+STARTUP_MODULES = (
+    "numpy",
+    "cv2",
+    "pydantic",
+    "yaml",
+    "tqdm",
+    "pipeline.data_models",
+    "pipeline.config_service",
+    "pipeline.file_service",
+    "pipeline.inpainting_service",
+    "pipeline.annotation_service",
+    "pipeline.augmentation_service",
+    "pipeline.hha_service",
+    "pipeline.pipeline_orchestrator",
+    "depth2hha",
+)
+# Imported by the stage that first needs them, not at start-up
+DEFERRED_MODULES = ("scipy.interpolate", "scipy.spatial", "albumentations")
+DEFAULT_STARTUP_BUDGET_S = 0.5
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="RGB/Depth -> HHA data preparation pipeline")
-    parser.add_argument("--config", required=True, help="Path to YAML config file")
-    return parser.parse_args()
+    parser.add_argument("--config", help="Path to YAML config file")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (overrides execution.workers from config)",
+    )
+    parser.add_argument(
+        "--resume",
+        metavar="RUN_DIR",
+        default=None,
+        help="Continue an interrupted run in RUN_DIR, skipping frames its journal lists as done",
+    )
+    parser.add_argument(
+        "--shard-index",
+        type=int,
+        default=None,
+        help="Process only this shard of the frames (overrides execution.shard_index)",
+    )
+    parser.add_argument(
+        "--num-shards",
+        type=int,
+        default=None,
+        help="Split the frames into this many shards by a stable hash of their names (overrides execution.num_shards)",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Report import and set-up times instead of running, exit 1 if over --startup-budget",
+    )
+    parser.add_argument(
+        "--startup-budget",
+        type=float,
+        default=DEFAULT_STARTUP_BUDGET_S,
+        help=f"Start-up time budget in seconds for --profile-startup (default: {DEFAULT_STARTUP_BUDGET_S})",
+    )
+    args = parser.parse_args()
+    if args.config is None and not args.profile_startup:
+        parser.error("--config is required")
+    return args
+
+
+def _timed_imports(modules: Sequence[str]) -> List[Tuple[str, float]]:
+    """Import `modules` in order; each time covers only what was not imported yet."""
+    timings = []
+    for name in modules:
+        start = time.perf_counter()
+        importlib.import_module(name)
+        timings.append((name, time.perf_counter() - start))
+    return timings
+
+
+def profile_startup(config_path: Optional[str], budget_s: float) -> int:
+    """Print where start-up time goes and check it against `budget_s`.
+
+    Measured from the start of this script, so interpreter start-up is not included;
+    `python -X importtime main.py --profile-startup` gives the per-module detail.
+
+    Returns:
+        int: Exit status, 1 when start-up exceeded the budget.
+    """
+    rows = _timed_imports(STARTUP_MODULES)
+    if config_path is not None:
+        from pipeline.config_service import ConfigService
+
+        start = time.perf_counter()
+        ConfigService().load_config(config_path)
+        rows.append(("(load config)", time.perf_counter() - start))
+        start = time.perf_counter()
+        _build_services()
+        rows.append(("(build services)", time.perf_counter() - start))
+    total = time.perf_counter() - _STARTED
+
+    print("Start-up (until the first frame):")
+    for name, seconds in rows:
+        print(f"  {name:<34} {seconds * 1000:8.1f} ms")
+    print(f"  {'total':<34} {total * 1000:8.1f} ms  (budget {budget_s * 1000:.0f} ms)")
+    print("Deferred to first use:")
+    for name, seconds in _timed_imports(DEFERRED_MODULES):
+        print(f"  {name:<34} {seconds * 1000:8.1f} ms")
+
+    if total > budget_s:
+        print(f"Start-up exceeded the budget by {(total - budget_s) * 1000:.0f} ms")
+        return 1
+    return 0
+
+
+def _build_services() -> dict:
+    # Pipeline modules are imported only once the arguments are known to be valid
+    from pipeline.annotation_service import AnnotationService
+    from pipeline.augmentation_service import AugmentationService
+    from pipeline.file_service import FileService
+    from pipeline.hha_service import HHAService
+    from pipeline.inpainting_service import InpaintingService
+
+    return {
+        "file_service": FileService(),
+        "inpainting_service": InpaintingService(),
+        "annotation_service": AnnotationService(),
+        "augmentation_service": AugmentationService(),
+        "hha_service": HHAService(),
+    }
 
 
 def main() -> None:
     args = parse_args()
+    if args.profile_startup:
+        sys.exit(profile_startup(args.config, args.startup_budget))
+
+    from pipeline.config_service import ConfigService
+    from pipeline.journal_service import ResumeMismatchError
+    from pipeline.pipeline_orchestrator import PipelineOrchestrator
 
     cfg_service = ConfigService()
     config = cfg_service.load_config(args.config)
+    if args.workers is not None:
+        config.execution.workers = max(1, args.workers)
+    if args.num_shards is not None:
+        config.execution.num_shards = args.num_shards
+    if args.shard_index is not None:
+        config.execution.shard_index = args.shard_index
+    if not 0 <= config.execution.shard_index < config.execution.num_shards:
+        sys.exit(f"Shard index {config.execution.shard_index} is out of range for {config.execution.num_shards} shard(s)")
 
-    orchestrator = PipelineOrchestrator(
-        config=config,
-        file_service=FileService(),
-        inpainting_service=InpaintingService(),
-        annotation_service=AnnotationService(),
-        augmentation_service=AugmentationService(),
-        hha_service=HHAService(),
-    )
-    orchestrator.run_full_pipeline()
+    run_dir = None
+    if args.resume is not None:
+        run_dir = Path(args.resume)
+        if not run_dir.is_dir():
+            sys.exit(f"Run directory to resume does not exist: {run_dir}")
+
+    orchestrator = PipelineOrchestrator(config=config, run_dir=run_dir, **_build_services())
+    try:
+        orchestrator.run_full_pipeline()
+    except ResumeMismatchError as exc:
+        sys.exit(str(exc))
 
 
 if __name__ == "__main__":
     main()
-
-
-
@@ -1,10 +1,15 @@
 from __future__ import annotations
 
-from typing import List, Tuple
+from itertools import chain
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple, Union
 
 import cv2
 import numpy as np
 
+# Upper bound on polygons considered together when grouping fillPoly calls
+_MAX_BATCHED_POLYGONS = 2048
+
 
 class AnnotationService:
     """Converts polygon annotations into a single-channel mask image.
@@ -14,9 +19,55 @@ class AnnotationService:
     an array-like of shape (N, 2) with (x, y) vertex coordinates.
     """
 
+    @staticmethod
+    def parse_polygons(text: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Parse YOLO-style '<class_id> x1 y1 x2 y2 ...' lines in bulk.
+
+        All numbers of the file are converted by one NumPy call; blank lines and
+        lines with an odd number of coordinates are skipped.
+
+        Returns:
+            Tuple of (class_ids (N,) int32, offsets (N + 1,) int64, coords (M, 2) float32);
+            polygon i has vertices coords[offsets[i]:offsets[i + 1]].
+        """
+        rows = [line.split() for line in text.splitlines()]
+        rows = [row for row in rows if row and len(row) % 2 == 1]
+        if not rows:
+            return np.zeros(0, dtype=np.int32), np.zeros(1, dtype=np.int64), np.zeros((0, 2), dtype=np.float32)
+
+        lengths = np.fromiter((len(row) for row in rows), dtype=np.int64, count=len(rows))
+        values = np.array(list(chain.from_iterable(rows)), dtype=np.float64)
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        class_ids = values[starts].astype(np.int32)
+
+        is_coord = np.ones(len(values), dtype=bool)
+        is_coord[starts] = False
+        coords = values[is_coord].astype(np.float32).reshape(-1, 2)
+        offsets = np.concatenate(([0], np.cumsum((lengths - 1) // 2)))
+        return class_ids, offsets, coords
+
+    @classmethod
+    def read_polygons(cls, path: Union[str, Path]) -> List[Tuple[int, np.ndarray]]:
+        """Read an annotation file into (class_id, (K, 2) vertices) tuples.
+
+        The vertex arrays are views into one flat coordinate array.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            class_ids, offsets, coords = cls.parse_polygons(f.read())
+        return [
+            (int(class_id), coords[start:stop])
+            for class_id, start, stop in zip(class_ids, offsets[:-1], offsets[1:])
+        ]
+
     def convert_polygons_to_mask(self, polygons: List[Tuple[int, np.ndarray]], shape: Tuple[int, int]) -> np.ndarray:
         """Rasterize normalized polygons into an integer mask.
 
+        Later polygons are painted over earlier ones. Polygons are drawn in batches
+        (one `cv2.fillPoly` call each) of the same class whose bounding boxes do not
+        overlap each other or anything drawn between them; fillPoly fills several
+        contours with the even-odd rule, so overlapping polygons must stay in
+        separate calls to keep both the union and the z-order.
+
         Args:
             polygons: List of (class_id, vertices) where vertices are normalized.
             shape: Target mask shape as (height, width).
@@ -27,16 +78,89 @@ class AnnotationService:
         height, width = int(shape[0]), int(shape[1])
         mask = np.zeros((height, width), dtype=np.uint8)
 
-        for class_id, coords in polygons:
-            if coords is None:
-                continue
-            vertices = np.asarray(coords, dtype=np.float32).reshape(-1, 2)
-            xs = np.clip(np.round(vertices[:, 0] * (width - 1)), 0, width - 1).astype(np.int32)
-            ys = np.clip(np.round(vertices[:, 1] * (height - 1)), 0, height - 1).astype(np.int32)
-            pts = np.stack([xs, ys], axis=1).reshape(-1, 1, 2)
-            cv2.fillPoly(mask, [pts], int(class_id))
+        polygons = [(class_id, coords) for class_id, coords in polygons if coords is not None]
+        if not polygons:
+            return mask
+
+        # Convert all vertices to pixel coordinates at once
+        vertices = [np.asarray(coords, dtype=np.float32).reshape(-1, 2) for _, coords in polygons]
+        counts = np.fromiter((len(v) for v in vertices), dtype=np.int64, count=len(vertices))
+        flat = np.concatenate(vertices)
+        pts = np.empty(flat.shape, dtype=np.int32)
+        pts[:, 0] = np.clip(np.round(flat[:, 0] * (width - 1)), 0, width - 1)
+        pts[:, 1] = np.clip(np.round(flat[:, 1] * (height - 1)), 0, height - 1)
+        contours = np.split(pts.reshape(-1, 1, 2), np.cumsum(counts)[:-1])
+
+        class_ids = [int(class_id) for class_id, _ in polygons]
+        # The overlap test is quadratic in memory, so very large files are batched in consecutive chunks
+        for start in range(0, len(contours), _MAX_BATCHED_POLYGONS):
+            stop = start + _MAX_BATCHED_POLYGONS
+            chunk = contours[start:stop]
+            for class_id, members in self._fill_batches(class_ids[start:stop], chunk, counts[start:stop]):
+                cv2.fillPoly(mask, [chunk[i] for i in members], class_id)
 
         return mask
 
+    @staticmethod
+    def _fill_batches(
+        class_ids: List[int], contours: List[np.ndarray], counts: np.ndarray
+    ) -> List[Tuple[int, List[int]]]:
+        """Group polygon indices into ordered (class_id, members) fill calls.
+
+        A polygon joins the latest batch of its class only if its bounding box is
+        disjoint from every polygon in that batch and in all batches opened after
+        it; otherwise it opens a new batch. Drawing the batches in order is then
+        pixel-identical to drawing the polygons one by one.
+        """
+        boxes = np.zeros((len(contours), 4), dtype=np.int32)
+        boxes[:, :2] = 1  # polygons without vertices get an empty box that never overlaps
+        drawn = counts > 0
+        if drawn.any():
+            pts = np.concatenate(contours).reshape(-1, 2)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[drawn]
+            boxes[drawn, :2] = np.minimum.reduceat(pts, starts)
+            boxes[drawn, 2:] = np.maximum.reduceat(pts, starts)
+
+        # Earlier polygons whose bounding box intersects each polygon's box
+        overlap = (
+            (boxes[:, None, 0] <= boxes[None, :, 2])
+            & (boxes[None, :, 0] <= boxes[:, None, 2])
+            & (boxes[:, None, 1] <= boxes[None, :, 3])
+            & (boxes[None, :, 1] <= boxes[:, None, 3])
+        )
+        rows, cols = np.nonzero(np.tril(overlap, k=-1))
+        split_at = np.cumsum(np.bincount(rows, minlength=len(contours)))[:-1]
+        earlier = [group.tolist() for group in np.split(cols, split_at)]
+
+        batches: List[Tuple[int, List[int]]] = []
+        batch_of: List[int] = []
+        latest_by_class: Dict[int, int] = {}
+        for i, class_id in enumerate(class_ids):
+            target = latest_by_class.get(class_id)
+            if target is None or any(batch_of[j] >= target for j in earlier[i]):
+                target = len(batches)
+                batches.append((class_id, []))
+                latest_by_class[class_id] = target
+            batches[target][1].append(i)
+            batch_of.append(target)
+        return batches
 
+    def convert_directory(
+        self,
+        annotation_dir: Union[str, Path],
+        shape: Union[Tuple[int, int], Callable[[Path], Tuple[int, int]]],
+        pattern: str = "*.txt",
+    ) -> Iterator[Tuple[Path, np.ndarray]]:
+        """Lazily rasterize every annotation file in a directory.
 
+        Args:
+            annotation_dir: Directory with annotation .txt files.
+            shape: Mask (height, width), or a callable returning it for an annotation path.
+            pattern: Glob pattern selecting the annotation files.
+
+        Yields:
+            (annotation path, uint8 mask) pairs in sorted path order.
+        """
+        for path in sorted(Path(annotation_dir).glob(pattern)):
+            mask_shape = shape(path) if callable(shape) else shape
+            yield path, self.convert_polygons_to_mask(self.read_polygons(path), mask_shape)
@@ -1,17 +1,26 @@
 from __future__ import annotations
 
 import random
-from typing import Dict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
-import albumentations as A
 import cv2
 import numpy as np
 
 from .data_models import PipelineConfig
 
+if TYPE_CHECKING:
+    import albumentations as A
+
 
 class AugmentationService:
-    """Synchronous geometric augmentations for RGB, depth and mask using Albumentations."""
+    """Synchronous geometric augmentations for RGB, depth and mask using Albumentations.
+
+    The composed transform is built once per distinct augmentation config and reused;
+    randomness comes from the global RNGs that are re-seeded on every call.
+    """
+
+    def __init__(self) -> None:
+        self._pipelines: Dict[tuple, A.Compose] = {}
 
     def apply(
         self,
@@ -19,18 +28,95 @@ class AugmentationService:
         depth: np.ndarray,
         mask: np.ndarray,
         config: PipelineConfig.AugmentationConfig,
+        seed: Optional[int] = None,
+        extra_images: Optional[Dict[str, np.ndarray]] = None,
     ) -> Dict[str, np.ndarray]:
         """Apply the configured augmentations synchronously.
 
-        Returns a dict with keys: 'rgb', 'depth', 'mask'.
+        Args:
+            rgb: HxWx3 image.
+            depth: HxW depth map.
+            mask: HxW label mask (nearest-neighbour resampling).
+            config: Augmentation settings.
+            seed: Overrides `config.seed`, e.g. to draw a different sample per epoch.
+            extra_images: Further HxW(xC) images (e.g. 'hha') warped like `rgb`.
+
+        Returns:
+            Dict[str, np.ndarray]: 'rgb', 'depth', 'mask' and the keys of `extra_images`.
         """
+        extra_images = extra_images or {}
         if not config.enabled:
-            return {"rgb": rgb, "depth": depth, "mask": mask}
+            return {"rgb": rgb, "depth": depth, "mask": mask, **extra_images}
 
         # Determinism
+        seed = config.seed if seed is None else seed
+        random.seed(seed)
+        np.random.seed(seed)
+
+        pipeline = self._get_pipeline(config, extra_targets=tuple(sorted(extra_images)))
+        result = pipeline(image=rgb, depth=depth, mask=mask, **extra_images)
+        return {
+            "rgb": result["image"],
+            "depth": result["depth"],
+            "mask": result["mask"],
+            **{name: result[name] for name in extra_images},
+        }
+
+    def apply_variants(
+        self,
+        rgb: np.ndarray,
+        depth: np.ndarray,
+        mask: np.ndarray,
+        config: PipelineConfig.AugmentationConfig,
+        with_camera_rotation: bool = False,
+    ) -> List[Dict[str, np.ndarray]]:
+        """Draw `config.variants_per_frame` augmented samples from one set of inputs.
+
+        The RNGs are seeded once and the samples are drawn in sequence, so the first
+        variant equals what `apply` returns. With augmentation disabled a single,
+        unmodified sample is returned.
+
+        With `with_camera_rotation`, every sample also carries 'camera_rotation': the
+        3x3 matrix taking directions in the original camera frame to the sample's
+        frame (horizontal flip and in-plane rotation; scale and crop keep directions).
+        """
+        if not config.enabled:
+            variant = {"rgb": rgb, "depth": depth, "mask": mask}
+            if with_camera_rotation:
+                variant["camera_rotation"] = np.eye(3)
+            return [variant]
+
         random.seed(config.seed)
         np.random.seed(config.seed)
 
+        pipeline = self._get_pipeline(config, replay=with_camera_rotation)
+        variants: List[Dict[str, np.ndarray]] = []
+        for _ in range(config.variants_per_frame):
+            result = pipeline(image=rgb, depth=depth, mask=mask)
+            variant = {"rgb": result["image"], "depth": result["depth"], "mask": result["mask"]}
+            if with_camera_rotation:
+                variant["camera_rotation"] = _camera_rotation(result["replay"])
+            variants.append(variant)
+        return variants
+
+    def _get_pipeline(
+        self, config: PipelineConfig.AugmentationConfig, replay: bool = False, extra_targets: Tuple[str, ...] = ()
+    ) -> A.Compose:
+        # The seed only matters when the RNGs are seeded, not for the transform itself
+        key = (config.model_dump_json(exclude={"seed", "variants_per_frame"}), replay, extra_targets)
+        pipeline = self._pipelines.get(key)
+        if pipeline is None:
+            pipeline = self._build_pipeline(config, replay, extra_targets)
+            self._pipelines[key] = pipeline
+        return pipeline
+
+    def _build_pipeline(
+        self, config: PipelineConfig.AugmentationConfig, replay: bool = False, extra_targets: Tuple[str, ...] = ()
+    ) -> A.Compose:
+        # Imported on first use: albumentations (with scikit-learn/scipy behind it)
+        # dominates start-up time and most entry points never augment
+        import albumentations as A
+
         height = int(config.crop_size[1])
         width = int(config.crop_size[0])
 
@@ -54,16 +140,34 @@ class AugmentationService:
                 ),
             )
 
-        pipeline = A.Compose(
+        # ReplayCompose draws the same random parameters and also reports them
+        compose = A.ReplayCompose if replay else A.Compose
+        return compose(
             transforms,
             additional_targets={
                 "depth": "image",  # treat as image for geometric transforms
                 "mask": "mask",    # ensure nearest-neighbor for masks
+                **{name: "image" for name in extra_targets},
             },
         )
 
-        result = pipeline(image=rgb, depth=depth, mask=mask)
-        return {"rgb": result["image"], "depth": result["depth"], "mask": result["mask"]}
-
-
 
+def _camera_rotation(replay: Dict[str, Any]) -> np.ndarray:
+    """Direction transform of one ReplayCompose result (see `apply_variants`).
+
+    Treats the image center as the principal point, like the unchanged intrinsics
+    used for augmented samples.
+    """
+    rotation = np.eye(3)
+    for transform in replay["transforms"]:
+        if not transform["applied"]:
+            continue
+        name = transform["__class_fullname__"].rsplit(".", 1)[-1]
+        if name == "HorizontalFlip":
+            rotation = np.diag([-1.0, 1.0, 1.0]) @ rotation
+        elif name == "Rotate":
+            # Same 2x2 part as the cv2.getRotationMatrix2D used to warp the image
+            angle = np.deg2rad(transform["params"]["angle"])
+            c, s = np.cos(angle), np.sin(angle)
+            rotation = np.array([[c, s, 0.0], [-s, c, 0.0], [0.0, 0.0, 1.0]]) @ rotation
+    return rotation
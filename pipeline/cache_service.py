@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+import numpy as np
+
+
+class StageCache:
+    """Persistent, content-addressed store for per-stage frame results.
+
+    Each entry is a single .npy file at `<directory>/<stage>/<key[:2]>/<key>.npy`.
+    Keys are digests of everything a stage's output depends on (input file
+    contents, the relevant config subsection, upstream keys), so a changed knob only
+    invalidates the stages downstream of it. Entries are written atomically and may
+    be shared by concurrent worker processes.
+
+    Eviction is least-recently-used by file mtime, which is refreshed on every hit;
+    `prune` trims the store to `max_bytes`.
+    """
+
+    # Bump a stage's version when its algorithm changes to invalidate old entries
+    STAGE_VERSIONS = {
+        "depth": "1",
+        "inpainted": "1",
+        "mask": "1",
+        "hha": "1",
+    }
+
+    def __init__(self, directory: Union[str, Path], max_bytes: int) -> None:
+        self.directory = Path(directory)
+        self.max_bytes = int(max_bytes)
+
+    @staticmethod
+    def file_digest(path: Union[str, Path]) -> str:
+        """Return a hex digest of a file's contents."""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def key(self, stage: str, *parts: Union[str, bytes]) -> str:
+        """Derive the cache key of `stage` from its input descriptors."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{stage}:{self.STAGE_VERSIONS[stage]}".encode("utf-8"))
+        for part in parts:
+            data = part if isinstance(part, bytes) else part.encode("utf-8")
+            # Length-prefix every part so different splits cannot collide
+            digest.update(len(data).to_bytes(8, "little"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def _entry_path(self, stage: str, key: str) -> Path:
+        return self.directory / stage / key[:2] / f"{key}.npy"
+
+    def load(self, stage: str, key: str) -> Optional[np.ndarray]:
+        """Return the cached array or None on a miss (unreadable entries count as misses)."""
+        path = self._entry_path(stage, key)
+        try:
+            array = np.load(path, allow_pickle=False)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as exc:
+            logging.warning("Discarding unreadable cache entry %s: %s", path, exc)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return array
+
+    def store(self, stage: str, key: str, array: np.ndarray) -> None:
+        path = self._entry_path(stage, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(array), allow_pickle=False)
+        os.replace(tmp_path, path)
+
+    def get_or_compute(self, stage: str, key: str, compute: Callable[[], np.ndarray]) -> np.ndarray:
+        """Return the cached result of `stage` for `key`, computing and storing it on a miss."""
+        array = self.load(stage, key)
+        if array is None:
+            array = compute()
+            self.store(stage, key, array)
+        return array
+
+    def prune(self) -> int:
+        """Evict least-recently-used entries until the store fits `max_bytes`.
+
+        Only finished entries (`<stage>/**/*.npy`) count and are evicted, so other
+        files kept under the same directory and entries still being written by
+        another process are left alone.
+
+        Returns:
+            int: Number of evicted entries.
+        """
+        entries = []
+        total = 0
+        for stage in self.STAGE_VERSIONS:
+            for root, _, files in os.walk(self.directory / stage):
+                for name in files:
+                    if not name.endswith(".npy"):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        return evicted
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 import numpy as np
 from pydantic import BaseModel, Field, ConfigDict
@@ -37,6 +37,15 @@ class PipelineConfig(BaseModel):
 
     class InpaintingConfig(BaseModel):
         method: str = Field(..., description="e.g., 'linear_nearest', 'rbf', 'none'")
+        rbf_kernel: str = Field(
+            "thin_plate_spline",
+            description="RBF kernel: thin_plate_spline, cubic, linear, gaussian, multiquadric, inverse_multiquadric",
+        )
+        rbf_epsilon: float = Field(1.0, gt=0, description="RBF shape parameter (coordinates are scaled by it)")
+        rbf_neighbors: int = Field(16, ge=3, description="Nearest valid samples fitted for each pixel of a small hole")
+        rbf_max_samples: int = Field(256, ge=3, description="Band samples fitted jointly for one large hole")
+        rbf_smoothing: float = Field(0.0, ge=0, description="Diagonal smoothing; >0 approximates instead of interpolating")
+        rbf_band_width: int = Field(3, ge=1, description="Width in pixels of the valid band sampled around holes")
 
     class AugmentationConfig(BaseModel):
         enabled: bool = True
@@ -46,21 +55,128 @@ class PipelineConfig(BaseModel):
         crop_size: Tuple[int, int]
         rotate_limit: int = 15
         pad_if_needed: bool = True
+        variants_per_frame: int = Field(1, ge=1, description="Augmented samples drawn per decoded frame")
 
     class CamerasConfig(BaseModel):
         """Configuration for camera intrinsic parameters."""
 
         rgb_camera_matrix: CameraIntrinsics
         depth_camera_matrix: CameraIntrinsics
+        depth_to_rgb_rotation: Tuple[Tuple[float, float, float], ...] = Field(
+            ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0)),
+            min_length=3,
+            max_length=3,
+            description="3x3 rotation from depth-camera to RGB-camera coordinates",
+        )
+        depth_to_rgb_translation_m: Tuple[float, float, float] = Field(
+            (0.0, 0.0, 0.0), description="Depth -> RGB camera translation in meters"
+        )
+
+    class RegistrationConfig(BaseModel):
+        """Configuration for aligning depth maps to the RGB camera."""
+
+        enabled: bool = False
+        reference_depth_m: float = Field(
+            2.0, gt=0, description="Depth at which parallax between the cameras is resolved"
+        )
+        map_cache_dir: Optional[str] = Field(
+            None, description="Directory persisting the remap tables; None keeps them in memory only"
+        )
+
+    class HHAConfig(BaseModel):
+        """Configuration for the gravity direction used by HHA conversion."""
+
+        gravity_mode: str = Field(
+            "per_frame",
+            description="'per_frame' (estimate every frame), 'fixed', 'running' (carry and re-check) or 'per_sequence'",
+        )
+        gravity: Optional[Tuple[float, float, float]] = Field(
+            None, description="Up-vector in depth-camera coordinates for 'fixed' mode"
+        )
+        gravity_check_interval: int = Field(10, ge=1, description="'running' mode re-estimates every N conversions")
+        gravity_max_drift_deg: float = Field(
+            5.0, gt=0, description="'running' mode: larger changes trigger a full re-estimate"
+        )
 
     class PathsConfig(BaseModel):
         raw_dir: str
         processed_dir: str
+        frame_manifest: Optional[str] = Field(
+            None, description="JSON cache of discovered frames, reused while the raw directories are unchanged"
+        )
+
+    class ExecutionConfig(BaseModel):
+        """Configuration for how frames are scheduled across CPU cores."""
+
+        workers: int = Field(1, ge=1, description="Number of worker processes; 1 runs in-process")
+        chunk_size: int = Field(0, ge=0, description="Frames per dispatched chunk; 0 picks automatically")
+        streaming: bool = Field(
+            False,
+            description="Load the next frames on a background thread; with workers > 1, also pass frames to "
+            "and from the pool through shared memory",
+        )
+        prefetch_depth: int = Field(2, ge=1, description="Frames loaded ahead of compute in streaming mode")
+        memory_lean: bool = Field(False, description="Bound per-frame scratch memory (band-wise HHA normals)")
+        memory_limit_mb: int = Field(0, ge=0, description="Per-worker data segment cap in MB; 0 disables it")
+        shard_index: int = Field(0, ge=0, description="Which of `num_shards` disjoint frame subsets this run processes")
+        num_shards: int = Field(1, ge=1, description="Number of independent runs (e.g. nodes) the frames are split over")
+
+    class OutputConfig(BaseModel):
+        """Configuration for how output artifacts are written."""
+
+        class ArtifactConfig(BaseModel):
+            """Whether and how one per-frame artifact is written."""
+
+            enabled: bool = True
+            format: str = Field("png", description="'png', 'npy', 'npz' (compressed), or 'jpg'/'webp' for rgb only")
+            png_compression: Optional[int] = Field(
+                None, ge=0, le=9, description="PNG zlib level for this artifact; None uses output.png_compression"
+            )
+            quality: Optional[int] = Field(
+                None, ge=1, le=100, description="JPEG/WebP quality; None keeps OpenCV's default"
+            )
+
+        png_compression: Optional[int] = Field(
+            None, ge=0, le=9, description="PNG zlib level (0-9); None keeps OpenCV's default"
+        )
+        hha_dtype: str = Field(
+            "uint16", description="'uint16' (HHA * 1000, saturating; legacy) or 'uint8' (HHA values as computed)"
+        )
+        depth_raw: ArtifactConfig = Field(default_factory=ArtifactConfig)
+        depth_filled: ArtifactConfig = Field(default_factory=ArtifactConfig)
+        hha: ArtifactConfig = Field(default_factory=ArtifactConfig)
+        mask: ArtifactConfig = Field(default_factory=ArtifactConfig)
+        rgb: ArtifactConfig = Field(default_factory=ArtifactConfig)
+        async_writes: bool = Field(True, description="Encode and write images on background threads")
+        writer_threads: int = Field(2, ge=1, description="Threads encoding images in the background")
+        max_pending_writes: int = Field(16, ge=1, description="Queued images before saving blocks (backpressure)")
+        export_format: str = Field("png", description="'png' (per-artifact files), 'shards' (packed binary) or 'both'")
+        shard_size_mb: int = Field(1024, gt=0, description="Size after which a new shard file is started")
+
+    class CacheConfig(BaseModel):
+        """Configuration for the persistent per-stage result cache."""
+
+        enabled: bool = False
+        directory: str = Field("./data/cache", description="Root directory of the stage cache")
+        max_size_mb: int = Field(4096, gt=0, description="Size cap; least recently used entries are evicted")
+
+    class ProfilingConfig(BaseModel):
+        """Configuration for opt-in per-stage instrumentation."""
+
+        enabled: bool = False
+        trace_memory: bool = Field(True, description="Record peak traced (Python/NumPy) memory per stage")
+        profile_slowest: int = Field(0, ge=0, description="Keep cProfile dumps of this many slowest frames")
 
     inpainting: InpaintingConfig
     augmentation: AugmentationConfig
     cameras: CamerasConfig
     paths: PathsConfig
+    registration: RegistrationConfig = Field(default_factory=RegistrationConfig)
+    hha: HHAConfig = Field(default_factory=HHAConfig)
+    execution: ExecutionConfig = Field(default_factory=ExecutionConfig)
+    output: OutputConfig = Field(default_factory=OutputConfig)
+    cache: CacheConfig = Field(default_factory=CacheConfig)
+    profiling: ProfilingConfig = Field(default_factory=ProfilingConfig)
 
 
 class RawFrameData(BaseModel):
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import hashlib
+from collections import OrderedDict
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .annotation_service import AnnotationService
+from .augmentation_service import AugmentationService
+from .data_models import FrameIdentifier, PipelineConfig, ProcessedFrameData
+from .file_service import FileService
+from .hha_service import HHAService
+from .inpainting_service import InpaintingService
+from .registration_service import RegistrationService
+
+
+class FrameDataset:
+    """Processed frames computed on demand, indexable like a map-style dataset.
+
+    `dataset[i]` loads frame `i`, runs registration, inpainting, mask rasterization,
+    HHA and augmentation in memory and returns a `ProcessedFrameData`; nothing is
+    written to disk. The deterministic stages (parsed depth, inpainted depth, mask,
+    HHA) go through a least-recently-used cache bounded to `cache_mb`, so from the
+    second epoch on a sample only costs decoding the RGB and augmenting.
+
+    HHA is computed once on the un-augmented frame and warped with the RGB image.
+    With `hha_after_augmentation` it is instead computed on every augmented depth
+    map, as the exported pipeline does, which is exact but not cached. HHA is not
+    cached either in the stateful `hha.gravity_mode`s (`running`, `per_sequence`),
+    where it depends on the frames converted before it.
+
+    Augmentation uses `config.augmentation.seed` for every frame, like the exported
+    pipeline, until `set_epoch` is called; then each (epoch, index) pair gets its
+    own seed, so samples differ between epochs but are reproducible.
+
+    Cached arrays are read-only and may be returned as is (or as views), so copy
+    a sample before modifying it in place. The dataset pickles without its cache,
+    so worker processes (forked or spawned) each fill their own.
+    """
+
+    def __init__(
+        self,
+        config: PipelineConfig,
+        frames: Optional[List[FrameIdentifier]] = None,
+        cache_mb: int = 1024,
+        hha_after_augmentation: bool = False,
+        file_service: Optional[FileService] = None,
+        inpainting_service: Optional[InpaintingService] = None,
+        annotation_service: Optional[AnnotationService] = None,
+        augmentation_service: Optional[AugmentationService] = None,
+        hha_service: Optional[HHAService] = None,
+    ) -> None:
+        """
+        Args:
+            config: Pipeline settings; `paths.raw_dir` is scanned unless `frames` is given.
+            frames: Frames to serve, in index order.
+            cache_mb: Memory budget of the stage cache in MB (per process); 0 disables it.
+            hha_after_augmentation: Compute HHA per augmented sample instead of warping
+                the cached HHA of the frame.
+        """
+        self.config = config
+        self.file_service = file_service or FileService()
+        self.inpainting_service = inpainting_service or InpaintingService()
+        self.annotation_service = annotation_service or AnnotationService()
+        self.augmentation_service = augmentation_service or AugmentationService()
+        self.hha_service = hha_service or HHAService()
+        self.hha_service.configure_gravity(config.hha)
+        self.registration_service: Optional[RegistrationService] = None
+        if config.registration.enabled:
+            self.registration_service = RegistrationService(config.registration.map_cache_dir)
+
+        if frames is None:
+            frames = self.file_service.discover_frames(config.paths.raw_dir, config.paths.frame_manifest)
+        self.frames = list(frames)
+        self.hha_after_augmentation = hha_after_augmentation
+        self.epoch: Optional[int] = None
+        self._cache = _ArrayCache(cache_mb * 1024 * 1024)
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def __iter__(self) -> Iterator[ProcessedFrameData]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def __getitem__(self, index: int) -> ProcessedFrameData:
+        frame_id = self.frames[index]
+        rgb = self.file_service.load_rgb(frame_id.raw_rgb_path)
+        shape = rgb.shape[:2]
+
+        depth_m = self._cache.get_or_compute(("inpainted", index), lambda: self._inpainted(index, shape))
+        mask = self._cache.get_or_compute(
+            ("mask", index),
+            lambda: self.annotation_service.convert_polygons_to_mask(
+                self.file_service.load_polygons(frame_id.raw_mask_path), shape
+            ),
+        )
+
+        augmentation = self.config.augmentation
+        K = self._intrinsics()
+        if self.hha_after_augmentation:
+            aug = self.augmentation_service.apply(rgb, depth_m, mask, augmentation, seed=self._seed(index))
+            hha = self.hha_service.convert(np.asarray(aug["depth"], dtype=np.float32), K)
+        else:
+            if self.config.hha.gravity_mode in HHAService.STATEFUL_GRAVITY_MODES:
+                frame_hha = self.hha_service.convert(depth_m.astype(np.float32), K)
+            else:
+                frame_hha = self._cache.get_or_compute(
+                    ("hha", index), lambda: self.hha_service.convert(depth_m.astype(np.float32), K)
+                )
+            aug = self.augmentation_service.apply(
+                rgb, depth_m, mask, augmentation, seed=self._seed(index), extra_images={"hha": frame_hha}
+            )
+            hha = aug["hha"]
+
+        return ProcessedFrameData(
+            identifier=frame_id,
+            rgb_image=aug["rgb"],
+            depth_map_filled_m=aug["depth"],
+            hha_image=hha,
+            segmentation_mask=aug["mask"],
+        )
+
+    def set_epoch(self, epoch: Optional[int]) -> None:
+        """Draw augmentations for `epoch` (None: the config seed for every frame)."""
+        self.epoch = epoch
+
+    def clear_cache(self) -> None:
+        self._cache.clear()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_cache"] = _ArrayCache(self._cache.max_bytes)
+        return state
+
+    def _inpainted(self, index: int, rgb_shape: Tuple[int, int]) -> np.ndarray:
+        frame_id = self.frames[index]
+        depth_mm = self._cache.get_or_compute(("depth", index), lambda: self._depth(frame_id, rgb_shape))
+        if depth_mm.shape[:2] != rgb_shape:
+            raise RuntimeError(
+                f"Dimension mismatch RGB({rgb_shape[1]}x{rgb_shape[0]}) vs "
+                f"Depth({depth_mm.shape[1]}x{depth_mm.shape[0]}) for {frame_id.base_name}"
+            )
+        inpainting = self.config.inpainting
+        return self.inpainting_service.apply(depth_mm, inpainting.method, inpainting)
+
+    def _depth(self, frame_id: FrameIdentifier, rgb_shape: Tuple[int, int]) -> np.ndarray:
+        depth_mm = self.file_service.load_depth_txt(frame_id.raw_depth_path)
+        if self.registration_service is None:
+            return depth_mm
+        cameras = self.config.cameras
+        maps = self.registration_service.maps(
+            cameras.depth_camera_matrix.to_numpy_array(),
+            cameras.rgb_camera_matrix.to_numpy_array(),
+            np.asarray(cameras.depth_to_rgb_rotation),
+            cameras.depth_to_rgb_translation_m,
+            self.config.registration.reference_depth_m,
+            depth_mm.shape[:2],
+            rgb_shape,
+        )
+        return self.registration_service.register_depth(depth_mm, maps)
+
+    def _intrinsics(self) -> np.ndarray:
+        cameras = self.config.cameras
+        intrinsics = cameras.rgb_camera_matrix if self.registration_service is not None else cameras.depth_camera_matrix
+        return intrinsics.to_numpy_array().astype(np.float32)
+
+    def _seed(self, index: int) -> int:
+        seed = self.config.augmentation.seed
+        if self.epoch is None:
+            return seed
+        digest = hashlib.blake2b(f"{seed}:{self.epoch}:{index}".encode("utf-8"), digest_size=4).digest()
+        return int.from_bytes(digest, "little")
+
+
+class _ArrayCache:
+    """Least-recently-used arrays, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = int(max_bytes)
+        self._entries: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+
+    def get_or_compute(self, key: tuple, compute: Callable[[], np.ndarray]) -> np.ndarray:
+        array = self._entries.get(key)
+        if array is not None:
+            self._entries.move_to_end(key)
+            return array
+        array = compute()
+        if array.nbytes > self.max_bytes:
+            return array
+        array.flags.writeable = False
+        self._entries[key] = array
+        self._bytes += array.nbytes
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+        return array
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
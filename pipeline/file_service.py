@@ -1,14 +1,26 @@
 from __future__ import annotations
 
+import gzip
+import io
+import json
 import os
 import re
 from pathlib import Path
-from typing import List
+from typing import Callable, Collection, Dict, List, NamedTuple, Optional, Tuple
 
 import cv2
 import numpy as np
 
-from .data_models import FrameIdentifier, RawFrameData, ProcessedFrameData
+from .annotation_service import AnnotationService
+from .data_models import FrameIdentifier, PipelineConfig, RawFrameData, ProcessedFrameData
+from .shard_service import SHARD_SUFFIX, ShardWriter
+from .writer_service import AsyncImageWriter, Countdown, write_image
+
+
+class _Artifact(NamedTuple):
+    directory: str
+    file_suffix: str
+    params: List[int]
 
 
 class FileService:
@@ -17,118 +29,443 @@ class FileService:
     RGB_DIR = "rgb"
     DEPTH_DIR = "depth"
     ANNOT_DIR = "annotations"
+    DEPTH_SUFFIXES = (".txt", ".txt.gz")
+
+    # Start of the first 'row,column,depth' line in the sparse-triple format;
+    # only the leading bytes are sniffed since the header is short.
+    _SNIFF_BYTES = 4096
+    _TRIPLES_START = re.compile(rb"^[ \t]*\d+[ \t]*,", re.MULTILINE)
+    _WIDTH_HEADER = re.compile(rb"Width:\s*(\d+)")
+    _HEIGHT_HEADER = re.compile(rb"Height:\s*(\d+)")
+
+    # File names of the per-frame inputs paired by `discover_frames`
+    _RGB_NAME = re.compile(r"rgb_frame_(.+?)_png\.rf\.")
+    _DEPTH_NAME = re.compile(r"depth_data_(.+)(\.txt|\.txt\.gz)$")
+    _ANNOT_NAME = re.compile(r"rgb_frame_(.+?)_png\.rf\..*\.txt$")
+    MANIFEST_VERSION = 1
+
+    # Per-frame output artifacts: name in OutputConfig -> (run sub-directory, file name suffix)
+    ARTIFACTS = {
+        "depth_raw": ("depth_raw_png", "_depth_raw"),
+        "depth_filled": ("depth_filled_png", "_depth_filled"),
+        "hha": ("hha_png", "_hha"),
+        "mask": ("masks", "_mask"),
+        "rgb": ("rgb", "_rgb"),
+    }
+    _LOSSLESS_FORMATS = ("png", "npy", "npz")
+    _LOSSY_QUALITY_FLAGS = {"jpg": cv2.IMWRITE_JPEG_QUALITY, "webp": cv2.IMWRITE_WEBP_QUALITY}
+
+    def __init__(self) -> None:
+        self._created_dirs: set[Path] = set()
+        self._artifacts = self._resolve_artifacts(PipelineConfig.OutputConfig())
+        self._hha_uint8 = False
+        self._writer: Optional[AsyncImageWriter] = None
+        self._write_png_files = True
+        self._shard_max_bytes: Optional[int] = None
+        self._shards: Optional[ShardWriter] = None
+        # Tags with frames in the open shard, and `when_written` callbacks waiting for it
+        self._shard_tags: set[str] = set()
+        self._shard_waiters: List[Callable[[bool], None]] = []
+
+    def configure_output(self, config: PipelineConfig.OutputConfig) -> None:
+        """Apply output settings: export format, per-artifact encodings and background writing."""
+        if config.export_format not in ("png", "shards", "both"):
+            raise ValueError(f"Unsupported export format: {config.export_format}")
+        if config.hha_dtype not in ("uint16", "uint8"):
+            raise ValueError(f"Unsupported HHA dtype: {config.hha_dtype}")
+        artifacts = self._resolve_artifacts(config)
+        self.close()
+        self._artifacts = artifacts
+        self._hha_uint8 = config.hha_dtype == "uint8"
+        self._write_png_files = config.export_format in ("png", "both")
+        self._shard_max_bytes = config.shard_size_mb * 1024 * 1024 if config.export_format != "png" else None
+        if config.async_writes:
+            self._writer = AsyncImageWriter(config.writer_threads, config.max_pending_writes)
+
+    def _resolve_artifacts(self, config: PipelineConfig.OutputConfig) -> Dict[str, Optional[_Artifact]]:
+        """Output location and encoder parameters of each enabled artifact (None if disabled)."""
+        artifacts: Dict[str, Optional[_Artifact]] = {}
+        for name, (directory, suffix) in self.ARTIFACTS.items():
+            artifact = getattr(config, name)
+            if not artifact.enabled:
+                artifacts[name] = None
+                continue
+            # Lossy formats would corrupt depth, HHA and label values
+            allowed = (*self._LOSSLESS_FORMATS, *self._LOSSY_QUALITY_FLAGS) if name == "rgb" else self._LOSSLESS_FORMATS
+            if artifact.format not in allowed:
+                raise ValueError(f"Unsupported format for output.{name}: {artifact.format}")
+
+            params: List[int] = []
+            if artifact.format == "png":
+                level = artifact.png_compression if artifact.png_compression is not None else config.png_compression
+                if level is not None:
+                    params = [cv2.IMWRITE_PNG_COMPRESSION, level]
+            elif artifact.format in self._LOSSY_QUALITY_FLAGS and artifact.quality is not None:
+                params = [self._LOSSY_QUALITY_FLAGS[artifact.format], artifact.quality]
+            artifacts[name] = _Artifact(directory, f"{suffix}.{artifact.format}", params)
+        return artifacts
+
+    def when_written(
+        self,
+        tag: str,
+        callback: Callable[[bool], None],
+        images_written: Optional[Callable[[bool], None]] = None,
+    ) -> None:
+        """Call `callback(ok)` once everything saved so far under `tag` is written.
+
+        That is when its queued images are written (`ok` is False if one failed)
+        and, with packed shards, when the shard holding it is finished. The callback
+        may run right away, on a writer thread or from a later save or `close`.
+        `images_written(ok)`, if given, is called as soon as the queued images are
+        written, i.e. once the saved arrays are no longer referenced (shards copy
+        them when saving).
+        """
+        in_shard = tag in self._shard_tags
+        countdown = Countdown(int(self._writer is not None) + int(in_shard), callback)
+        if in_shard:
+            self._shard_waiters.append(countdown.done)
+        if self._writer is None:
+            if images_written is not None:
+                images_written(True)
+            return
+
+        def done(ok: bool) -> None:
+            if images_written is not None:
+                images_written(ok)
+            countdown.done(ok)
+
+        self._writer.when_done(tag, done)
+
+    def remove_partial_outputs(self, run_dir: Path, keep: Collection[str]) -> int:
+        """Delete the artifacts of every frame not in `keep` and unfinished shards.
+
+        Used when resuming a run, so frames interrupted mid-write leave nothing
+        behind. Finished packed shards are kept and may hold an older copy of a
+        frame that is processed again.
+
+        Returns:
+            int: Number of files removed.
+        """
+        removed = 0
+        for directory, suffix in self.ARTIFACTS.values():
+            for entry in self._scan(Path(run_dir) / directory):
+                stem = entry.name.rsplit(".", 1)[0]
+                if not stem.endswith(suffix):
+                    continue
+                frame = stem[: -len(suffix)]
+                # Augmented variants are saved as '<frame>_v<i>'
+                if frame in keep or _VARIANT_SUFFIX.sub("", frame) in keep:
+                    continue
+                os.remove(entry.path)
+                removed += 1
+        for entry in self._scan(Path(run_dir) / "shards"):
+            if entry.name.endswith(f"{SHARD_SUFFIX}.partial"):
+                os.remove(entry.path)
+                removed += 1
+        return removed
+
+    def flush(self) -> List[str]:
+        """Wait for queued image writes; returns base names of frames whose writes failed."""
+        return self._writer.flush() if self._writer is not None else []
+
+    def close(self) -> List[str]:
+        """Finish the open shard and flush and stop the background writer, if any."""
+        if self._shards is not None:
+            shards, self._shards = self._shards, None
+            shards.close()
+        if self._writer is None:
+            return []
+        writer, self._writer = self._writer, None
+        return writer.close()
 
     def _extract_frame_id_from_rgb(self, filename: str) -> str | None:
         """Extract frame_id from RGB filename like 'rgb_frame_<id>_png.rf.<hash>.jpg'."""
         # regex capturing content between 'rgb_frame_' and '_png.rf'
-        m = re.search(r"rgb_frame_(.+?)_png\.rf\.", filename)
+        m = self._RGB_NAME.search(filename)
         return m.group(1) if m else None
 
-    def discover_frames(self, raw_base_dir: str) -> List[FrameIdentifier]:
+    def discover_frames(self, raw_base_dir: str, manifest_path: Optional[str] = None) -> List[FrameIdentifier]:
+        """Pair RGB, depth and annotation files by frame id.
+
+        Each directory is listed once with `os.scandir` into a frame_id -> path index,
+        so discovery is linear in the number of files.
+
+        Args:
+            raw_base_dir: Directory holding the 'rgb', 'depth' and 'annotations' folders.
+            manifest_path: Optional JSON file caching the result; it is reused while the
+                modification times of the three directories are unchanged.
+
+        Returns:
+            List[FrameIdentifier]: Frames with all three inputs present.
+        """
         raw_path = Path(raw_base_dir)
         rgb_dir = raw_path / self.RGB_DIR
         depth_dir = raw_path / self.DEPTH_DIR
         annot_dir = raw_path / self.ANNOT_DIR
 
-        frames: List[FrameIdentifier] = []
         if not rgb_dir.exists():
-            return frames
+            return []
 
-        for rgb_file in rgb_dir.glob("*.jpg"):
-            frame_id = self._extract_frame_id_from_rgb(rgb_file.name)
-            if not frame_id:
+        dir_mtimes = {str(d): self._dir_mtime(d) for d in (rgb_dir, depth_dir, annot_dir)}
+        if manifest_path is not None:
+            cached = self._read_manifest(manifest_path, dir_mtimes)
+            if cached is not None:
+                return cached
+
+        rgb_files: list[tuple[str, str]] = []
+        for entry in self._scan(rgb_dir):
+            if not entry.name.endswith(".jpg"):
+                continue
+            frame_id = self._extract_frame_id_from_rgb(entry.name)
+            if frame_id:
+                rgb_files.append((frame_id, entry.path))
+
+        depth_files: dict[str, tuple[int, str]] = {}
+        for entry in self._scan(depth_dir):
+            m = self._DEPTH_NAME.match(entry.name)
+            if m is None:
                 continue
+            # Prefer suffixes listed earlier in DEPTH_SUFFIXES
+            rank = self.DEPTH_SUFFIXES.index(m.group(2))
+            current = depth_files.get(m.group(1))
+            if current is None or rank < current[0]:
+                depth_files[m.group(1)] = (rank, entry.path)
 
-            depth_file = depth_dir / f"depth_data_{frame_id}.txt"
-            # annotation file could have varying hash suffix; pick the first match
-            candidates = list(annot_dir.glob(f"rgb_frame_{frame_id}_png.rf.*.txt"))
-            annot_file = candidates[0] if candidates else None
+        # annotation file could have varying hash suffix; keep the first match
+        annot_files: dict[str, str] = {}
+        for entry in self._scan(annot_dir):
+            m = self._ANNOT_NAME.match(entry.name)
+            if m is not None:
+                annot_files.setdefault(m.group(1), entry.path)
 
-            if not depth_file.exists() or annot_file is None:
+        frames: List[FrameIdentifier] = []
+        for frame_id, rgb_file in rgb_files:
+            depth_file = depth_files.get(frame_id)
+            annot_file = annot_files.get(frame_id)
+            if depth_file is None or annot_file is None:
                 continue
 
             frames.append(
                 FrameIdentifier(
                     base_name=frame_id,
-                    raw_rgb_path=str(rgb_file),
-                    raw_depth_path=str(depth_file),
-                    raw_mask_path=str(annot_file),
+                    raw_rgb_path=rgb_file,
+                    raw_depth_path=depth_file[1],
+                    raw_mask_path=annot_file,
                 )
             )
 
+        if manifest_path is not None:
+            self._write_manifest(manifest_path, dir_mtimes, frames)
         return frames
 
-    def load_raw_data(self, frame_id: FrameIdentifier) -> RawFrameData:
-        rgb = cv2.imread(frame_id.raw_rgb_path, cv2.IMREAD_COLOR)
+    @staticmethod
+    def _scan(directory: Path) -> List[os.DirEntry]:
+        try:
+            with os.scandir(directory) as it:
+                return [entry for entry in it if entry.is_file()]
+        except FileNotFoundError:
+            return []
+
+    @staticmethod
+    def _dir_mtime(directory: Path) -> int | None:
+        try:
+            return os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _read_manifest(self, manifest_path: str, dir_mtimes: dict) -> List[FrameIdentifier] | None:
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("version") != self.MANIFEST_VERSION or manifest.get("dir_mtimes") != dir_mtimes:
+            return None
+        return [FrameIdentifier(**frame) for frame in manifest["frames"]]
+
+    def _write_manifest(self, manifest_path: str, dir_mtimes: dict, frames: List[FrameIdentifier]) -> None:
+        manifest = {
+            "version": self.MANIFEST_VERSION,
+            "dir_mtimes": dir_mtimes,
+            "frames": [frame.model_dump() for frame in frames],
+        }
+        path = Path(manifest_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+    def load_depth_txt(self, path: str) -> np.ndarray:
+        """Read a depth .txt (optionally .txt.gz) file into a float32 millimeter map.
+
+        Supported formats:
+          - Plain whitespace-separated grid of millimeters (H x W)
+          - Header with lines like 'Width: <w>', 'Height: <h>' followed by sparse
+            'row,column,depth_value' lines; pixels not listed are 0 (missing).
+
+        The file is read in one go and parsed by numpy's C tokenizer; sparse triples
+        are scattered into the grid with a single fancy-indexed assignment.
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        if str(path).endswith(".gz"):
+            data = gzip.decompress(data)
+
+        triples_start = self._TRIPLES_START.search(data, 0, self._SNIFF_BYTES)
+        if triples_start is None:
+            depth = np.loadtxt(io.StringIO(data.decode("ascii")), dtype=np.float32, ndmin=2)
+            if depth.size == 0:
+                raise ValueError(f"Depth file is empty: {path}")
+            return depth
+
+        header = data[: triples_start.start()]
+        width_match = self._WIDTH_HEADER.search(header)
+        height_match = self._HEIGHT_HEADER.search(header)
+        if width_match is None or height_match is None:
+            raise ValueError(f"Cannot determine width/height from depth header: {path}")
+        width = int(width_match.group(1))
+        height = int(height_match.group(1))
+
+        body = data[triples_start.start():].decode("ascii")
+        triples = np.loadtxt(io.StringIO(body), delimiter=",", dtype=np.float64, ndmin=2)
+        depth = np.zeros((height, width), dtype=np.float32)
+        if triples.size == 0:
+            return depth
+        if triples.shape[1] != 3:
+            raise ValueError(f"Expected 'row,column,depth' triples in {path}")
+
+        rows = triples[:, 0].astype(np.int64)
+        cols = triples[:, 1].astype(np.int64)
+        in_bounds = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+        depth[rows[in_bounds], cols[in_bounds]] = triples[in_bounds, 2]
+        return depth
+
+    def load_rgb(self, path: str) -> np.ndarray:
+        rgb = cv2.imread(path, cv2.IMREAD_COLOR)
         if rgb is None:
-            raise FileNotFoundError(f"Cannot read RGB image: {frame_id.raw_rgb_path}")
+            raise FileNotFoundError(f"Cannot read RGB image: {path}")
+        return rgb
+
+    def load_polygons(self, path: str) -> List[Tuple[int, np.ndarray]]:
+        """Read '<class_id> x1 y1 x2 y2 ...' lines of normalized polygon vertices."""
+        return AnnotationService.read_polygons(path)
 
-        # Depth txt: rows of millimeter values
+    def load_raw_data(self, frame_id: FrameIdentifier) -> RawFrameData:
+        rgb = self.load_rgb(frame_id.raw_rgb_path)
+
+        # Depth txt: grid or sparse triples of millimeter values
         try:
-            depth_mm = np.loadtxt(frame_id.raw_depth_path, dtype=np.float32)
+            depth_mm = self.load_depth_txt(frame_id.raw_depth_path)
         except Exception as exc:
             raise RuntimeError(f"Failed to read depth txt: {frame_id.raw_depth_path}") from exc
 
-        polygons: list[tuple[int, np.ndarray]] = []
-        with open(frame_id.raw_mask_path, "r", encoding="utf-8") as f:
-            for line in f:
-                parts = line.strip().split()
-                if not parts:
-                    continue
-                class_id = int(parts[0])
-                coords = np.array(list(map(float, parts[1:])), dtype=np.float32)
-                if coords.size % 2 != 0:
-                    # skip malformed
-                    continue
-                coords = coords.reshape(-1, 2)
-                polygons.append((class_id, coords))
-
         return RawFrameData(
             identifier=frame_id,
             rgb_image=rgb,
             depth_map_mm=depth_mm,
-            polygons=polygons,
+            polygons=self.load_polygons(frame_id.raw_mask_path),
         )
 
     def _ensure_dir(self, path: Path) -> None:
+        # Output folders are created once and remembered for the rest of the run
+        if path in self._created_dirs:
+            return
         os.makedirs(path, exist_ok=True)
+        self._created_dirs.add(path)
 
-    def save_raw_depth_png(self, frame_id: FrameIdentifier, depth_mm: np.ndarray, run_dir: Path) -> Path:
-        self._ensure_dir(run_dir)
-        out_dir = run_dir / "depth_raw_png"
+    def _write_artifact(self, name: str, base_name: str, image: np.ndarray, run_dir: Path, tag: str) -> Path:
+        artifact = self._artifacts[name]
+        out_dir = run_dir / artifact.directory
         self._ensure_dir(out_dir)
-        out_path = out_dir / f"{frame_id.base_name}_depth_raw.png"
+        path = out_dir / f"{base_name}{artifact.file_suffix}"
+        if self._writer is None:
+            write_image(str(path), image, artifact.params)
+        else:
+            self._writer.submit(path, image, artifact.params, tag=tag)
+        return path
+
+    def save_raw_depth(self, frame_id: FrameIdentifier, depth_mm: np.ndarray, run_dir: Path) -> Optional[Path]:
+        """Write the raw depth as uint16 millimeters; returns None if the artifact is disabled."""
+        if self._artifacts["depth_raw"] is None:
+            return None
         depth_uint16 = np.clip(depth_mm, 0, 65535).astype(np.uint16)
-        cv2.imwrite(str(out_path), depth_uint16)
-        return out_path
-
-    def save_processed_data(self, data: ProcessedFrameData, run_dir: Path) -> None:
-        # Save filled depth (m -> uint16 mm)
-        depth_dir = run_dir / "depth_filled_png"
-        self._ensure_dir(depth_dir)
-        depth_mm_uint16 = np.clip(np.round(data.depth_map_filled_m * 1000.0), 0, 65535).astype(np.uint16)
-        cv2.imwrite(str(depth_dir / f"{data.identifier.base_name}_depth_filled.png"), depth_mm_uint16)
-
-        # Save HHA (assumed float32 in [0..some_scale]); scale to uint16 via 1000 as per spec
-        hha_dir = run_dir / "hha_png"
-        self._ensure_dir(hha_dir)
-        hha_uint16 = np.clip(np.round(data.hha_image * 1000.0), 0, 65535).astype(np.uint16)
-        cv2.imwrite(str(hha_dir / f"{data.identifier.base_name}_hha.png"), hha_uint16)
-
-        # Save mask (uint8)
-        masks_dir = run_dir / "masks"
-        self._ensure_dir(masks_dir)
-        mask_u8 = data.segmentation_mask.astype(np.uint8)
-        cv2.imwrite(str(masks_dir / f"{data.identifier.base_name}_mask.png"), mask_u8)
-
-        # Save (possibly augmented) RGB image
-        rgb_dir = run_dir / "rgb"
-        self._ensure_dir(rgb_dir)
-        rgb_bgr = data.rgb_image
-        # Ensure 8-bit
-        if rgb_bgr.dtype != np.uint8:
-            rgb_bgr = np.clip(np.round(rgb_bgr), 0, 255).astype(np.uint8)
-        cv2.imwrite(str(rgb_dir / f"{data.identifier.base_name}_rgb.png"), rgb_bgr)
+        return self._write_artifact("depth_raw", frame_id.base_name, depth_uint16, run_dir, frame_id.base_name)
+
+    def save_processed_data(self, data: ProcessedFrameData, run_dir: Path, tag: Optional[str] = None) -> None:
+        """Write the enabled filled depth, HHA, mask and RGB artifacts of one processed frame.
+
+        With background writing enabled the images are only queued; `tag` (default:
+        the frame's base name) is what `flush` reports if one of them fails.
+        """
+        name = data.identifier.base_name
+        tag = tag if tag is not None else name
+
+        if self._shard_max_bytes is not None:
+            self._append_to_shard(data, run_dir, tag)
+        if not self._write_png_files:
+            return
+
+        # Filled depth (m -> uint16 mm)
+        if self._artifacts["depth_filled"] is not None:
+            depth_mm_uint16 = _scaled_to_uint16(data.depth_map_filled_m, 1000.0)
+            self._write_artifact("depth_filled", name, depth_mm_uint16, run_dir, tag)
+
+        # HHA: legacy uint16 (values * 1000, saturating) or the 8-bit values themselves
+        if self._artifacts["hha"] is not None:
+            if self._hha_uint8:
+                hha = _to_uint8(data.hha_image)
+            else:
+                hha = _scaled_to_uint16(data.hha_image, 1000.0)
+            self._write_artifact("hha", name, hha, run_dir, tag)
+
+        if self._artifacts["mask"] is not None:
+            mask_u8 = np.asarray(data.segmentation_mask, dtype=np.uint8)
+            self._write_artifact("mask", name, mask_u8, run_dir, tag)
+
+        # (Possibly augmented) RGB image
+        if self._artifacts["rgb"] is not None:
+            self._write_artifact("rgb", name, _to_uint8(data.rgb_image), run_dir, tag)
+
+    def _append_to_shard(self, data: ProcessedFrameData, run_dir: Path, tag: str) -> None:
+        if self._shards is None:
+            # One shard sequence per process, so pool workers never share a file
+            self._shards = ShardWriter(
+                run_dir / "shards",
+                prefix=f"shard-{os.getpid()}",
+                max_bytes=self._shard_max_bytes,
+                on_finish=self._shard_finished,
+            )
+        self._shards.append(
+            data.identifier.base_name,
+            {
+                "rgb": data.rgb_image,
+                "depth": data.depth_map_filled_m.astype(np.float32, copy=False),
+                "hha": data.hha_image,
+                "mask": data.segmentation_mask.astype(np.uint8, copy=False),
+            },
+        )
+        self._shard_tags.add(tag)
+
+    def _shard_finished(self, names: List[str]) -> None:
+        waiters, self._shard_waiters = self._shard_waiters, []
+        self._shard_tags.clear()
+        for waiter in waiters:
+            waiter(True)
+
+
+_VARIANT_SUFFIX = re.compile(r"_v\d+$")
+
 
+def _to_uint8(image: np.ndarray) -> np.ndarray:
+    if image.dtype == np.uint8:
+        return image
+    return np.clip(np.round(image), 0, 255).astype(np.uint8)
 
 
+def _scaled_to_uint16(image: np.ndarray, scale: float) -> np.ndarray:
+    """clip(round(image * scale), 0, 65535) as uint16, with a single float temporary."""
+    scaled = np.multiply(image, scale)
+    np.round(scaled, out=scaled)
+    np.clip(scaled, 0, 65535, out=scaled)
+    return scaled.astype(np.uint16)
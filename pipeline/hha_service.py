@@ -1,18 +1,38 @@
 from __future__ import annotations
 
-from typing import Callable, Optional
+import logging
+from typing import Any, Callable, Optional
 
 import numpy as np
 
+from .data_models import PipelineConfig
+
 
 class HHAService:
     """Wrapper around an external 'depth2hha' provider to compute HHA images.
 
     Expects input depth in meters and an intrinsic camera matrix (3x3).
+
+    By default the backend estimates the gravity direction on every frame. For
+    rigidly mounted cameras `configure_gravity` can instead use a fixed vector,
+    estimate it once ('per_sequence': the first conversion of this instance, i.e.
+    once per run or pool worker), or carry it across conversions ('running'),
+    re-estimating every `gravity_check_interval` conversions warm-started from the
+    carried value and from scratch when it drifted by more than
+    `gravity_max_drift_deg`. The carried gravity is kept in depth-camera
+    coordinates; `convert`'s `camera_rotation` maps it into each converted image.
     """
 
+    GRAVITY_MODES = ("per_frame", "fixed", "running", "per_sequence")
+    # Modes whose output depends on the conversions before it, not only on the input
+    STATEFUL_GRAVITY_MODES = ("running", "per_sequence")
+
     def __init__(self) -> None:
         self._converter: Optional[Callable[..., np.ndarray]] = self._resolve_converter()
+        self._batch_converter: Optional[Callable[..., np.ndarray]] = self._resolve_batch_converter()
+        self._gravity_config = PipelineConfig.HHAConfig()
+        self._gravity: Optional[np.ndarray] = None
+        self._conversions_since_check = 0
 
     def _resolve_converter(self) -> Optional[Callable[..., np.ndarray]]:
         try:
@@ -27,13 +47,97 @@ class HHAService:
                 return func  # type: ignore[return-value]
         return None
 
-    def convert(self, depth_map_m: np.ndarray, camera_matrix: np.ndarray) -> np.ndarray:
+    def _resolve_batch_converter(self) -> Optional[Callable[..., np.ndarray]]:
+        try:
+            import depth2hha  # type: ignore
+        except Exception:
+            return None
+        func = getattr(depth2hha, "convert_batch", None)
+        return func if callable(func) else None
+
+    def configure_gravity(self, config: PipelineConfig.HHAConfig) -> None:
+        """Select how the gravity direction is obtained (see the class docstring)."""
+        if config.gravity_mode not in self.GRAVITY_MODES:
+            raise ValueError(f"Unsupported gravity mode: {config.gravity_mode}")
+        if config.gravity_mode == "fixed" and config.gravity is None:
+            raise ValueError("hha.gravity is required with gravity_mode 'fixed'")
+        self._gravity_config = config
+        self.reset_gravity()
+
+    def reset_gravity(self) -> None:
+        """Forget the carried gravity estimate, e.g. when a new sequence starts."""
+        config = self._gravity_config
+        self._gravity = _oriented(np.asarray(config.gravity, dtype=np.float64)) if config.gravity_mode == "fixed" else None
+        self._conversions_since_check = 0
+
+    def convert(
+        self,
+        depth_map_m: np.ndarray,
+        camera_matrix: np.ndarray,
+        camera_rotation: Optional[np.ndarray] = None,
+        **options: Any,
+    ) -> np.ndarray:
         """Convert a metric depth map to an HHA image using the external library.
 
+        `camera_rotation` (3x3) maps depth-camera directions into this depth map's
+        frame, e.g. after registration or flip/rotate augmentation; it only matters
+        for the non-default gravity modes. Extra keyword `options` (e.g. `band_rows`)
+        are passed through to the backend.
         Raises a clear error if the converter is unavailable.
         """
         if depth_map_m.ndim != 2:
             raise ValueError("depth_map_m must be a 2D array of meters")
+        self._check_backend(camera_matrix)
+
+        if self._gravity_config.gravity_mode == "per_frame":
+            hha = self._converter(depth_map_m, camera_matrix, **options)
+        else:
+            rotation = np.eye(3) if camera_rotation is None else np.asarray(camera_rotation, dtype=np.float64)
+            hha = self._convert_with_carried_gravity(depth_map_m, camera_matrix, rotation, options)
+        if not isinstance(hha, np.ndarray) or (hha.ndim != 3 or hha.shape[2] != 3):
+            raise RuntimeError("depth2hha returned unexpected result; expected HxWx3 ndarray")
+        return hha
+
+    def convert_batch(
+        self,
+        depth_maps_m: np.ndarray,
+        camera_matrix: np.ndarray,
+        camera_rotations: Optional[np.ndarray] = None,
+        **options: Any,
+    ) -> np.ndarray:
+        """Convert a (B, H, W) stack of metric depth maps to (B, H, W, 3) HHA images.
+
+        Inputs are validated once and, when the backend provides `convert_batch`,
+        the whole stack goes to it in one call. `camera_rotations` holds one 3x3
+        matrix per map (see `convert`). Conversions that update the carried gravity
+        ('running' mode, or the first 'per_sequence' estimate) run one at a time so
+        the results match consecutive `convert` calls.
+        """
+        depth_maps_m = np.asarray(depth_maps_m)
+        if depth_maps_m.ndim != 3:
+            raise ValueError("depth_maps_m must be a (B, H, W) stack of meters")
+        self._check_backend(camera_matrix)
+
+        mode = self._gravity_config.gravity_mode
+        sequential = mode == "running" or (mode == "per_sequence" and self._gravity is None)
+        if self._batch_converter is None or sequential:
+            rotations = [None] * len(depth_maps_m) if camera_rotations is None else camera_rotations
+            return np.stack(
+                [
+                    self.convert(depth_map_m, camera_matrix, camera_rotation=rotation, **options)
+                    for depth_map_m, rotation in zip(depth_maps_m, rotations)
+                ]
+            )
+
+        if mode != "per_frame":
+            rotations = [np.eye(3)] * len(depth_maps_m) if camera_rotations is None else camera_rotations
+            options = dict(options, gravity=np.stack([_oriented(rotation @ self._gravity) for rotation in rotations]))
+        hha = self._batch_converter(depth_maps_m, camera_matrix, **options)
+        if not isinstance(hha, np.ndarray) or hha.shape != depth_maps_m.shape + (3,):
+            raise RuntimeError("depth2hha returned unexpected result; expected BxHxWx3 ndarray")
+        return hha
+
+    def _check_backend(self, camera_matrix: np.ndarray) -> None:
         if camera_matrix.shape != (3, 3):
             raise ValueError("camera_matrix must be 3x3")
 
@@ -44,10 +148,44 @@ class HHAService:
                 "compute_hha, computeHHA."
             )
 
-        hha = self._converter(depth_map_m, camera_matrix)
-        if not isinstance(hha, np.ndarray) or (hha.ndim != 3 or hha.shape[2] != 3):
-            raise RuntimeError("depth2hha returned unexpected result; expected HxWx3 ndarray")
-        return hha
+    def _convert_with_carried_gravity(
+        self, depth_map_m: np.ndarray, camera_matrix: np.ndarray, rotation: np.ndarray, options: dict
+    ) -> np.ndarray:
+        if self._gravity is None:
+            hha, gravity = self._converter(depth_map_m, camera_matrix, return_gravity=True, **options)
+            self._gravity = _oriented(rotation.T @ gravity)
+            return hha
 
+        if self._gravity_config.gravity_mode == "running":
+            self._conversions_since_check += 1
+            if self._conversions_since_check >= self._gravity_config.gravity_check_interval:
+                self._conversions_since_check = 0
+                return self._recheck_gravity(depth_map_m, camera_matrix, rotation, options)
+
+        return self._converter(depth_map_m, camera_matrix, gravity=_oriented(rotation @ self._gravity), **options)
+
+    def _recheck_gravity(
+        self, depth_map_m: np.ndarray, camera_matrix: np.ndarray, rotation: np.ndarray, options: dict
+    ) -> np.ndarray:
+        hha, gravity = self._converter(
+            depth_map_m,
+            camera_matrix,
+            gravity_init=_oriented(rotation @ self._gravity),
+            return_gravity=True,
+            **options,
+        )
+        estimate = _oriented(rotation.T @ gravity)
+        drift = np.degrees(np.arccos(np.clip(abs(float(estimate @ self._gravity)), 0.0, 1.0)))
+        if drift > self._gravity_config.gravity_max_drift_deg:
+            logging.warning("Gravity estimate drifted by %.1f deg; re-estimating it from scratch", drift)
+            hha, gravity = self._converter(depth_map_m, camera_matrix, return_gravity=True, **options)
+            estimate = _oriented(rotation.T @ gravity)
+        self._gravity = estimate
+        return hha
 
 
+def _oriented(gravity: np.ndarray) -> np.ndarray:
+    """Unit vector with a non-negative y component, the backend's sign convention."""
+    gravity = np.asarray(gravity, dtype=np.float64)
+    gravity = gravity / np.linalg.norm(gravity)
+    return -gravity if gravity[1] < 0 else gravity
@@ -1,7 +1,27 @@
 from __future__ import annotations
 
+from typing import Callable, Dict, Optional, Tuple
+
+import cv2
 import numpy as np
-from scipy.interpolate import griddata
+
+from .data_models import PipelineConfig
+
+
+def _thin_plate_spline(r: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(r > 0, r * r * np.log(r), 0.0)
+
+
+# Radial kernels phi(epsilon * r); names follow scipy.interpolate.RBFInterpolator
+_RBF_KERNELS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "thin_plate_spline": _thin_plate_spline,
+    "cubic": lambda r: r ** 3,
+    "linear": lambda r: -r,
+    "gaussian": lambda r: np.exp(-(r * r)),
+    "multiquadric": lambda r: -np.sqrt(1.0 + r * r),
+    "inverse_multiquadric": lambda r: 1.0 / np.sqrt(1.0 + r * r),
+}
 
 
 class InpaintingService:
@@ -9,15 +29,36 @@ class InpaintingService:
 
     Methods:
         - 'linear_nearest': cascade of linear interpolation, then nearest for remaining gaps.
+        - 'rbf': local radial basis function interpolation from the nearest valid samples.
         - 'none': return input converted to meters without filling.
+
+    Only missing pixels are evaluated. For 'linear_nearest' the interpolant is built
+    from the ring of valid pixels bordering the holes: those are the vertices of every
+    Delaunay triangle that covers a hole pixel, so triangulating them alone reproduces
+    the full-image triangulation over the holes at a fraction of the cost.
     """
 
-    def apply(self, depth_map: np.ndarray, method: str) -> np.ndarray:
+    # 4-connected neighbourhood used to pick the valid pixels bordering holes
+    _RING_KERNEL = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+    # Missing pixels whose local RBF systems are solved (or evaluated) together; bounds
+    # peak memory to roughly RBF_CHUNK * (neighbors + 3)^2 * 8 bytes per batch.
+    RBF_CHUNK = 1024
+    # Holes whose bounding box fits in SMALL_HOLE pixels use per-pixel nearest-sample fits
+    SMALL_HOLE = 8
+
+    def apply(
+        self,
+        depth_map: np.ndarray,
+        method: str,
+        config: Optional[PipelineConfig.InpaintingConfig] = None,
+    ) -> np.ndarray:
         """Apply inpainting to a depth map.
 
         Args:
             depth_map: Depth map in millimeters (2D array).
-            method: Inpainting method. Supported: 'linear_nearest', 'none'.
+            method: Inpainting method. Supported: 'linear_nearest', 'rbf', 'none'.
+            config: Optional inpainting config providing the 'rbf' parameters;
+                defaults are used when omitted.
 
         Returns:
             np.ndarray: Depth map in meters with gaps filled according to method.
@@ -25,41 +66,216 @@ class InpaintingService:
         if depth_map.ndim != 2:
             raise ValueError("depth_map must be a 2D array")
 
-        # Normalize to meters (float32) from millimeters
-        depth_m = depth_map.astype(np.float32) / 1000.0
+        # Normalize to meters (float32) from millimeters in a single allocation
+        depth_m = np.divide(depth_map, np.float32(1000.0), dtype=np.float32)
 
         if method == "none":
             return depth_m
 
-        if method != "linear_nearest":
+        if method not in ("linear_nearest", "rbf"):
             raise ValueError(f"Unsupported inpainting method: {method}")
 
-        height, width = depth_m.shape
-
         # Invalid where zeros or NaNs
         invalid = (depth_map == 0) | np.isnan(depth_m)
-        valid = ~invalid
-
-        if not np.any(valid):
+        if not np.any(invalid):
+            return depth_m
+        if np.all(invalid):
             # No valid points at all; return zeros
             return np.zeros_like(depth_m, dtype=np.float32)
 
-        yy, xx = np.indices((height, width))
-        points = np.stack([yy[valid], xx[valid]], axis=1)
-        values = depth_m[valid]
+        hole_rows, hole_cols = np.nonzero(invalid)
+        queries = np.stack([hole_rows, hole_cols], axis=1).astype(np.float64)
+
+        if method == "rbf":
+            if config is None:
+                config = PipelineConfig.InpaintingConfig(method=method)
+            filled = self._fill_rbf(depth_m, invalid, queries, config)
+        else:
+            filled = self._fill_linear_nearest(depth_m, invalid, queries)
+
+        # depth_m is already a fresh array; fill it in place
+        depth_m[hole_rows, hole_cols] = filled
+        return depth_m
+
+    def _band_samples(
+        self, depth_m: np.ndarray, invalid: np.ndarray, kernel: np.ndarray, iterations: int = 1
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (row, col) positions and values of valid pixels within the band around holes."""
+        band = cv2.dilate(invalid.astype(np.uint8), kernel, iterations=iterations).astype(bool) & ~invalid
+        rows, cols = np.nonzero(band)
+        points = np.stack([rows, cols], axis=1).astype(np.float64)
+        return points, depth_m[rows, cols].astype(np.float64)
+
+    def _fill_linear_nearest(self, depth_m: np.ndarray, invalid: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        # scipy is imported on first use to keep start-up (and spawned workers) light
+        from scipy.interpolate import LinearNDInterpolator
+        from scipy.spatial import Delaunay, QhullError, cKDTree
+
+        points, values = self._band_samples(depth_m, invalid, self._RING_KERNEL)
 
-        # First pass: linear interpolation
-        filled_linear = griddata(points, values, (yy, xx), method="linear")
+        # First pass: linear interpolation inside the triangulated ring
+        try:
+            filled = LinearNDInterpolator(Delaunay(points), values)(queries)
+        except QhullError:
+            # Degenerate ring (e.g. collinear points): leave everything to the nearest pass
+            filled = np.full(len(queries), np.nan)
 
-        # Second pass: nearest for remaining NaNs
-        missing = np.isnan(filled_linear)
+        # Second pass: nearest ring pixel for holes outside the triangulation
+        missing = np.isnan(filled)
         if np.any(missing):
-            filled_nearest = griddata(points, values, (yy, xx), method="nearest")
-            filled_linear[missing] = filled_nearest[missing]
+            _, nearest = cKDTree(points).query(queries[missing])
+            filled[missing] = values[nearest]
+        return filled
 
-        # Where still NaN (edge cases), set to zero (no data)
-        filled = np.nan_to_num(filled_linear, nan=0.0)
-        return filled.astype(np.float32)
+    def _fill_rbf(
+        self,
+        depth_m: np.ndarray,
+        invalid: np.ndarray,
+        queries: np.ndarray,
+        config: PipelineConfig.InpaintingConfig,
+    ) -> np.ndarray:
+        """Fill missing pixels with RBFs fitted to nearby valid samples.
+
+        Small holes (bounding box up to `SMALL_HOLE` pixels): every missing pixel gets
+        its own fit to its `rbf_neighbors` nearest band samples, which surround it;
+        these small systems are built and solved in fixed-size batches.
+
+        Large holes: nearest samples would all lie on one edge, so each component is
+        fitted once to its whole surrounding band (evenly subsampled to
+        `rbf_max_samples`) and evaluated over its pixels in chunks.
+
+        Cost is linear in the number of missing pixels and memory stays bounded.
+        """
+        from scipy.spatial import cKDTree
+
+        kernel = _RBF_KERNELS.get(config.rbf_kernel)
+        if kernel is None:
+            raise ValueError(f"Unsupported RBF kernel: {config.rbf_kernel}")
+
+        square = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+        points, values = self._band_samples(depth_m, invalid, square, iterations=config.rbf_band_width)
+        tree = cKDTree(points)
+        k = min(config.rbf_neighbors, len(points))
+        if k < 3:
+            _, nearest = tree.query(queries)
+            return values[nearest]
+
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(invalid.astype(np.uint8), connectivity=8)
+        extent = np.maximum(stats[:, cv2.CC_STAT_WIDTH], stats[:, cv2.CC_STAT_HEIGHT])
+        query_labels = labels[queries[:, 0].astype(np.intp), queries[:, 1].astype(np.intp)]
+        is_small = (extent <= self.SMALL_HOLE)[query_labels]
+
+        filled = np.empty(len(queries), dtype=np.float64)
+        small = np.flatnonzero(is_small)
+        for start in range(0, len(small), self.RBF_CHUNK):
+            sel = small[start:start + self.RBF_CHUNK]
+            _, idx = tree.query(queries[sel], k=k)
+            estimates = self._solve_rbf(
+                points[idx] - queries[sel, None, :], values[idx], kernel, config.rbf_epsilon, config.rbf_smoothing
+            )
+            filled[sel] = estimates[0]
+
+        large = np.flatnonzero(~is_small)
+        if len(large):
+            order = large[np.argsort(query_labels[large], kind="stable")]
+            bounds = np.searchsorted(query_labels[order], np.unique(query_labels[order]))
+            for component in np.split(order, bounds[1:]):
+                label = query_labels[component[0]]
+                filled[component] = self._fill_component_rbf(
+                    depth_m, invalid, labels, label, stats[label], queries[component], kernel, config
+                )
+        return filled
+
+    def _fill_component_rbf(
+        self,
+        depth_m: np.ndarray,
+        invalid: np.ndarray,
+        labels: np.ndarray,
+        label: int,
+        stat: np.ndarray,
+        queries: np.ndarray,
+        kernel: Callable[[np.ndarray], np.ndarray],
+        config: PipelineConfig.InpaintingConfig,
+    ) -> np.ndarray:
+        # Work inside the component's bounding box grown by the band width
+        pad = config.rbf_band_width
+        height, width = invalid.shape
+        x0 = max(int(stat[cv2.CC_STAT_LEFT]) - pad, 0)
+        y0 = max(int(stat[cv2.CC_STAT_TOP]) - pad, 0)
+        x1 = min(int(stat[cv2.CC_STAT_LEFT] + stat[cv2.CC_STAT_WIDTH]) + pad, width)
+        y1 = min(int(stat[cv2.CC_STAT_TOP] + stat[cv2.CC_STAT_HEIGHT]) + pad, height)
+
+        component = (labels[y0:y1, x0:x1] == label).astype(np.uint8)
+        square = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+        band = cv2.dilate(component, square, iterations=pad).astype(bool) & ~invalid[y0:y1, x0:x1]
+        rows, cols = np.nonzero(band)
+        if len(rows) == 0:
+            return np.zeros(len(queries))
+        step = -(-len(rows) // config.rbf_max_samples)
+        rows, cols = rows[::step], cols[::step]
+        values = depth_m[y0 + rows, x0 + cols].astype(np.float64)
+        if len(rows) < 3:
+            return np.full(len(queries), values.mean())
+
+        # Fit around the band centroid for conditioning, then evaluate in chunks
+        points = np.stack([y0 + rows, x0 + cols], axis=1).astype(np.float64)
+        center = points.mean(axis=0)
+        offsets = points - center
+        coeffs = self._solve_rbf(
+            offsets[None], values[None], kernel, config.rbf_epsilon, config.rbf_smoothing, evaluate=False
+        )[0]
+        scaled_samples = offsets * config.rbf_epsilon
+        filled = np.empty(len(queries), dtype=np.float64)
+        n = len(points)
+        for start in range(0, len(queries), self.RBF_CHUNK):
+            scaled = (queries[start:start + self.RBF_CHUNK] - center) * config.rbf_epsilon
+            basis = kernel(np.linalg.norm(scaled[:, None, :] - scaled_samples[None], axis=-1))
+            filled[start:start + len(scaled)] = (
+                basis @ coeffs[:n] + coeffs[n] + scaled @ coeffs[n + 1:]
+            )
+        return filled
+
+    @staticmethod
+    def _solve_rbf(
+        offsets: np.ndarray,
+        values: np.ndarray,
+        kernel: Callable[[np.ndarray], np.ndarray],
+        epsilon: float,
+        smoothing: float,
+        evaluate: bool = True,
+    ) -> np.ndarray:
+        """Solve a batch of RBF fits with a linear polynomial tail.
+
+        Args:
+            offsets: (Q, k, 2) sample positions relative to each fit's origin.
+            values: (Q, k) sample values.
+            evaluate: When True return (1, Q) values at each origin, otherwise the
+                (Q, k + 3) coefficients (kernel weights, constant, x/y slopes).
+        """
+        n_fits, k, _ = offsets.shape
+        scaled = offsets * epsilon
+        dists = np.linalg.norm(scaled[:, :, None, :] - scaled[:, None, :, :], axis=-1)
 
+        system = np.zeros((n_fits, k + 3, k + 3), dtype=np.float64)
+        system[:, :k, :k] = kernel(dists)
+        if smoothing:
+            system[:, np.arange(k), np.arange(k)] += smoothing
+        system[:, :k, k] = 1.0
+        system[:, :k, k + 1:] = scaled
+        system[:, k, :k] = 1.0
+        system[:, k + 1:, :k] = np.swapaxes(scaled, 1, 2)
+        rhs = np.zeros((n_fits, k + 3, 1), dtype=np.float64)
+        rhs[:, :k, 0] = values
 
+        try:
+            coeffs = np.linalg.solve(system, rhs)[:, :, 0]
+        except np.linalg.LinAlgError:
+            # Some neighbourhood is degenerate (e.g. collinear samples); fall back to
+            # least-squares solutions for this batch.
+            coeffs = (np.linalg.pinv(system) @ rhs)[:, :, 0]
+        if not evaluate:
+            return coeffs
 
+        # At the origin the polynomial tail reduces to its constant term
+        basis = kernel(np.linalg.norm(scaled, axis=-1))
+        return (np.einsum("qk,qk->q", coeffs[:, :k], basis) + coeffs[:, k])[None]
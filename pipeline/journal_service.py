@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import datetime as _dt
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+
+class ResumeMismatchError(RuntimeError):
+    """Raised when a run is resumed with settings other than those it was started with."""
+
+
+class RunJournal:
+    """Append-only, fsync'd record of finished frames in a run directory.
+
+    `<run_dir>/journal.jsonl` holds one JSON line per event: a 'start' line per
+    (re)started run with the settings a resume must match, then a 'done' or
+    'failed' line per frame, appended once the frame's outputs are written (see
+    `FileService.when_written`) and fsync'd before returning. Each line is a
+    single O_APPEND write, so the parent and pool workers can share the file; a
+    line torn by a crash (or otherwise malformed) is ignored when reading. The last entry of a frame wins.
+    """
+
+    FILE_NAME = "journal.jsonl"
+
+    def __init__(self, run_dir: Union[str, Path]) -> None:
+        self.path = Path(run_dir) / self.FILE_NAME
+        self._fd: Optional[int] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def start(self, **settings: object) -> None:
+        """Record that a run (or resume) starts with `settings`."""
+        self._append({"event": "start", **settings})
+
+    def record(self, frame: str, ok: bool) -> None:
+        """Record that `frame` finished ('done') or failed."""
+        self._append({"event": "done" if ok else "failed", "frame": frame})
+
+    def read(self) -> Tuple[Optional[dict], Dict[str, str]]:
+        """Return (settings of the first start event or None, {frame: last 'done'/'failed' event})."""
+        settings: Optional[dict] = None
+        statuses: Dict[str, str] = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return None, statuses
+        for number, line in enumerate(lines, 1):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                entry = None
+            event = entry.get("event") if isinstance(entry, dict) else None
+            if event == "start":
+                if settings is None:
+                    settings = {k: v for k, v in entry.items() if k not in ("event", "time", "pid")}
+            elif event in ("done", "failed") and isinstance(entry.get("frame"), str):
+                statuses[entry["frame"]] = event
+            else:
+                logging.warning("Ignoring torn or malformed line %d of %s", number, self.path)
+        return settings, statuses
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fd is not None and self._pid == os.getpid():
+                os.close(self._fd)
+            self._fd = None
+
+    def _append(self, entry: dict) -> None:
+        entry.update(time=_dt.datetime.now().isoformat(timespec="seconds"), pid=os.getpid())
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        with self._lock:
+            # A forked worker must not share the parent's descriptor
+            if self._fd is None or self._pid != os.getpid():
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                self._pid = os.getpid()
+            os.write(self._fd, line)
+            os.fsync(self._fd)
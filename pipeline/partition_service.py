@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import datetime as _dt
+import errno
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, TypeVar, Union
+
+from .data_models import FrameIdentifier
+from .journal_service import RunJournal
+from .shard_service import SHARD_SUFFIX
+
+_Frame = TypeVar("_Frame", FrameIdentifier, str)
+
+
+class PartitionService:
+    """Deterministic split of a capture across independent runs, and their merge.
+
+    A frame belongs to shard `blake2b(base_name) mod num_shards`, so every node
+    that sees the same raw directory picks a disjoint subset without talking to
+    the others, and adding frames never moves existing ones between shards of
+    the same count. Every run records what it was assigned and what failed in
+    `<run_dir>/run_manifest.json` (plus `failed_files.txt`); `merge` combines the
+    run directories of all shards into one dataset by hard-linking their files
+    (symlinking across filesystems), so nothing is copied.
+    """
+
+    MANIFEST_NAME = "run_manifest.json"
+    FAILED_NAME = "failed_files.txt"
+    MANIFEST_VERSION = 1
+    # Per-run diagnostics that are not part of the dataset
+    _NOT_MERGED = {MANIFEST_NAME, FAILED_NAME, RunJournal.FILE_NAME, "profiling"}
+    # Packed shard files are named per process, so names can repeat across nodes
+    _PACKED_SHARDS_DIR = "shards"
+    # Leftovers of writes a crash interrupted (unfinished packed shards, atomic writes)
+    _UNFINISHED_SUFFIXES = (f"{SHARD_SUFFIX}.partial", ".tmp")
+
+    @staticmethod
+    def shard_of(base_name: str, num_shards: int) -> int:
+        """Shard index of a frame; stable across machines, processes and Python versions."""
+        digest = hashlib.blake2b(base_name.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "little") % num_shards
+
+    @classmethod
+    def select(cls, frames: Sequence[_Frame], shard_index: int, num_shards: int) -> List[_Frame]:
+        """Frames (identifiers or base names) of shard `shard_index`, in their original order."""
+        if num_shards < 1 or not 0 <= shard_index < num_shards:
+            raise ValueError(f"Invalid shard {shard_index} of {num_shards}")
+        if num_shards == 1:
+            return list(frames)
+        return [
+            frame
+            for frame in frames
+            if cls.shard_of(frame if isinstance(frame, str) else frame.base_name, num_shards) == shard_index
+        ]
+
+    def write_run_manifest(
+        self,
+        run_dir: Path,
+        frames: Sequence[str],
+        failed: Sequence[str],
+        shard_index: int = 0,
+        num_shards: int = 1,
+        config_digest: Optional[str] = None,
+    ) -> Path:
+        """Record a finished run: its shard, assigned frames and failures."""
+        manifest = {
+            "version": self.MANIFEST_VERSION,
+            "shard_index": shard_index,
+            "num_shards": num_shards,
+            "config_digest": config_digest,
+            "finished": _dt.datetime.now().isoformat(timespec="seconds"),
+            "frames": list(frames),
+            "failed": list(failed),
+        }
+        run_dir = Path(run_dir)
+        _write_text_atomic(run_dir / self.FAILED_NAME, "".join(f"{name}\n" for name in failed))
+        path = run_dir / self.MANIFEST_NAME
+        _write_text_atomic(path, json.dumps(manifest, indent=2))
+        return path
+
+    def read_run_manifest(self, run_dir: Union[str, Path]) -> dict:
+        path = Path(run_dir) / self.MANIFEST_NAME
+        try:
+            manifest = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError as exc:
+            raise FileNotFoundError(f"{run_dir} has no {self.MANIFEST_NAME}; is the run finished?") from exc
+        if manifest.get("version") != self.MANIFEST_VERSION:
+            raise ValueError(f"Unsupported run manifest version in {path}")
+        return manifest
+
+    def merge(self, run_dirs: Sequence[Union[str, Path]], output_dir: Union[str, Path], symlink: bool = False) -> dict:
+        """Combine finished shard runs into `output_dir` without copying files.
+
+        Files keep their path relative to the run directory; packed shard files are
+        prefixed with their shard index since their names are only unique per node.
+        Each file is hard-linked (or symlinked with `symlink`, or when the output is
+        on another filesystem). Conflicts between the runs, or with files already in
+        `output_dir`, are detected before anything is linked.
+
+        Args:
+            run_dirs: Run directories, at most one per shard index.
+            output_dir: Merged dataset directory; must not contain conflicting files.
+            symlink: Always symlink instead of hard-linking.
+
+        Returns:
+            dict: The merged manifest, also written to `output_dir`. Its
+            'missing_shards' lists shard indices no run was given for.
+        """
+        manifests = [self.read_run_manifest(run_dir) for run_dir in run_dirs]
+        counts = {manifest["num_shards"] for manifest in manifests}
+        if len(counts) > 1:
+            raise ValueError(f"Runs were split into different shard counts: {sorted(counts)}")
+        seen: Dict[int, Path] = {}
+        for run_dir, manifest in zip(run_dirs, manifests):
+            index = manifest["shard_index"]
+            if index in seen:
+                raise ValueError(f"Shard {index} given twice: {seen[index]} and {run_dir}")
+            seen[index] = Path(run_dir)
+        if len({manifest["config_digest"] for manifest in manifests}) > 1:
+            logging.warning("Merging runs made with different configs")
+
+        output_dir = Path(output_dir)
+        links: Dict[Path, Path] = {}
+        for run_dir, manifest in zip(run_dirs, manifests):
+            for source, target in self._run_files(Path(run_dir), output_dir, manifest["shard_index"]):
+                if target in links:
+                    raise FileExistsError(f"{links[target]} and {source} would both be merged as {target}")
+                if (target.exists() or target.is_symlink()) and not os.path.samefile(source, target):
+                    raise FileExistsError(f"{target} already exists and is not {source}")
+                links[target] = source
+        for target, source in links.items():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            _link(source, target, symlink)
+        linked = len(links)
+
+        num_shards = counts.pop() if counts else 1
+        merged = {
+            "version": self.MANIFEST_VERSION,
+            "num_shards": num_shards,
+            "missing_shards": [index for index in range(num_shards) if index not in seen],
+            "sources": [
+                {"run_dir": str(Path(run_dir).resolve()), "shard_index": manifest["shard_index"]}
+                for run_dir, manifest in zip(run_dirs, manifests)
+            ],
+            "frames": [name for manifest in manifests for name in manifest["frames"]],
+            "failed": [name for manifest in manifests for name in manifest["failed"]],
+            "files": linked,
+        }
+        output_dir.mkdir(parents=True, exist_ok=True)
+        _write_text_atomic(output_dir / self.FAILED_NAME, "".join(f"{name}\n" for name in merged["failed"]))
+        _write_text_atomic(output_dir / self.MANIFEST_NAME, json.dumps(merged, indent=2))
+        return merged
+
+    def _run_files(self, run_dir: Path, output_dir: Path, shard_index: int) -> List[Tuple[Path, Path]]:
+        """(source, merged path) of every dataset file of a run."""
+        pairs: List[Tuple[Path, Path]] = []
+        for root, dirs, files in os.walk(run_dir):
+            rel_root = Path(root).relative_to(run_dir)
+            if rel_root == Path("."):
+                dirs[:] = [d for d in dirs if d not in self._NOT_MERGED]
+                files = [f for f in files if f not in self._NOT_MERGED]
+            for name in files:
+                if name.endswith(self._UNFINISHED_SUFFIXES):
+                    continue
+                source = Path(root) / name
+                if rel_root.parts[:1] == (self._PACKED_SHARDS_DIR,):
+                    name = f"part{shard_index:03d}-{name}"
+                pairs.append((source, output_dir / rel_root / name))
+        return pairs
+
+
+def _link(source: Path, target: Path, symlink: bool) -> None:
+    if target.exists() or target.is_symlink():
+        if os.path.samefile(source, target):
+            return  # already merged by an earlier, interrupted merge
+        raise FileExistsError(f"{target} already exists and is not {source}")
+    if not symlink:
+        try:
+            os.link(source, target)
+            return
+        except OSError as exc:
+            if exc.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+    os.symlink(source.resolve(), target)
+
+
+def _write_text_atomic(path: Path, text: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(text, encoding="utf-8")
+    os.replace(tmp_path, path)
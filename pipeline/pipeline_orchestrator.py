@@ -1,24 +1,41 @@
 from __future__ import annotations
 
+import contextlib
 import datetime as _dt
+import hashlib
+import itertools
 import logging
+import multiprocessing.util
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Callable, ContextManager, Deque, Dict, List, Optional, Tuple
 
 import numpy as np
 from tqdm import tqdm
 
+from .cache_service import StageCache
 from .data_models import FrameIdentifier, RawFrameData, ProcessedFrameData, PipelineConfig
 from .file_service import FileService
 from .inpainting_service import InpaintingService
+from .journal_service import ResumeMismatchError, RunJournal
+from .partition_service import PartitionService
 from .annotation_service import AnnotationService
 from .augmentation_service import AugmentationService
 from .hha_service import HHAService
+from .profiling_service import StageProfiler
+from .registration_service import RegistrationService
+from .transport_service import SharedFrameRing, SlotFull, SlotLayout, RingHandle
 
 
 class PipelineOrchestrator:
     """Coordinates end-to-end processing of frames according to PipelineConfig."""
 
+    # Rows per band of the HHA normal solve in memory-lean mode
+    LEAN_HHA_BAND_ROWS = 64
+    # Shared-memory slots per pool worker when streaming: one being computed, one being saved
+    RING_SLOTS_PER_WORKER = 2
+
     def __init__(
         self,
         config: PipelineConfig,
@@ -27,6 +44,8 @@ class PipelineOrchestrator:
         annotation_service: AnnotationService,
         augmentation_service: AugmentationService,
         hha_service: HHAService,
+        run_dir: Optional[Path] = None,
+        registration_service: Optional[RegistrationService] = None,
     ) -> None:
         self.config = config
         self.file_service = file_service
@@ -34,9 +53,28 @@ class PipelineOrchestrator:
         self.annotation_service = annotation_service
         self.augmentation_service = augmentation_service
         self.hha_service = hha_service
+        self.registration_service: Optional[RegistrationService] = None
+        if config.registration.enabled:
+            self.registration_service = registration_service or RegistrationService(config.registration.map_cache_dir)
+        self.stage_cache: Optional[StageCache] = None
+        if config.cache.enabled:
+            self.stage_cache = StageCache(config.cache.directory, config.cache.max_size_mb * 1024 * 1024)
+
+        self.file_service.configure_output(config.output)
+        self.hha_service.configure_gravity(config.hha)
 
         self._setup_logging()
-        self.run_dir = self._create_run_dir()
+        self.run_dir = run_dir if run_dir is not None else self._create_run_dir()
+        self.journal = RunJournal(self.run_dir)
+
+        # Memory-lean mode computes HHA normals band by band instead of full-frame
+        self._hha_options = {"band_rows": self.LEAN_HHA_BAND_ROWS} if config.execution.memory_lean else {}
+
+        self.profiler: Optional[StageProfiler] = None
+        if config.profiling.enabled:
+            self.profiler = StageProfiler(
+                self.run_dir / "profiling", config.profiling.trace_memory, config.profiling.profile_slowest
+            )
 
     def _setup_logging(self) -> None:
         logs_dir = Path("logs")
@@ -53,22 +91,44 @@ class PipelineOrchestrator:
     def _create_run_dir(self) -> Path:
         processed_base = Path(self.config.paths.processed_dir)
         timestamp = _dt.datetime.now().strftime("%Y%m%d_%H%M%S")
-        run_dir = processed_base / f"run_{timestamp}"
+        execution = self.config.execution
+        shard = f"_shard{execution.shard_index}of{execution.num_shards}" if execution.num_shards > 1 else ""
+        run_dir = processed_base / f"run_{timestamp}{shard}"
         run_dir.mkdir(parents=True, exist_ok=True)
         return run_dir
 
     def run_full_pipeline(self) -> None:
-        frames = self.file_service.discover_frames(self.config.paths.raw_dir)
+        frames = self.file_service.discover_frames(self.config.paths.raw_dir, self.config.paths.frame_manifest)
         logging.info("Discovered %d frames", len(frames))
-        failed_list: list[str] = []
+        execution = self.config.execution
+        if execution.num_shards > 1:
+            frames = PartitionService.select(frames, execution.shard_index, execution.num_shards)
+            logging.info("Shard %d of %d: %d frames", execution.shard_index, execution.num_shards, len(frames))
+        pending = self._skip_journaled(frames)
 
-        for frame_id in tqdm(frames, desc="Processing frames"):
-            try:
-                self.process_single_frame(frame_id)
-            except Exception as exc:  # noqa: BLE001
-                logging.exception("Failed processing %s: %s", frame_id.base_name, exc)
-                failed_list.append(frame_id.base_name)
+        workers = self.config.execution.workers
+        parallel = workers > 1 and len(pending) > 1
+        if parallel and execution.streaming:
+            failed_list = self._run_parallel_streaming(pending, workers)
+        elif parallel:
+            failed_list = self._run_parallel(pending, workers)
+        else:
+            _limit_memory(self.config.execution.memory_limit_mb)
+            if self.config.execution.streaming:
+                failed_list = self._run_streaming(pending)
+            else:
+                failed_list = self._run_sequential(pending)
+        self.journal.close()
+        _log_peak_rss(include_workers=parallel)
 
+        PartitionService().write_run_manifest(
+            self.run_dir,
+            [frame_id.base_name for frame_id in frames],
+            failed_list,
+            execution.shard_index,
+            execution.num_shards,
+            self._dataset_config_digest(),
+        )
         if failed_list:
             failed_file = Path("logs") / "failed_files.txt"
             with failed_file.open("w", encoding="utf-8") as f:
@@ -78,6 +138,298 @@ class PipelineOrchestrator:
         else:
             logging.info("Completed successfully. All frames processed.")
 
+        if self.profiler is not None:
+            table = StageProfiler.summarize(self.profiler.output_dir, self.config.profiling.profile_slowest)
+            logging.info("Per-stage timings (see %s):\n%s", self.profiler.output_dir, table)
+
+        if self.stage_cache is not None:
+            evicted = self.stage_cache.prune()
+            if evicted:
+                logging.info("Evicted %d least recently used stage cache entries", evicted)
+
+    def _skip_journaled(self, frames: List[FrameIdentifier]) -> List[FrameIdentifier]:
+        """Start the run's journal; when resuming, drop finished frames and clear the rest's outputs.
+
+        Frames journaled as 'done' are skipped. Failed and interrupted frames are
+        processed again after their partial artifacts (and unfinished packed shards)
+        are removed. Resuming requires the same output settings and shard. With a
+        stateful gravity mode the resumed frames get a fresh gravity estimate.
+        """
+        execution = self.config.execution
+        settings = {
+            "config_digest": self._dataset_config_digest(),
+            "shard_index": execution.shard_index,
+            "num_shards": execution.num_shards,
+        }
+        previous, statuses = self.journal.read()
+        if previous is not None and previous != settings:
+            raise ResumeMismatchError(f"Cannot resume {self.run_dir}: it was started with {previous}, now {settings}")
+        self.journal.start(**settings)
+        if previous is None and not statuses:
+            return frames
+
+        done = {name for name, status in statuses.items() if status == "done"}
+        if self.config.hha.gravity_mode in HHAService.STATEFUL_GRAVITY_MODES:
+            logging.warning(
+                "hha.gravity_mode '%s' carries its estimate across frames; the resumed frames start "
+                "a new estimate, so their HHA may differ slightly from an uninterrupted run",
+                self.config.hha.gravity_mode,
+            )
+        removed = self.file_service.remove_partial_outputs(self.run_dir, done)
+        pending = [frame_id for frame_id in frames if frame_id.base_name not in done]
+        logging.info(
+            "Resuming %s: %d frames done, %d to process, %d partial files removed",
+            self.run_dir,
+            len(frames) - len(pending),
+            len(pending),
+            removed,
+        )
+        return pending
+
+    def _dataset_config_digest(self) -> str:
+        """Digest of the settings that shape the outputs, i.e. not scheduling or local paths.
+
+        Of the execution settings only `memory_lean` counts, since banded HHA normals
+        may differ by rounding; it is added only when set, so other digests stay as is.
+        """
+        settings = self.config.model_dump_json(exclude={"execution", "paths", "profiling"})
+        if self.config.execution.memory_lean:
+            settings += "memory_lean"
+        return hashlib.blake2b(settings.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _run_sequential(self, frames: List[FrameIdentifier]) -> List[str]:
+        failed_list: list[str] = []
+        for frame_id in tqdm(frames, desc="Processing frames"):
+            if self._process_isolated(frame_id) is not None:
+                failed_list.append(frame_id.base_name)
+        return self._finish_writes(failed_list)
+
+    def _run_streaming(self, frames: List[FrameIdentifier]) -> List[str]:
+        """Overlap loading, compute and writing of consecutive frames.
+
+        A loader thread decodes up to `execution.prefetch_depth` frames ahead of the
+        compute loop, and the file service's background writer (see `output`) encodes
+        the previous frames' images, so both I/O sides overlap the compute of the
+        current frame. Memory stays bounded by the two queue depths, and every frame
+        is still processed (and fails) in isolation.
+        """
+        depth = self.config.execution.prefetch_depth
+        logging.info("Streaming frames (prefetch depth %d)", depth)
+        failed_list: list[str] = []
+        upcoming = iter(frames)
+        in_flight: Deque[Tuple[FrameIdentifier, Future]] = deque()
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="frame-loader") as loader:
+            for frame_id in itertools.islice(upcoming, depth):
+                in_flight.append((frame_id, loader.submit(self._load_frame, frame_id)))
+            with tqdm(total=len(frames), desc="Processing frames") as progress:
+                while in_flight:
+                    frame_id, loaded = in_flight.popleft()
+                    following = next(upcoming, None)
+                    if following is not None:
+                        in_flight.append((following, loader.submit(self._load_frame, following)))
+                    if self._process_isolated(frame_id, loaded) is not None:
+                        failed_list.append(frame_id.base_name)
+                    progress.update()
+        return self._finish_writes(failed_list)
+
+    def _finish_writes(self, failed_list: List[str]) -> List[str]:
+        # Writes still queued at this point can only add failures
+        for name in self.file_service.close():
+            if name not in failed_list:
+                failed_list.append(name)
+        return failed_list
+
+    def _run_parallel(self, frames: List[FrameIdentifier], workers: int) -> List[str]:
+        """Fan frames out over a process pool.
+
+        Each worker builds its own service instances (same classes as the parent's)
+        and writes into the shared run directory. Results come back in submission
+        order, so the failure list matches the sequential run.
+        """
+        workers = min(workers, len(frames))
+        chunk_size = self.config.execution.chunk_size or max(1, len(frames) // (workers * 4))
+        logging.info("Processing with %d workers (chunk size %d)", workers, chunk_size)
+
+        failed_list: list[str] = []
+        with self._worker_pool(workers) as executor:
+            results = executor.map(_process_in_worker, frames, chunksize=chunk_size)
+            for failed_name in tqdm(results, total=len(frames), desc="Processing frames"):
+                if failed_name is not None:
+                    failed_list.append(failed_name)
+        return failed_list
+
+    def _run_parallel_streaming(self, frames: List[FrameIdentifier], workers: int) -> List[str]:
+        """Load and save frames in this process and only compute them in the pool.
+
+        A loader thread decodes frames ahead (`execution.prefetch_depth`). Each
+        frame's RGB and depth are copied into a free slot of a `SharedFrameRing`,
+        and a worker gets just the slot layout and the annotation polygons. It runs
+        the compute stages on views of the slot and appends the raw depth and every
+        variant's depth, HHA, mask and RGB to the same slot; this process saves them
+        from there and frees the slot once its queued images are written. Frame
+        arrays are thus never pickled. Frames whose inputs or outputs do not fit
+        into a slot are saved by the worker itself, as in `_run_parallel`.
+
+        Results are saved in submission order, so the failure list matches the
+        sequential run.
+        """
+        workers = min(workers, len(frames))
+        depth = self.config.execution.prefetch_depth
+        logging.info("Streaming frames to %d workers through shared memory (prefetch depth %d)", workers, depth)
+
+        failed_list: list[str] = []
+        ring: Optional[SharedFrameRing] = None
+        upcoming = iter(frames)
+        loading: Deque[Tuple[FrameIdentifier, Future]] = deque()
+        # (frame, slot or None, worker result or None if loading failed), in submission order
+        in_flight: Deque[Tuple[FrameIdentifier, Optional[int], Optional[Future]]] = deque()
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="frame-loader") as loader, self._worker_pool(
+            workers
+        ) as executor, tqdm(total=len(frames), desc="Processing frames") as progress:
+
+            def save_oldest() -> None:
+                frame_id, slot, result = in_flight.popleft()
+                if not self._save_from_ring(ring, frame_id, slot, result):
+                    failed_list.append(frame_id.base_name)
+                progress.update()
+
+            try:
+                for frame_id in itertools.islice(upcoming, depth):
+                    loading.append((frame_id, loader.submit(self._load_frame, frame_id)))
+                while loading:
+                    frame_id, loaded = loading.popleft()
+                    following = next(upcoming, None)
+                    if following is not None:
+                        loading.append((following, loader.submit(self._load_frame, following)))
+                    try:
+                        raw, digests = loaded.result()
+                    except Exception as exc:  # noqa: BLE001
+                        logging.exception("Failed processing %s: %s", frame_id.base_name, exc)
+                        in_flight.append((frame_id, None, None))
+                        continue
+
+                    if ring is None:
+                        ring = SharedFrameRing(self.RING_SLOTS_PER_WORKER * workers + 2, self._slot_bytes(raw))
+                    # Free slots by saving finished frames; results arrive in order
+                    slot = ring.acquire(timeout=0)
+                    while slot is None:
+                        if in_flight:
+                            save_oldest()
+                            slot = ring.acquire(timeout=0)
+                        else:
+                            slot = ring.acquire()
+                    inputs = ring.writer(slot)
+                    try:
+                        inputs.put("rgb", raw.rgb_image)
+                        inputs.put("depth", raw.depth_map_mm)
+                    except SlotFull:
+                        ring.release(slot)
+                        in_flight.append((frame_id, None, executor.submit(_process_unshared_in_worker, frame_id)))
+                        continue
+                    result = executor.submit(
+                        _compute_in_worker, frame_id, ring.handle, inputs.layout, raw.polygons, digests
+                    )
+                    del raw
+                    in_flight.append((frame_id, slot, result))
+                    while in_flight and (in_flight[0][2] is None or in_flight[0][2].done()):
+                        save_oldest()
+                while in_flight:
+                    save_oldest()
+            finally:
+                # Queued images may still read from the ring
+                failed_list = self._finish_writes(failed_list)
+                if ring is not None:
+                    ring.close()
+        return failed_list
+
+    def _save_from_ring(
+        self,
+        ring: Optional[SharedFrameRing],
+        frame_id: FrameIdentifier,
+        slot: Optional[int],
+        result: Optional[Future],
+    ) -> bool:
+        """Save a frame computed by `_compute_in_worker` from its ring slot; False if it failed.
+
+        `result` is None for frames that failed to load. Frames the worker saved
+        itself have been journaled by it; the others are journaled here.
+        """
+        name = frame_id.base_name
+        if result is None:
+            self.journal.record(name, ok=False)
+            return False
+        release = None if slot is None else (lambda ok: ring.release(slot))
+        try:
+            failed_name, layout = result.result()
+            if failed_name is not None:
+                if release is not None:
+                    release(False)
+                return False
+            if layout is not None:
+                self._save_frame(frame_id, *_frame_from_slot(ring, layout, self._variant_identifier, frame_id))
+        except Exception as exc:  # noqa: BLE001
+            logging.exception("Failed processing %s: %s", name, exc)
+            self.journal.record(name, ok=False)
+            if release is not None:
+                self.file_service.when_written(name, lambda ok: None, release)
+            return False
+        if layout is not None:
+            self.file_service.when_written(name, lambda ok: self.journal.record(name, ok), release)
+        elif release is not None:
+            release(True)
+        return True
+
+    def _slot_bytes(self, raw: RawFrameData) -> int:
+        """Ring slot size for frames like `raw`: its inputs, the raw depth and all variants' outputs."""
+        height, width = raw.rgb_image.shape[:2]
+        pixels, variants = height * width, 1
+        augmentation = self.config.augmentation
+        if augmentation.enabled:
+            crop_width, crop_height = augmentation.crop_size
+            pixels = max(pixels, crop_width * crop_height)
+            variants = augmentation.variants_per_frame
+        # RGB, float32 depth, uint8/float32 HHA and uint8 mask per output pixel
+        output_bytes = pixels * (3 + 4 + 3 * 4 + 1)
+        depth_bytes = max(raw.depth_map_mm.nbytes, height * width * 4)
+        return raw.rgb_image.nbytes + 2 * depth_bytes + variants * output_bytes + (4 * variants + 3) * 64
+
+    def _worker_pool(self, workers: int) -> ProcessPoolExecutor:
+        """Process pool whose workers each build an orchestrator with this one's service types."""
+        service_types = (
+            type(self.file_service),
+            type(self.inpainting_service),
+            type(self.annotation_service),
+            type(self.augmentation_service),
+            type(self.hha_service),
+        )
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(self.config, self.run_dir, service_types),
+        )
+
+    def _process_isolated(self, frame_id: FrameIdentifier, loaded: Optional[Future] = None) -> Optional[str]:
+        """Process one frame, logging any error. Returns the base name on failure.
+
+        `loaded` is an optional future of `_load_frame` that was started ahead of time.
+        """
+        try:
+            with self._frame(frame_id.base_name):
+                if loaded is None:
+                    self.process_single_frame(frame_id)
+                else:
+                    with self._stage("wait_for_input"):
+                        raw, digests = loaded.result()
+                    self._process_loaded(frame_id, raw, digests)
+        except Exception as exc:  # noqa: BLE001
+            logging.exception("Failed processing %s: %s", frame_id.base_name, exc)
+            self.journal.record(frame_id.base_name, ok=False)
+            return frame_id.base_name
+        # Journal the frame once its queued outputs are on disk
+        name = frame_id.base_name
+        self.file_service.when_written(name, lambda ok: self.journal.record(name, ok))
+        return None
+
     def _validate_dimensions(self, raw: RawFrameData) -> None:
         rgb_h, rgb_w = raw.rgb_image.shape[:2]
         depth_h, depth_w = raw.depth_map_mm.shape[:2]
@@ -87,36 +439,381 @@ class PipelineOrchestrator:
             )
 
     def process_single_frame(self, frame_id: FrameIdentifier) -> None:
-        raw: RawFrameData = self.file_service.load_raw_data(frame_id)
+        with self._stage("load_raw_data"):
+            raw, digests = self._load_frame(frame_id)
+        self._process_loaded(frame_id, raw, digests)
+
+    def _load_frame(self, frame_id: FrameIdentifier) -> Tuple[RawFrameData, Tuple[str, str]]:
+        """Read a frame's inputs; safe to run on a loader thread (no instrumentation hooks)."""
+        digests = self._input_digests(frame_id)
+        return self._load_raw(frame_id, digests[0]), digests
+
+    def _process_loaded(self, frame_id: FrameIdentifier, raw: RawFrameData, digests: Tuple[str, str]) -> None:
+        _, processed = self._compute_frame(frame_id, raw, digests, save_raw_depth=True)
+        self._save_frame(frame_id, None, processed)
+
+    def _compute_frame(
+        self, frame_id: FrameIdentifier, raw: RawFrameData, digests: Tuple[str, str], save_raw_depth: bool = False
+    ) -> Tuple[np.ndarray, List[ProcessedFrameData]]:
+        """Run every compute stage of a loaded frame.
+
+        Returns the (registered) raw depth map and one `ProcessedFrameData` per
+        augmentation variant. With `save_raw_depth` the raw depth is saved right
+        away, so its write overlaps the remaining stages.
+        """
+        depth_digest, annotation_digest = digests
+        if self.registration_service is not None:
+            with self._stage("registration"):
+                raw = raw.model_copy(update={"depth_map_mm": self._register_depth(raw)})
         self._validate_dimensions(raw)
 
         # Save raw depth before inpainting
-        self.file_service.save_raw_depth_png(frame_id, raw.depth_map_mm, self.run_dir)
+        if save_raw_depth:
+            with self._stage("save_raw_depth"):
+                self.file_service.save_raw_depth(frame_id, raw.depth_map_mm, self.run_dir)
 
         # Inpainting (mm -> m inside service)
-        depth_filled_m = self.inpainting_service.apply(raw.depth_map_mm, self.config.inpainting.method)
+        inpainting_key = (depth_digest, self.config.inpainting.model_dump_json()) + self._registration_key(raw)
+        with self._stage("inpainting"):
+            depth_filled_m = self._cached(
+                "inpainted",
+                inpainting_key,
+                lambda: self.inpainting_service.apply(
+                    raw.depth_map_mm, self.config.inpainting.method, self.config.inpainting
+                ),
+            )
 
         # Annotation conversion (normalized polygons -> mask)
-        mask = self.annotation_service.convert_polygons_to_mask(raw.polygons, raw.rgb_image.shape[:2])
+        shape = raw.rgb_image.shape[:2]
+        with self._stage("annotation_mask"):
+            mask = self._cached(
+                "mask",
+                (annotation_digest, repr(shape)),
+                lambda: self.annotation_service.convert_polygons_to_mask(raw.polygons, shape),
+            )
+
+        # Augment synchronously (if enabled); several variants share the decoded,
+        # inpainted inputs above. A carried gravity estimate needs each variant's
+        # flip/rotation to be mapped into it.
+        carried_gravity = self.config.hha.gravity_mode != "per_frame"
+        with self._stage("augmentation"):
+            variants = self.augmentation_service.apply_variants(
+                raw.rgb_image, depth_filled_m, mask, self.config.augmentation, with_camera_rotation=carried_gravity
+            )
+
+        # HHA conversion using the intrinsics of the camera the depth is aligned to
+        cameras = self.config.cameras
+        intrinsics = cameras.rgb_camera_matrix if self.registration_service is not None else cameras.depth_camera_matrix
+        K = intrinsics.to_numpy_array()
+        hha_key: Optional[Tuple[str | bytes, ...]] = inpainting_key + (self._augmentation_key(), K.tobytes())
+        if self.config.hha.gravity_mode in HHAService.STATEFUL_GRAVITY_MODES:
+            # The estimate carried over from earlier frames is not part of any key,
+            # and a cache hit would also skip updating it
+            hha_key = None
+        else:
+            if carried_gravity:
+                hha_key += (self.config.hha.model_dump_json(),)
+            if self._hha_options:
+                # Banded normals may differ by rounding; keys without options stay unchanged
+                hha_key += (repr(sorted(self._hha_options.items())),)
+        with self._stage("hha"):
+            hha_images = self._variant_hha(variants, K.astype(np.float32), hha_key, carried_gravity)
+
+        processed = [
+            ProcessedFrameData(
+                identifier=self._variant_identifier(frame_id, index, len(variants)),
+                rgb_image=aug["rgb"],
+                depth_map_filled_m=aug["depth"],
+                hha_image=hha,
+                segmentation_mask=aug["mask"],
+            )
+            for index, (aug, hha) in enumerate(zip(variants, hha_images))
+        ]
+        return raw.depth_map_mm, processed
+
+    def _save_frame(
+        self, frame_id: FrameIdentifier, depth_mm: Optional[np.ndarray], processed: List[ProcessedFrameData]
+    ) -> None:
+        """Save a computed frame; `depth_mm` None means its raw depth was saved already."""
+        if depth_mm is not None:
+            with self._stage("save_raw_depth"):
+                self.file_service.save_raw_depth(frame_id, depth_mm, self.run_dir)
+        for data in processed:
+            with self._stage("save_processed_data"):
+                self.file_service.save_processed_data(data, self.run_dir, tag=frame_id.base_name)
+
+    def _variant_hha(
+        self,
+        variants: List[dict],
+        K: np.ndarray,
+        hha_key: Optional[Tuple[str | bytes, ...]],
+        carried_gravity: bool,
+    ) -> List[np.ndarray]:
+        """HHA images of all variants of a frame, converted as one micro-batch.
+
+        Cached variants are loaded (unless `hha_key` is None, which bypasses the
+        stage cache); the rest are grouped by shape (variants of a frame normally
+        share the crop size) and each group goes through a single
+        `HHAService.convert_batch` call.
+        """
+        use_cache = self.stage_cache is not None and hha_key is not None
+        hha_images: List[Optional[np.ndarray]] = [None] * len(variants)
+        if use_cache:
+            keys = [hha_key + (str(index),) for index in range(len(variants))]
+            keys = [self.stage_cache.key("hha", *parts) for parts in keys]
+            hha_images = [self.stage_cache.load("hha", key) for key in keys]
 
-        # Augment synchronously (if enabled)
-        aug = self.augmentation_service.apply(raw.rgb_image, depth_filled_m, mask, self.config.augmentation)
-        rgb_aug = aug["rgb"]
-        depth_aug = aug["depth"]
-        mask_aug = aug["mask"]
+        groups: Dict[tuple, List[int]] = {}
+        for index, hha in enumerate(hha_images):
+            if hha is None:
+                groups.setdefault(np.shape(variants[index]["depth"]), []).append(index)
+        for indices in groups.values():
+            rotations = None
+            if carried_gravity:
+                rotations = [variants[i]["camera_rotation"] @ self._depth_to_image_rotation() for i in indices]
+            batch = self.hha_service.convert_batch(
+                np.stack([np.asarray(variants[i]["depth"], dtype=np.float32) for i in indices]),
+                K,
+                camera_rotations=rotations,
+                **self._hha_options,
+            )
+            for index, hha in zip(indices, batch):
+                hha_images[index] = hha
+                if use_cache:
+                    self.stage_cache.store("hha", keys[index], hha)
+        return hha_images
 
-        # HHA conversion using depth camera intrinsics
-        K = self.config.cameras.depth_camera_matrix.to_numpy_array()
-        hha = self.hha_service.convert(depth_aug.astype(np.float32), K.astype(np.float32))
+    def _register_depth(self, raw: RawFrameData) -> np.ndarray:
+        """Align the raw depth map to the RGB image with the cached remap tables."""
+        cameras = self.config.cameras
+        maps = self.registration_service.maps(
+            cameras.depth_camera_matrix.to_numpy_array(),
+            cameras.rgb_camera_matrix.to_numpy_array(),
+            np.asarray(cameras.depth_to_rgb_rotation),
+            cameras.depth_to_rgb_translation_m,
+            self.config.registration.reference_depth_m,
+            raw.depth_map_mm.shape[:2],
+            raw.rgb_image.shape[:2],
+        )
+        return self.registration_service.register_depth(raw.depth_map_mm, maps)
+
+    def _depth_to_image_rotation(self) -> np.ndarray:
+        """Rotation from depth-camera directions to those of the (unaugmented) depth map."""
+        if self.registration_service is None:
+            return np.eye(3)
+        return np.asarray(self.config.cameras.depth_to_rgb_rotation, dtype=np.float64)
+
+    def _registration_key(self, raw: RawFrameData) -> Tuple[str, ...]:
+        """Cache key part for registered depth; empty (keys unchanged) when registration is off."""
+        if self.registration_service is None:
+            return ()
+        setup = self.config.cameras.model_dump_json() + self.config.registration.model_dump_json(
+            include={"reference_depth_m"}
+        )
+        return (setup, repr(raw.rgb_image.shape[:2]))
 
-        processed = ProcessedFrameData(
+    def _frame(self, name: str) -> ContextManager[None]:
+        return self.profiler.frame(name) if self.profiler is not None else contextlib.nullcontext()
+
+    def _stage(self, name: str) -> ContextManager[None]:
+        """Instrumentation hook around one stage call; a no-op unless profiling is enabled."""
+        return self.profiler.stage(name) if self.profiler is not None else contextlib.nullcontext()
+
+    def _input_digests(self, frame_id: FrameIdentifier) -> Tuple[str, str]:
+        """Content digests of the depth and annotation files; empty without a stage cache."""
+        if self.stage_cache is None:
+            return "", ""
+        return (
+            self.stage_cache.file_digest(frame_id.raw_depth_path),
+            self.stage_cache.file_digest(frame_id.raw_mask_path),
+        )
+
+    def _load_raw(self, frame_id: FrameIdentifier, depth_digest: str) -> RawFrameData:
+        if self.stage_cache is None:
+            return self.file_service.load_raw_data(frame_id)
+        depth_mm = self._cached(
+            "depth", (depth_digest,), lambda: self.file_service.load_depth_txt(frame_id.raw_depth_path)
+        )
+        return RawFrameData(
             identifier=frame_id,
-            rgb_image=rgb_aug,
-            depth_map_filled_m=depth_aug,
-            hha_image=hha,
-            segmentation_mask=mask_aug,
+            rgb_image=self.file_service.load_rgb(frame_id.raw_rgb_path),
+            depth_map_mm=depth_mm,
+            polygons=self.file_service.load_polygons(frame_id.raw_mask_path),
         )
-        self.file_service.save_processed_data(processed, self.run_dir)
 
+    def _augmentation_key(self) -> str:
+        """Config part that determines augmented depth; the variant count does not
+        change individual samples since they are drawn in sequence from one seed."""
+        config = self.config.augmentation
+        if not config.enabled:
+            return "disabled"
+        return config.model_dump_json(exclude={"variants_per_frame"})
+
+    def _cached(self, stage: str, key_parts: Tuple[str | bytes, ...], compute: Callable[[], np.ndarray]) -> np.ndarray:
+        """Run `compute` through the stage cache when one is configured."""
+        if self.stage_cache is None:
+            return compute()
+        return self.stage_cache.get_or_compute(stage, self.stage_cache.key(stage, *key_parts), compute)
 
+    def _variant_identifier(self, frame_id: FrameIdentifier, index: int, count: int) -> FrameIdentifier:
+        """Suffix the base name per augmentation variant; a single variant keeps it as is."""
+        if count == 1:
+            return frame_id
+        return frame_id.model_copy(update={"base_name": f"{frame_id.base_name}_v{index}"})
 
+
+def _limit_memory(limit_mb: int) -> None:
+    """Cap this process's data segment (heap and anonymous mappings) at `limit_mb`.
+
+    Allocations beyond the cap raise MemoryError inside the frame being processed,
+    which then fails in isolation like any other error. 0 disables the cap.
+    """
+    if not limit_mb:
+        return
+    try:
+        import resource
+    except ImportError:
+        logging.warning("execution.memory_limit_mb is not supported on this platform; ignoring it")
+        return
+    limit = limit_mb * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_DATA)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_DATA, (limit, hard))
+
+
+def _log_peak_rss(include_workers: bool) -> None:
+    try:
+        import resource
+    except ImportError:
+        return
+    # ru_maxrss is in KiB on Linux; children are the (already exited) pool workers
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if include_workers:
+        workers = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        logging.info("Peak RSS: %.0f MB in this process, %.0f MB in the largest worker", own, workers)
+    else:
+        logging.info("Peak RSS: %.0f MB", own)
+
+
+# Per-process orchestrator used by pool workers; built once in `_init_worker`.
+_WORKER: Optional[PipelineOrchestrator] = None
+
+
+def _init_worker(config: PipelineConfig, run_dir: Path, service_types: Tuple[type, ...]) -> None:
+    global _WORKER
+    _limit_memory(config.execution.memory_limit_mb)
+    file_cls, inpainting_cls, annotation_cls, augmentation_cls, hha_cls = service_types
+    _WORKER = PipelineOrchestrator(
+        config=config,
+        file_service=file_cls(),
+        inpainting_service=inpainting_cls(),
+        annotation_service=annotation_cls(),
+        augmentation_service=augmentation_cls(),
+        hha_service=hha_cls(),
+        run_dir=run_dir,
+    )
+    # Pool workers exit without returning control to us; finish the open shard and
+    # queued writes from multiprocessing's exit hook.
+    multiprocessing.util.Finalize(None, _WORKER.file_service.close, exitpriority=10)
+    # Lower priority: runs after the queued writes, which may still read ring slots
+    multiprocessing.util.Finalize(None, _close_ring, exitpriority=5)
+
+
+def _process_in_worker(frame_id: FrameIdentifier) -> Optional[str]:
+    assert _WORKER is not None, "worker was not initialized"
+    failed_name = _WORKER._process_isolated(frame_id)
+    # Results are reported per frame, so drain this frame's queued writes before
+    # returning; encoding still overlaps with the frame's remaining compute.
+    if _WORKER.file_service.flush() and failed_name is None:
+        failed_name = frame_id.base_name
+    return failed_name
+
+
+# Processed arrays a worker appends to a ring slot per variant, as '<field>/<variant>'
+_SLOT_FIELDS = ("rgb_image", "depth_map_filled_m", "hha_image", "segmentation_mask")
+
+# Ring attached by this worker, reused across frames
+_RING: Optional[SharedFrameRing] = None
+
+
+def _compute_in_worker(
+    frame_id: FrameIdentifier,
+    handle: RingHandle,
+    layout: SlotLayout,
+    polygons: List[Tuple[int, np.ndarray]],
+    digests: Tuple[str, str],
+) -> Tuple[Optional[str], Optional[SlotLayout]]:
+    """Compute a frame whose inputs are in a ring slot and append its outputs to the slot.
+
+    Returns:
+        Tuple[Optional[str], Optional[SlotLayout]]: The base name if the frame
+        failed, and the layout of the filled slot; None if the outputs did not fit
+        and the worker saved (and journaled) the frame itself.
+    """
+    global _RING
+    assert _WORKER is not None, "worker was not initialized"
+    if _RING is None or _RING.handle.name != handle.name:
+        _close_ring()
+        _RING = SharedFrameRing.attach(handle)
+    name = frame_id.base_name
+    try:
+        with _WORKER._frame(name):
+            inputs = _RING.arrays(layout)
+            raw = RawFrameData.model_construct(
+                identifier=frame_id, rgb_image=inputs["rgb"], depth_map_mm=inputs["depth"], polygons=polygons
+            )
+            depth_mm, processed = _WORKER._compute_frame(frame_id, raw, digests)
+            outputs = _RING.writer(layout)
+            try:
+                outputs.put("depth_raw", depth_mm)
+                for index, data in enumerate(processed):
+                    for field in _SLOT_FIELDS:
+                        outputs.put(f"{field}/{index}", getattr(data, field))
+            except SlotFull:
+                _WORKER._save_frame(frame_id, depth_mm, processed)
+                outputs = None
+    except Exception as exc:  # noqa: BLE001
+        logging.exception("Failed processing %s: %s", name, exc)
+        _WORKER.journal.record(name, ok=False)
+        return name, None
+    if outputs is not None:
+        return None, outputs.layout
+    _WORKER.file_service.when_written(name, lambda ok: _WORKER.journal.record(name, ok))
+    # The saved arrays may be views of the slot, which is reused after we return
+    if _WORKER.file_service.flush():
+        return name, None
+    return None, None
+
+
+def _close_ring() -> None:
+    """Unmap the ring this worker attached to, if any (the owner unlinks it)."""
+    global _RING
+    if _RING is not None:
+        _RING.close()
+        _RING = None
+
+
+def _process_unshared_in_worker(frame_id: FrameIdentifier) -> Tuple[Optional[str], None]:
+    """`_process_in_worker` for frames too large for the ring, with `_compute_in_worker`'s result type."""
+    return _process_in_worker(frame_id), None
+
+
+def _frame_from_slot(
+    ring: SharedFrameRing,
+    layout: SlotLayout,
+    variant_identifier: Callable[[FrameIdentifier, int, int], FrameIdentifier],
+    frame_id: FrameIdentifier,
+) -> Tuple[np.ndarray, List[ProcessedFrameData]]:
+    """Views of the raw depth and processed variants `_compute_in_worker` left in a slot."""
+    arrays = ring.arrays(layout)
+    count = sum(1 for name in arrays if name.startswith(f"{_SLOT_FIELDS[0]}/"))
+    processed = [
+        # Built from our own worker's outputs, so skip validation
+        ProcessedFrameData.model_construct(
+            identifier=variant_identifier(frame_id, index, count),
+            **{field: arrays[f"{field}/{index}"] for field in _SLOT_FIELDS},
+        )
+        for index in range(count)
+    ]
+    return arrays["depth_raw"], processed
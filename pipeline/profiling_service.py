@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import contextlib
+import cProfile
+import csv
+import heapq
+import json
+import os
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+class StageProfiler:
+    """Opt-in per-frame, per-stage instrumentation.
+
+    For every stage of every frame it records wall time, CPU time (process-wide,
+    so background writer threads are included) and, when `trace_memory` is set,
+    the peak of Python/NumPy heap allocations traced by `tracemalloc` above the
+    stage's starting point. Each process appends one JSON line per frame to
+    `<output_dir>/stages-<pid>.jsonl`, so pool workers need no coordination;
+    `summarize` merges them once the run is over.
+
+    With `profile_slowest` > 0 every frame runs under cProfile and each process
+    keeps the dumps of its N slowest frames in `<output_dir>/profiles`. Note that
+    profiling (and to a lesser degree memory tracing) inflates the timings.
+    """
+
+    def __init__(self, output_dir: Path, trace_memory: bool = True, profile_slowest: int = 0) -> None:
+        self.output_dir = Path(output_dir)
+        self.trace_memory = trace_memory
+        self.profile_slowest = profile_slowest
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        if profile_slowest:
+            (self.output_dir / "profiles").mkdir(exist_ok=True)
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        self._records_path = self.output_dir / f"stages-{os.getpid()}.jsonl"
+        self._current: Optional[Dict[str, Dict[str, float]]] = None
+        self._frame_base_memory = 0
+        self._frame_peak_memory = 0
+        # Min-heap of (wall seconds, frame name) for the slowest frames of this process
+        self._slowest: List[Tuple[float, str]] = []
+
+    @contextlib.contextmanager
+    def frame(self, name: str) -> Iterator[None]:
+        """Instrument everything inside the block as frame `name`."""
+        self._current = {}
+        failed = True
+        profile = cProfile.Profile() if self.profile_slowest else None
+        if self.trace_memory:
+            self._frame_base_memory = tracemalloc.get_traced_memory()[0]
+            self._frame_peak_memory = 0
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+            failed = False
+        finally:
+            if profile is not None:
+                profile.disable()
+            wall = time.perf_counter() - wall_start
+            record = {
+                "frame": name,
+                "failed": failed,
+                "total": {
+                    "wall_s": wall,
+                    "cpu_s": time.process_time() - cpu_start,
+                    "peak_mem_bytes": self._frame_peak_memory,
+                },
+                "stages": self._current,
+            }
+            self._current = None
+            with open(self._records_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+            if profile is not None:
+                self._keep_if_slowest(profile, name, wall)
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Instrument one stage call; repeated stages of a frame (e.g. per variant) add up."""
+        if self._current is None:
+            yield
+            return
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            base_memory = tracemalloc.get_traced_memory()[0]
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            peak = 0
+            if self.trace_memory:
+                peak_abs = tracemalloc.get_traced_memory()[1]
+                peak = peak_abs - base_memory
+                self._frame_peak_memory = max(self._frame_peak_memory, peak_abs - self._frame_base_memory)
+            entry = self._current.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0, "peak_mem_bytes": 0})
+            entry["wall_s"] += wall
+            entry["cpu_s"] += cpu
+            entry["peak_mem_bytes"] = max(entry["peak_mem_bytes"], peak)
+
+    def _keep_if_slowest(self, profile: cProfile.Profile, name: str, wall: float) -> None:
+        if len(self._slowest) >= self.profile_slowest:
+            if wall <= self._slowest[0][0]:
+                return
+            _, evicted = heapq.heappop(self._slowest)
+            _profile_path(self.output_dir, evicted).unlink(missing_ok=True)
+        heapq.heappush(self._slowest, (wall, name))
+        profile.dump_stats(str(_profile_path(self.output_dir, name)))
+
+    @staticmethod
+    def summarize(output_dir: Path, profile_slowest: int = 0) -> str:
+        """Merge per-process records into stages.csv/stages.json/summary.json.
+
+        Keeps only the cProfile dumps of the `profile_slowest` slowest frames overall.
+
+        Returns:
+            str: A p50/p95/max table per stage, ready to print.
+        """
+        output_dir = Path(output_dir)
+        records: List[dict] = []
+        for path in sorted(output_dir.glob("stages-*.jsonl")):
+            with open(path, "r", encoding="utf-8") as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+
+        columns = ("wall_s", "cpu_s", "peak_mem_bytes")
+        rows: List[Tuple[str, str, Dict[str, float]]] = []
+        for record in records:
+            for stage, metrics in record["stages"].items():
+                rows.append((record["frame"], stage, metrics))
+            rows.append((record["frame"], "total", record["total"]))
+
+        with open(output_dir / "stages.csv", "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("frame", "stage", *columns))
+            for frame, stage, metrics in rows:
+                writer.writerow((frame, stage, *(metrics[c] for c in columns)))
+        with open(output_dir / "stages.json", "w", encoding="utf-8") as f:
+            json.dump(records, f, indent=1)
+
+        by_stage: Dict[str, Dict[str, List[float]]] = {}
+        for _, stage, metrics in rows:
+            values = by_stage.setdefault(stage, {c: [] for c in columns})
+            for c in columns:
+                values[c].append(metrics[c])
+        summary = {
+            stage: {
+                column: {
+                    "p50": float(np.percentile(samples, 50)),
+                    "p95": float(np.percentile(samples, 95)),
+                    "max": float(np.max(samples)),
+                }
+                for column, samples in values.items()
+            }
+            for stage, values in by_stage.items()
+        }
+        slowest = sorted(records, key=lambda r: r["total"]["wall_s"], reverse=True)
+        with open(output_dir / "summary.json", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "frames": len(records),
+                    "failed_frames": sum(r["failed"] for r in records),
+                    "stages": summary,
+                    "slowest_frames": [(r["frame"], r["total"]["wall_s"]) for r in slowest[:10]],
+                },
+                f,
+                indent=2,
+            )
+
+        if profile_slowest:
+            keep = {_profile_path(output_dir, r["frame"]).name for r in slowest[:profile_slowest]}
+            for dump in (output_dir / "profiles").glob("*.prof"):
+                if dump.name not in keep:
+                    dump.unlink()
+
+        lines = [
+            f"{'stage':<20}{'wall p50':>10}{'p95':>10}{'max':>10}{'cpu p50':>10}{'mem p95':>10}{'mem max':>10}",
+        ]
+        for stage, metrics in summary.items():
+            wall, cpu, mem = metrics["wall_s"], metrics["cpu_s"], metrics["peak_mem_bytes"]
+            lines.append(
+                f"{stage:<20}{wall['p50']:>9.3f}s{wall['p95']:>9.3f}s{wall['max']:>9.3f}s{cpu['p50']:>9.3f}s"
+                f"{mem['p95'] / 2**20:>8.1f}MB{mem['max'] / 2**20:>8.1f}MB"
+            )
+        return "\n".join(lines)
+
+
+def _profile_path(output_dir: Path, frame: str) -> Path:
+    return Path(output_dir) / "profiles" / f"{frame}.prof"
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple, Union
+
+import cv2
+import numpy as np
+
+
+class RegistrationMaps(NamedTuple):
+    """Precomputed depth -> RGB lookup for `cv2.remap`.
+
+    For every RGB pixel, `map_x`/`map_y` give the depth-image pixel it samples and
+    `z_scale` the factor that turns that pixel's depth (along the depth camera's
+    optical axis) into depth along the RGB camera's axis; `z_offset_mm` is added
+    on top (the translation's z component).
+    """
+
+    map_x: np.ndarray
+    map_y: np.ndarray
+    z_scale: np.ndarray
+    z_offset_mm: float
+
+
+class RegistrationService:
+    """Aligns depth maps to the RGB camera's pixel grid.
+
+    The mapping depends only on both cameras' intrinsics, the depth -> RGB
+    extrinsics and the two resolutions, so it is computed once per combination
+    and reused for every frame: aligning a frame is then a single nearest-neighbour
+    `cv2.remap` plus a per-pixel scale. Maps are kept in memory and, with a
+    `cache_dir`, persisted as .npz files shared across runs and worker processes.
+
+    A fixed lookup table cannot model parallax, so points are assumed to lie at
+    `reference_depth_m`. The registration is exact for a pure rotation between
+    the cameras and otherwise off by `f * baseline * |1/z - 1/z_ref|` pixels.
+    """
+
+    # Bump when the map computation changes to invalidate persisted maps
+    MAPS_VERSION = "1"
+
+    def __init__(self, cache_dir: Optional[Union[str, Path]] = None) -> None:
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self._maps: Dict[str, RegistrationMaps] = {}
+
+    def maps(
+        self,
+        depth_K: np.ndarray,
+        rgb_K: np.ndarray,
+        rotation: np.ndarray,
+        translation_m: Sequence[float],
+        reference_depth_m: float,
+        depth_shape: Tuple[int, int],
+        rgb_shape: Tuple[int, int],
+    ) -> RegistrationMaps:
+        """Return (computing on first use) the maps for one camera setup.
+
+        Args:
+            depth_K: 3x3 depth camera intrinsics.
+            rgb_K: 3x3 RGB camera intrinsics.
+            rotation: 3x3 rotation taking depth-camera coordinates to RGB-camera coordinates.
+            translation_m: Depth -> RGB translation in meters.
+            reference_depth_m: Depth at which parallax is resolved.
+            depth_shape: Depth image (height, width).
+            rgb_shape: RGB image (height, width); the registered depth has this shape.
+        """
+        depth_K = np.asarray(depth_K, dtype=np.float64).reshape(3, 3)
+        rgb_K = np.asarray(rgb_K, dtype=np.float64).reshape(3, 3)
+        rotation = np.asarray(rotation, dtype=np.float64).reshape(3, 3)
+        translation = np.asarray(translation_m, dtype=np.float64).reshape(3)
+        depth_shape = (int(depth_shape[0]), int(depth_shape[1]))
+        rgb_shape = (int(rgb_shape[0]), int(rgb_shape[1]))
+
+        key = self._key(depth_K, rgb_K, rotation, translation, float(reference_depth_m), depth_shape, rgb_shape)
+        maps = self._maps.get(key)
+        if maps is None:
+            maps = self._load(key)
+            if maps is None:
+                maps = _compute_maps(depth_K, rgb_K, rotation, translation, float(reference_depth_m), rgb_shape)
+                self._store(key, maps)
+            self._maps[key] = maps
+        return maps
+
+    @staticmethod
+    def register_depth(depth_mm: np.ndarray, maps: RegistrationMaps) -> np.ndarray:
+        """Resample a depth map (millimeters, 0 = missing) onto the RGB grid.
+
+        Nearest-neighbour sampling keeps depth edges sharp and holes as zeros; RGB
+        pixels that see outside the depth image become holes too and are filled by
+        the inpainting stage like any other.
+        """
+        depth = np.asarray(depth_mm, dtype=np.float32)
+        registered = cv2.remap(
+            depth, maps.map_x, maps.map_y, interpolation=cv2.INTER_NEAREST, borderMode=cv2.BORDER_CONSTANT, borderValue=0
+        )
+        valid = registered > 0
+        registered *= maps.z_scale
+        if maps.z_offset_mm:
+            registered += np.float32(maps.z_offset_mm)
+        registered[~valid] = 0
+        np.maximum(registered, 0, out=registered)
+        return registered
+
+    def _key(self, *parts: object) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self.MAPS_VERSION.encode("utf-8"))
+        for part in parts:
+            data = part.tobytes() if isinstance(part, np.ndarray) else repr(part).encode("utf-8")
+            digest.update(len(data).to_bytes(8, "little"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        assert self.cache_dir is not None
+        return self.cache_dir / f"registration-{key}.npz"
+
+    def _load(self, key: str) -> Optional[RegistrationMaps]:
+        if self.cache_dir is None:
+            return None
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                return RegistrationMaps(data["map_x"], data["map_y"], data["z_scale"], float(data["z_offset_mm"]))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as exc:
+            logging.warning("Ignoring unreadable registration maps %s: %s", path, exc)
+            return None
+
+    def _store(self, key: str, maps: RegistrationMaps) -> None:
+        if self.cache_dir is None:
+            return
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as f:
+                np.savez(f, map_x=maps.map_x, map_y=maps.map_y, z_scale=maps.z_scale, z_offset_mm=maps.z_offset_mm)
+            os.replace(tmp_path, path)
+        except OSError as exc:
+            logging.warning("Could not persist registration maps to %s: %s", path, exc)
+
+
+def _compute_maps(
+    depth_K: np.ndarray,
+    rgb_K: np.ndarray,
+    rotation: np.ndarray,
+    translation: np.ndarray,
+    reference_depth_m: float,
+    rgb_shape: Tuple[int, int],
+) -> RegistrationMaps:
+    height, width = rgb_shape
+    # Back-project every RGB pixel to the reference depth (RGB camera frame)
+    us, vs = np.meshgrid(np.arange(width, dtype=np.float64), np.arange(height, dtype=np.float64))
+    pixels = np.stack([us, vs, np.ones_like(us)], axis=-1)
+    points_rgb = reference_depth_m * pixels @ np.linalg.inv(rgb_K).T
+
+    # X_rgb = R X_depth + t  =>  X_depth = R^T (X_rgb - t)
+    points_depth = (points_rgb - translation) @ rotation
+    projected = points_depth @ depth_K.T
+    z = projected[..., 2]
+    behind = z <= 0
+    z = np.where(behind, 1.0, z)
+    map_x = np.where(behind, -1.0, projected[..., 0] / z).astype(np.float32)
+    map_y = np.where(behind, -1.0, projected[..., 1] / z).astype(np.float32)
+
+    # A depth pixel's ray d (unit z) maps to RGB depth z_rgb = z_depth * (R d)_z + t_z
+    rays = np.stack([map_x, map_y, np.ones_like(map_x)], axis=-1).astype(np.float64) @ np.linalg.inv(depth_K).T
+    z_scale = (rays @ rotation[2]).astype(np.float32)
+    return RegistrationMaps(map_x, map_y, z_scale, float(translation[2] * 1000.0))
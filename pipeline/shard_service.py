@@ -0,0 +1,182 @@
+"""Packed shard export of processed frames and a memory-mapped reader.
+
+Shard format, version 1
+-----------------------
+A shard is a single little-endian binary file ``<prefix>-<seq>.bin``::
+
+    offset 0   header, 64 bytes
+               magic         8s   b"HHASHRD\\0"
+               version       u32  1
+               frame_count   u32
+               index_offset  u64  byte offset of the index
+               index_length  u64  byte length of the index
+               (zero padding up to 64 bytes)
+    offset 64  array data; every array starts on a 64-byte boundary and is
+               stored C-contiguous with no per-array header
+    ...        index: UTF-8 JSON
+               {"frames": [{"name": str,
+                            "arrays": {key: {"offset": int,
+                                             "dtype": numpy dtype str, e.g. "|u1", "<f4",
+                                             "shape": [int, ...]}}}]}
+
+Frames exported by the pipeline carry the keys 'rgb' (uint8 HxWx3, BGR),
+'depth' (float32 HxW, meters), 'hha' (HxWx3 as produced by the HHA service)
+and 'mask' (uint8 HxW). Shapes may differ between frames.
+
+Shards are written under a '.partial' name and renamed when closed, so a reader
+never sees an incomplete file. Readers must reject unknown magic or versions.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import struct
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+SHARD_MAGIC = b"HHASHRD\0"
+SHARD_VERSION = 1
+SHARD_SUFFIX = ".bin"
+_HEADER = struct.Struct("<8sIIQQ")
+_HEADER_SIZE = 64
+_ALIGNMENT = 64
+
+
+class ShardWriter:
+    """Appends frames to packed shards, starting a new shard past `max_bytes`.
+
+    Frames become readable only when their shard is finished; `on_finish`, if
+    given, is then called with the names of the frames it holds. Existing shard
+    files are never overwritten, so a resumed run can reuse the prefix.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        prefix: str = "shard",
+        max_bytes: int = 1 << 30,
+        on_finish: Optional[Callable[[List[str]], None]] = None,
+    ) -> None:
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.max_bytes = int(max_bytes)
+        self.on_finish = on_finish
+        self._seq = 0
+        self._file = None
+        self._path: Optional[Path] = None
+        self._frames: List[dict] = []
+
+    def append(self, name: str, arrays: Dict[str, np.ndarray]) -> None:
+        """Write one frame's arrays to the current shard."""
+        if self._file is None:
+            self._open()
+        elif self._file.tell() >= self.max_bytes:
+            self._finish()
+            self._open()
+
+        entry: Dict[str, dict] = {}
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            offset = self._pad()
+            self._file.write(array.reshape(-1).view(np.uint8))
+            entry[key] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        self._frames.append({"name": name, "arrays": entry})
+
+    def close(self) -> None:
+        """Finish the current shard, if any."""
+        if self._file is not None:
+            self._finish()
+
+    def _open(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        final = self.directory / f"{self.prefix}-{self._seq:05d}{SHARD_SUFFIX}"
+        while final.exists():
+            self._seq += 1
+            final = self.directory / f"{self.prefix}-{self._seq:05d}{SHARD_SUFFIX}"
+        self._seq += 1
+        self._path = final
+        self._file = open(final.with_name(final.name + ".partial"), "wb")
+        self._file.write(b"\0" * _HEADER_SIZE)
+        self._frames = []
+
+    def _pad(self) -> int:
+        position = self._file.tell()
+        padding = -position % _ALIGNMENT
+        if padding:
+            self._file.write(b"\0" * padding)
+        return position + padding
+
+    def _finish(self) -> None:
+        index = json.dumps({"frames": self._frames}, separators=(",", ":")).encode("utf-8")
+        index_offset = self._pad()
+        self._file.write(index)
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(SHARD_MAGIC, SHARD_VERSION, len(self._frames), index_offset, len(index)))
+        self._file.close()
+        os.replace(self._file.name, self._path)
+        names = [frame["name"] for frame in self._frames]
+        self._file = None
+        self._frames = []
+        if self.on_finish is not None:
+            self.on_finish(names)
+
+
+class ShardReader:
+    """Random access to frames stored in one shard file or a directory of shards.
+
+    Frames are returned as read-only, zero-copy views into memory-mapped shards.
+    A frame stored more than once (a resumed run re-exports frames whose shard was
+    finished but not yet journaled) is served once, from its copy in the last shard
+    by file name, at the position of its first copy.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        path = Path(path)
+        files = sorted(path.glob(f"*{SHARD_SUFFIX}")) if path.is_dir() else [path]
+        self._maps: List[np.memmap] = []
+        latest: Dict[str, tuple] = {}  # name -> (shard number, frame entry)
+        for number, shard_path in enumerate(files):
+            mapped, frames = self._open_shard(shard_path)
+            self._maps.append(mapped)
+            for frame in frames:
+                latest[frame["name"]] = (number, frame)
+        self._frames: List[tuple] = list(latest.values())
+        self._by_name = {name: i for i, name in enumerate(latest)}
+
+    @staticmethod
+    def _open_shard(path: Path) -> tuple:
+        mapped = np.memmap(path, dtype=np.uint8, mode="r")
+        if len(mapped) < _HEADER_SIZE:
+            raise ValueError(f"Not a shard file (too short): {path}")
+        magic, version, count, index_offset, index_length = _HEADER.unpack_from(mapped, 0)
+        if magic != SHARD_MAGIC:
+            raise ValueError(f"Not a shard file (bad magic): {path}")
+        if version != SHARD_VERSION:
+            raise ValueError(f"Unsupported shard version {version} in {path}")
+        index = json.loads(bytes(mapped[index_offset:index_offset + index_length]).decode("utf-8"))
+        frames = index["frames"]
+        if len(frames) != count:
+            raise ValueError(f"Shard index does not match its header: {path}")
+        return mapped, frames
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    @property
+    def names(self) -> List[str]:
+        return [frame["name"] for _, frame in self._frames]
+
+    def index_of(self, name: str) -> int:
+        return self._by_name[name]
+
+    def __getitem__(self, index: int) -> Dict[str, np.ndarray]:
+        """Return {key: array view} for the frame at `index`."""
+        number, frame = self._frames[index]
+        mapped = self._maps[number]
+        return {
+            key: np.ndarray(tuple(spec["shape"]), dtype=np.dtype(spec["dtype"]), buffer=mapped, offset=spec["offset"])
+            for key, spec in frame["arrays"].items()
+        }
@@ -0,0 +1,150 @@
+"""Shared-memory transport of frame arrays between the pipeline and pool workers.
+
+A `SharedFrameRing` is one `multiprocessing.shared_memory` block cut into
+equally sized slots. The owning process `acquire`s a free slot, fills it through
+a `SlotWriter` and sends only the slot number and its `SlotLayout` (names,
+offsets, shapes, dtypes) to a worker, which attaches to the block once and
+reads the arrays as zero-copy views; results travel back the same way. Slots
+are `release`d by the owner once everything reading them is done.
+
+Containers on this path use `__slots__` instead of pydantic models: they are
+created for every frame and only ever hold data produced by the pipeline itself.
+"""
+
+from __future__ import annotations
+
+import threading
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+_ALIGNMENT = 64
+
+
+class ArraySpec:
+    """Where one array lives inside a slot."""
+
+    __slots__ = ("offset", "shape", "dtype")
+
+    def __init__(self, offset: int, shape: Tuple[int, ...], dtype: str) -> None:
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
+
+    def __reduce__(self) -> tuple:
+        return ArraySpec, (self.offset, self.shape, self.dtype)
+
+
+class SlotLayout:
+    """Named arrays stored in one slot, in the order they were written."""
+
+    __slots__ = ("slot", "arrays")
+
+    def __init__(self, slot: int, arrays: Optional[Dict[str, ArraySpec]] = None) -> None:
+        self.slot = slot
+        self.arrays: Dict[str, ArraySpec] = arrays if arrays is not None else {}
+
+    def __reduce__(self) -> tuple:
+        return SlotLayout, (self.slot, self.arrays)
+
+
+class RingHandle:
+    """Everything a process needs to attach to a ring."""
+
+    __slots__ = ("name", "slots", "slot_bytes")
+
+    def __init__(self, name: str, slots: int, slot_bytes: int) -> None:
+        self.name = name
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+
+    def __reduce__(self) -> tuple:
+        return RingHandle, (self.name, self.slots, self.slot_bytes)
+
+
+class SlotFull(Exception):
+    """Raised when arrays do not fit into the remaining space of a slot."""
+
+
+class SlotWriter:
+    """Copies arrays into consecutive, aligned positions of one slot."""
+
+    __slots__ = ("_ring", "_used", "layout")
+
+    def __init__(self, ring: SharedFrameRing, layout: SlotLayout) -> None:
+        self._ring = ring
+        self._used = max((spec.offset + _nbytes(spec) for spec in layout.arrays.values()), default=0)
+        self.layout = layout
+
+    def put(self, name: str, array: np.ndarray) -> None:
+        """Copy `array` into the slot under `name`; raises `SlotFull` if it does not fit."""
+        array = np.asarray(array)
+        offset = self._used + (-self._used % _ALIGNMENT)
+        if offset + array.nbytes > self._ring.slot_bytes:
+            raise SlotFull(f"{name} ({array.nbytes} bytes) does not fit into slot {self.layout.slot}")
+        spec = ArraySpec(offset, tuple(array.shape), array.dtype.str)
+        np.copyto(self._ring.view(self.layout.slot, spec), array, casting="no")
+        self.layout.arrays[name] = spec
+        self._used = offset + array.nbytes
+
+
+class SharedFrameRing:
+    """Fixed pool of shared-memory slots for frame arrays (see the module docstring).
+
+    The creating process owns the block and must `close` it, which also unlinks
+    it; attached processes only `close` their mapping. `acquire` and `release`
+    are thread-safe but only meaningful in the owning process.
+    """
+
+    def __init__(self, slots: int, slot_bytes: int, handle: Optional[RingHandle] = None) -> None:
+        self.slots = int(slots)
+        self.slot_bytes = int(slot_bytes) + (-int(slot_bytes) % _ALIGNMENT)
+        self._owner = handle is None
+        if handle is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=self.slots * self.slot_bytes)
+        else:
+            self._shm = shared_memory.SharedMemory(name=handle.name)
+        self._free: List[int] = list(range(self.slots))
+        self._available = threading.Condition()
+
+    @classmethod
+    def attach(cls, handle: RingHandle) -> "SharedFrameRing":
+        return cls(handle.slots, handle.slot_bytes, handle)
+
+    @property
+    def handle(self) -> RingHandle:
+        return RingHandle(self._shm.name, self.slots, self.slot_bytes)
+
+    def acquire(self, timeout: Optional[float] = None) -> Optional[int]:
+        """Take a free slot, waiting up to `timeout` seconds (None: forever); None on timeout."""
+        with self._available:
+            if not self._available.wait_for(lambda: self._free, timeout):
+                return None
+            return self._free.pop()
+
+    def release(self, slot: int) -> None:
+        with self._available:
+            self._free.append(slot)
+            self._available.notify()
+
+    def writer(self, layout_or_slot: SlotLayout | int) -> SlotWriter:
+        """Writer appending to a slot (given by number, or its layout to add to it)."""
+        layout = layout_or_slot if isinstance(layout_or_slot, SlotLayout) else SlotLayout(layout_or_slot)
+        return SlotWriter(self, layout)
+
+    def view(self, slot: int, spec: ArraySpec) -> np.ndarray:
+        return np.ndarray(spec.shape, np.dtype(spec.dtype), self._shm.buf, slot * self.slot_bytes + spec.offset)
+
+    def arrays(self, layout: SlotLayout) -> Dict[str, np.ndarray]:
+        """Zero-copy views of all arrays in `layout`; valid until the slot is released."""
+        return {name: self.view(layout.slot, spec) for name, spec in layout.arrays.items()}
+
+    def close(self) -> None:
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def _nbytes(spec: ArraySpec) -> int:
+    return int(np.prod(spec.shape, dtype=np.int64)) * np.dtype(spec.dtype).itemsize
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+import cv2
+import numpy as np
+
+
+class AsyncImageWriter:
+    """Background image encoder/writer with a bounded number of pending writes.
+
+    Paths ending in '.npy'/'.npz' are saved as (compressed) NumPy arrays, anything
+    else is encoded by OpenCV according to its extension.
+
+    `submit` hands an image to a small thread pool (OpenCV releases the GIL while
+    encoding) and returns immediately unless `max_pending` writes are already in
+    flight, in which case it blocks until one finishes. `flush` is the barrier: it
+    waits for everything submitted so far and reports which tags failed.
+    """
+
+    def __init__(self, threads: int = 2, max_pending: int = 16) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="image-writer")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending: List[Future] = []
+        # Futures per tag not yet handed to `when_done`
+        self._by_tag: Dict[str, List[Future]] = {}
+
+    def submit(
+        self,
+        path: Union[str, Path],
+        image: np.ndarray,
+        params: Sequence[int] = (),
+        tag: Optional[str] = None,
+    ) -> None:
+        """Queue `image` to be written to `path`; `tag` names the owner in failure reports.
+
+        The caller must not modify `image` afterwards.
+        """
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(write_image, str(path), image, list(params))
+        except BaseException:
+            self._slots.release()
+            raise
+        future.tag = tag  # type: ignore[attr-defined]
+        future.add_done_callback(lambda _: self._slots.release())
+        with self._lock:
+            self._pending.append(future)
+            if tag is not None:
+                self._by_tag.setdefault(tag, []).append(future)
+
+    def when_done(self, tag: str, callback: Callable[[bool], None]) -> None:
+        """Call `callback(ok)` once every write submitted so far under `tag` has finished.
+
+        `ok` is False if any of them failed. The callback runs on a writer thread, or
+        right away if nothing is pending.
+        """
+        with self._lock:
+            futures = self._by_tag.pop(tag, [])
+        countdown = Countdown(len(futures), callback)
+        for future in futures:
+            future.add_done_callback(lambda f: countdown.done(f.exception() is None))
+
+    def flush(self) -> List[str]:
+        """Wait for all submitted writes.
+
+        Returns:
+            List[str]: Distinct tags of failed writes, in submission order; each
+            failure is logged.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._by_tag.clear()
+
+        failed: List[str] = []
+        for future in pending:
+            exc = future.exception()
+            if exc is None:
+                continue
+            tag = getattr(future, "tag", None)
+            logging.error("Failed writing image for %s: %s", tag, exc)
+            if tag is not None and tag not in failed:
+                failed.append(tag)
+        return failed
+
+    def close(self) -> List[str]:
+        """Flush and stop the worker threads."""
+        failed = self.flush()
+        self._executor.shutdown(wait=True)
+        return failed
+
+
+class Countdown:
+    """Calls `callback(ok)` after `count` calls of `done(ok)`; `ok` is False if any call was."""
+
+    def __init__(self, count: int, callback: Callable[[bool], None]) -> None:
+        self._remaining = count
+        self._ok = True
+        self._callback = callback
+        self._lock = threading.Lock()
+        if count == 0:
+            callback(True)
+
+    def done(self, ok: bool = True) -> None:
+        with self._lock:
+            self._ok = self._ok and ok
+            self._remaining -= 1
+            finished = self._remaining == 0
+        if finished:
+            self._callback(self._ok)
+
+
+def write_image(path: str, image: np.ndarray, params: Sequence[int] = ()) -> None:
+    """Write `image` in the format given by the extension of `path`; `params` go to `cv2.imwrite`."""
+    if path.endswith(".npy"):
+        np.save(path, image)
+    elif path.endswith(".npz"):
+        np.savez_compressed(path, image=image)
+    elif not cv2.imwrite(path, image, list(params)):
+        raise OSError(f"cv2.imwrite could not write {path}")
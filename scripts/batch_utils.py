@@ -0,0 +1,178 @@
+"""Directory/glob batch mode shared by the scripts/run_*.py stage tools.
+
+A batch is a list of `BatchItem`s (the input files of one frame and the files it
+produces). Items whose outputs are newer than all of their inputs are skipped
+unless forced; the rest run in this process or on a `--workers` process pool
+whose workers build their services once, and a throughput summary is printed.
+"""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+# Suffixes the pipeline and these tools append to a frame's base name
+FRAME_SUFFIXES = ("_depth_filled", "_depth_raw", "_depth", "_mask", "_rgb", "_hha")
+_GLOB_CHARS = set("*?[")
+
+
+class BatchItem(NamedTuple):
+    name: str
+    inputs: Tuple[Path, ...]
+    outputs: Tuple[Path, ...]
+
+
+def add_batch_arguments(parser: argparse.ArgumentParser, default_pattern: str) -> None:
+    """Add the options common to all batch modes."""
+    parser.add_argument(
+        "--pattern", default=default_pattern, help=f"Glob for files inside input directories (default: {default_pattern})"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for batch mode (1 = in-process)")
+    parser.add_argument("--force", action="store_true", help="Reprocess items whose outputs are up to date")
+
+
+def expand_inputs(spec: str, pattern: str) -> List[Path]:
+    """Files named by `spec`: a directory (filtered by `pattern`), a glob or a single file."""
+    path = Path(spec)
+    if path.is_dir():
+        files = path.glob(pattern)
+    elif _GLOB_CHARS & set(spec):
+        files = (Path(p) for p in glob.glob(spec, recursive=True))
+    else:
+        files = [path]
+    return sorted(p for p in files if p.is_file())
+
+
+def frame_key(path: Path) -> str:
+    """Frame name of a file: its name without extension (and '.gz') and without a known suffix."""
+    name = path.name[:-3] if path.name.endswith(".gz") else path.name
+    name = Path(name).stem
+    for suffix in FRAME_SUFFIXES:
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+    return name
+
+
+def index_by_frame(files: Iterable[Path]) -> Dict[str, Path]:
+    return {frame_key(path): path for path in files}
+
+
+def write_image(path: Path, image: np.ndarray) -> None:
+    """Write an image atomically, so an interrupted run never leaves an output that looks up to date."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.stem}.{os.getpid()}.tmp{path.suffix}")
+    if not cv2.imwrite(str(tmp_path), image):
+        raise OSError(f"Failed to write image: {path}")
+    os.replace(tmp_path, path)
+
+
+def settings_stamp(out_dir: Path, name: str, settings: str) -> Path:
+    """A file in `out_dir` holding `settings`, rewritten (and so newer) only when they change.
+
+    Pass it in `extra_inputs` for options that change the outputs but live on the
+    command line rather than in a config file.
+    """
+    path = out_dir / f".{name}.settings"
+    try:
+        if path.read_text(encoding="utf-8") == settings:
+            return path
+    except FileNotFoundError:
+        pass
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(settings, encoding="utf-8")
+    os.replace(tmp_path, path)
+    return path
+
+
+def is_up_to_date(item: BatchItem, extra_inputs: Sequence[Path] = ()) -> bool:
+    """True if every output exists and is newer than every input (and `extra_inputs`, e.g. the config)."""
+    try:
+        newest_input = max(os.stat(p).st_mtime_ns for p in (*item.inputs, *extra_inputs))
+        oldest_output = min(os.stat(p).st_mtime_ns for p in item.outputs)
+    except (FileNotFoundError, ValueError):
+        return False
+    return oldest_output >= newest_input
+
+
+def run_batch(
+    items: List[BatchItem],
+    process: Callable[[BatchItem], None],
+    initializer: Callable[..., None],
+    initargs: tuple,
+    workers: int,
+    force: bool = False,
+    extra_inputs: Sequence[Path] = (),
+    desc: str = "Processing",
+) -> int:
+    """Process `items` and print a throughput summary.
+
+    `initializer(*initargs)` runs once per process (this one, or each pool worker)
+    before any item; `process` must be a module-level function so the pool can
+    pickle it.
+
+    Returns:
+        int: Number of failed items, suitable as an exit status.
+    """
+    pending = items if force else [item for item in items if not is_up_to_date(item, extra_inputs)]
+    skipped = len(items) - len(pending)
+    input_bytes = sum(os.path.getsize(p) for item in pending for p in item.inputs)
+
+    failures: List[Tuple[str, str]] = []
+    start = time.perf_counter()
+    if pending:
+        if workers <= 1 or len(pending) == 1:
+            initializer(*initargs)
+            results: Iterable[Optional[str]] = map(_Guarded(process), pending)
+            failures = _collect(pending, results, desc)
+        else:
+            workers = min(workers, len(pending))
+            chunk_size = max(1, len(pending) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+                results = executor.map(_Guarded(process), pending, chunksize=chunk_size)
+                failures = _collect(pending, results, desc)
+    elapsed = time.perf_counter() - start
+
+    done = len(pending) - len(failures)
+    seconds = max(elapsed, 1e-9)
+    print(
+        f"{done} processed, {skipped} up to date, {len(failures)} failed in {elapsed:.1f} s "
+        f"({len(pending) / seconds:.2f} items/s, {input_bytes / 2**20 / seconds:.1f} MB/s read, "
+        f"{max(1, workers)} worker(s))"
+    )
+    for name, error in failures:
+        print(f"  failed: {name}: {error}")
+    return len(failures)
+
+
+class _Guarded:
+    """Picklable wrapper turning an item's exception into an error message."""
+
+    def __init__(self, process: Callable[[BatchItem], None]) -> None:
+        self.process = process
+
+    def __call__(self, item: BatchItem) -> Optional[str]:
+        try:
+            self.process(item)
+        except Exception as exc:  # noqa: BLE001
+            logging.debug("Failed processing %s", item.name, exc_info=True)
+            return f"{type(exc).__name__}: {exc}"
+        return None
+
+
+def _collect(items: List[BatchItem], results: Iterable[Optional[str]], desc: str) -> List[Tuple[str, str]]:
+    failures = []
+    for item, error in tqdm(zip(items, results), total=len(items), desc=desc):
+        if error is not None:
+            failures.append((item.name, error))
+    return failures
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+import sys
+
+# Ensure project root is on sys.path for 'pipeline' imports
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from pipeline.partition_service import PartitionService
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Merge the run directories of sharded runs (main.py --shard-index/--num-shards) into one dataset"
+    )
+    parser.add_argument("run_dirs", nargs="+", help="Finished run directories, one per shard")
+    parser.add_argument("--output", required=True, help="Merged dataset directory")
+    parser.add_argument("--symlink", action="store_true", help="Symlink files instead of hard-linking them")
+    parser.add_argument("--allow-partial", action="store_true", help="Exit 0 even if some shards are missing")
+    args = parser.parse_args()
+
+    merged = PartitionService().merge(args.run_dirs, args.output, symlink=args.symlink)
+    print(
+        f"Merged {len(merged['sources'])} run(s) of {merged['num_shards']} shard(s): "
+        f"{len(merged['frames'])} frames, {len(merged['failed'])} failed, {merged['files']} files linked into {args.output}"
+    )
+    if merged["missing_shards"]:
+        print(f"Missing shards: {', '.join(map(str, merged['missing_shards']))}")
+        if not args.allow_partial:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import argparse
 from pathlib import Path
-from typing import List, Tuple
+from typing import Optional
 
 import sys
 
@@ -15,46 +15,70 @@ import cv2
 import numpy as np
 
 from pipeline.annotation_service import AnnotationService
+from scripts.batch_utils import (
+    BatchItem,
+    add_batch_arguments,
+    expand_inputs,
+    frame_key,
+    index_by_frame,
+    run_batch,
+    write_image,
+)
 
+# Per-process state, built once by `_init_worker`
+_ANNOTATION: Optional[AnnotationService] = None
 
-def _read_polygons_from_txt(path: str) -> List[Tuple[int, np.ndarray]]:
-    polygons: list[tuple[int, np.ndarray]] = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            parts = line.strip().split()
-            if not parts:
-                continue
-            class_id = int(parts[0])
-            coords = np.array(list(map(float, parts[1:])), dtype=np.float32)
-            if coords.size % 2 != 0:
-                continue
-            coords = coords.reshape(-1, 2)
-            polygons.append((class_id, coords))
-    return polygons
 
+def _init_worker() -> None:
+    global _ANNOTATION
+    _ANNOTATION = AnnotationService()
 
-def main() -> None:
-    parser = argparse.ArgumentParser(description="Convert YOLO-like polygons to mask")
-    parser.add_argument("--annotation", required=True, help="Path to annotation .txt file")
-    parser.add_argument("--rgb", required=True, help="Path to corresponding RGB image to infer size")
-    parser.add_argument("--output", required=True, help="Path to output mask .png")
-    args = parser.parse_args()
 
-    rgb = cv2.imread(args.rgb, cv2.IMREAD_COLOR)
+def _process(item: BatchItem) -> None:
+    annotation_path, rgb_path = item.inputs
+    rgb = cv2.imread(str(rgb_path), cv2.IMREAD_COLOR)
     if rgb is None:
-        raise FileNotFoundError(f"Cannot read RGB image: {args.rgb}")
+        raise FileNotFoundError(f"Cannot read RGB image: {rgb_path}")
     h, w = rgb.shape[:2]
 
-    polygons = _read_polygons_from_txt(args.annotation)
-    mask = AnnotationService().convert_polygons_to_mask(polygons, (h, w))
+    mask = _ANNOTATION.convert_polygons_to_mask(_ANNOTATION.read_polygons(annotation_path), (h, w))
+    write_image(item.outputs[0], mask.astype(np.uint8))
 
-    out_path = Path(args.output)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    cv2.imwrite(str(out_path), mask.astype(np.uint8))
 
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert YOLO-like polygons to mask")
+    parser.add_argument("--annotation", help="Path to annotation .txt file")
+    parser.add_argument("--rgb", help="Path to corresponding RGB image to infer size")
+    parser.add_argument("--output", help="Path to output mask .png")
+    parser.add_argument("--annotation_dir", help="Directory (filtered by --pattern) or glob of annotation files")
+    parser.add_argument("--rgb_dir", help="Directory or glob of RGB images, matched to annotations by name")
+    parser.add_argument("--output_dir", help="Directory for <name>_mask.png outputs")
+    add_batch_arguments(parser, default_pattern="*.txt")
+    args = parser.parse_args()
 
-if __name__ == "__main__":
-    main()
-
+    if args.annotation_dir is None:
+        if None in (args.annotation, args.rgb, args.output):
+            parser.error("either --annotation/--rgb/--output or --annotation_dir/--rgb_dir/--output_dir is required")
+        _init_worker()
+        inputs = (Path(args.annotation), Path(args.rgb))
+        _process(BatchItem(inputs[0].name, inputs, (Path(args.output),)))
+        return
+    if args.rgb_dir is None or args.output_dir is None:
+        parser.error("--rgb_dir and --output_dir are required with --annotation_dir")
+
+    rgb_files = index_by_frame(expand_inputs(args.rgb_dir, "*.*"))
+    out_dir = Path(args.output_dir)
+    items = []
+    for annotation_path in expand_inputs(args.annotation_dir, args.pattern):
+        frame = frame_key(annotation_path)
+        if frame not in rgb_files:
+            print(f"Skipping {annotation_path.name}: no matching RGB image")
+            continue
+        items.append(BatchItem(frame, (annotation_path, rgb_files[frame]), (out_dir / f"{frame}_mask.png",)))
+
+    failed = run_batch(items, _process, _init_worker, (), args.workers, args.force, desc="Annotations")
+    sys.exit(1 if failed else 0)
 
 
+if __name__ == "__main__":
+    main()
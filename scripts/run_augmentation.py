@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import argparse
 from pathlib import Path
+from typing import Optional
 
 import sys
 
@@ -15,46 +16,97 @@ import numpy as np
 
 from pipeline.config_service import ConfigService
 from pipeline.augmentation_service import AugmentationService
+from pipeline.data_models import PipelineConfig
+from scripts.batch_utils import BatchItem, add_batch_arguments, expand_inputs, index_by_frame, run_batch, write_image
 
+OUTPUT_NAMES = ("rgb_aug.png", "depth_aug.png", "mask_aug.png")
+
+# Per-process state, built once by `_init_worker`
+_AUGMENTATION: Optional[AugmentationService] = None
+_CONFIG: Optional[PipelineConfig.AugmentationConfig] = None
 
-def main() -> None:
-    parser = argparse.ArgumentParser(description="Apply synchronous augmentations to RGB/Depth/Mask")
-    parser.add_argument("--rgb", required=True, help="Path to RGB image")
-    parser.add_argument("--depth", required=True, help="Path to depth (uint16 mm) or .npy (m)")
-    parser.add_argument("--mask", required=True, help="Path to mask (uint8)")
-    parser.add_argument("--config", required=True, help="Path to YAML config file")
-    parser.add_argument("--output_dir", required=True, help="Dir to save augmented outputs")
-    args = parser.parse_args()
 
-    rgb = cv2.imread(args.rgb, cv2.IMREAD_COLOR)
+def _init_worker(config_path: str) -> None:
+    global _AUGMENTATION, _CONFIG
+    _CONFIG = ConfigService().load_config(config_path).augmentation
+    _AUGMENTATION = AugmentationService()
+
+
+def _process(item: BatchItem) -> None:
+    rgb_path, depth_path, mask_path = item.inputs
+    rgb = cv2.imread(str(rgb_path), cv2.IMREAD_COLOR)
     if rgb is None:
-        raise FileNotFoundError(f"Cannot read RGB image: {args.rgb}")
+        raise FileNotFoundError(f"Cannot read RGB image: {rgb_path}")
 
-    if args.depth.endswith(".npy"):
-        depth_m = np.load(args.depth).astype(np.float32)
+    if depth_path.suffix == ".npy":
+        depth_m = np.load(depth_path).astype(np.float32)
     else:
-        depth_mm = cv2.imread(args.depth, cv2.IMREAD_UNCHANGED)
+        depth_mm = cv2.imread(str(depth_path), cv2.IMREAD_UNCHANGED)
         if depth_mm is None:
-            raise FileNotFoundError(f"Cannot read depth image: {args.depth}")
+            raise FileNotFoundError(f"Cannot read depth image: {depth_path}")
         depth_m = depth_mm.astype(np.float32) / 1000.0
 
-    mask = cv2.imread(args.mask, cv2.IMREAD_UNCHANGED)
+    mask = cv2.imread(str(mask_path), cv2.IMREAD_UNCHANGED)
     if mask is None:
-        raise FileNotFoundError(f"Cannot read mask image: {args.mask}")
+        raise FileNotFoundError(f"Cannot read mask image: {mask_path}")
 
-    cfg = ConfigService().load_config(args.config)
-    result = AugmentationService().apply(rgb, depth_m, mask, cfg.augmentation)
+    result = _AUGMENTATION.apply(rgb, depth_m, mask, _CONFIG)
 
-    out_dir = Path(args.output_dir)
-    out_dir.mkdir(parents=True, exist_ok=True)
-    cv2.imwrite(str(out_dir / "rgb_aug.png"), result["rgb"]) 
+    rgb_out, depth_out, mask_out = item.outputs
+    write_image(rgb_out, result["rgb"])
     depth_u16 = np.clip(np.round(result["depth"] * 1000.0), 0, 65535).astype(np.uint16)
-    cv2.imwrite(str(out_dir / "depth_aug.png"), depth_u16)
-    cv2.imwrite(str(out_dir / "mask_aug.png"), result["mask"].astype(np.uint8))
+    write_image(depth_out, depth_u16)
+    write_image(mask_out, result["mask"].astype(np.uint8))
 
 
-if __name__ == "__main__":
-    main()
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Apply synchronous augmentations to RGB/Depth/Mask")
+    parser.add_argument("--rgb", help="Path to RGB image")
+    parser.add_argument("--depth", help="Path to depth (uint16 mm) or .npy (m)")
+    parser.add_argument("--mask", help="Path to mask (uint8)")
+    parser.add_argument("--rgb_dir", help="Directory or glob of RGB images (batch mode)")
+    parser.add_argument("--depth_dir", help="Directory or glob of depth images, matched to RGB by frame name")
+    parser.add_argument("--mask_dir", help="Directory or glob of masks, matched to RGB by frame name")
+    parser.add_argument("--config", required=True, help="Path to YAML config file")
+    parser.add_argument(
+        "--output_dir", required=True, help="Dir to save augmented outputs (one sub-directory per frame in batch mode)"
+    )
+    add_batch_arguments(parser, default_pattern="*.*")
+    args = parser.parse_args()
 
+    out_dir = Path(args.output_dir)
+    if args.rgb_dir is None:
+        if None in (args.rgb, args.depth, args.mask):
+            parser.error("either --rgb/--depth/--mask or --rgb_dir/--depth_dir/--mask_dir is required")
+        _init_worker(args.config)
+        inputs = (Path(args.rgb), Path(args.depth), Path(args.mask))
+        _process(BatchItem(inputs[0].name, inputs, tuple(out_dir / name for name in OUTPUT_NAMES)))
+        return
+    if args.depth_dir is None or args.mask_dir is None:
+        parser.error("--depth_dir and --mask_dir are required with --rgb_dir")
+
+    depths = index_by_frame(expand_inputs(args.depth_dir, args.pattern))
+    masks = index_by_frame(expand_inputs(args.mask_dir, args.pattern))
+    items = []
+    for frame, rgb_path in index_by_frame(expand_inputs(args.rgb_dir, args.pattern)).items():
+        if frame not in depths or frame not in masks:
+            print(f"Skipping {frame}: no matching depth or mask")
+            continue
+        outputs = tuple(out_dir / frame / name for name in OUTPUT_NAMES)
+        items.append(BatchItem(frame, (rgb_path, depths[frame], masks[frame]), outputs))
+
+    failed = run_batch(
+        items,
+        _process,
+        _init_worker,
+        (args.config,),
+        args.workers,
+        args.force,
+        extra_inputs=(Path(args.config),),
+        desc="Augmentation",
+    )
+    sys.exit(1 if failed else 0)
 
 
+if __name__ == "__main__":
+    main()
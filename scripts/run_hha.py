@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import argparse
 from pathlib import Path
+from typing import Optional
 
 import sys
 
@@ -15,64 +16,106 @@ import numpy as np
 
 from pipeline.config_service import ConfigService
 from pipeline.hha_service import HHAService
+from scripts.batch_utils import BatchItem, add_batch_arguments, expand_inputs, frame_key, run_batch, write_image
+
+# Per-process state, built once by `_init_worker`
+_HHA: Optional[HHAService] = None
+_K: Optional[np.ndarray] = None
+
+
+def _init_worker(config_path: str) -> None:
+    global _HHA, _K
+    cfg = ConfigService().load_config(config_path)
+    _K = cfg.cameras.depth_camera_matrix.to_numpy_array().astype(np.float32)
+    _HHA = HHAService()
+    _HHA.configure_gravity(cfg.hha)
+
+
+def _load_depth_m(path: Path) -> np.ndarray:
+    if path.suffix == ".npy":
+        return np.load(path).astype(np.float32)
+    depth_mm_u16 = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+    if depth_mm_u16 is None:
+        raise FileNotFoundError(f"Cannot read depth image: {path}")
+    return depth_mm_u16.astype(np.float32) / 1000.0
+
+
+def _to_uint8(img: np.ndarray) -> np.ndarray:
+    """Normalize/convert HHA to 8-bit without saturating channels."""
+    x = img
+    if x.dtype == np.uint8:
+        return x
+    x = x.astype(np.float32)
+    maxv = float(np.nanmax(x)) if np.isfinite(x).any() else 0.0
+    minv = float(np.nanmin(x)) if np.isfinite(x).any() else 0.0
+    if maxv <= 1.0:  # likely 0..1
+        x = x * 255.0
+    elif maxv <= 255.0 and minv >= 0.0:  # already 0..255 range
+        pass
+    else:
+        # min-max normalize each channel independently to 0..255
+        x_out = np.empty_like(x, dtype=np.float32)
+        for c in range(x.shape[2]):
+            ch = x[..., c]
+            ch_min = float(np.nanmin(ch))
+            ch_max = float(np.nanmax(ch))
+            if ch_max - ch_min < 1e-6:
+                x_out[..., c] = 0.0
+            else:
+                x_out[..., c] = (ch - ch_min) * (255.0 / (ch_max - ch_min))
+        x = x_out
+    x = np.clip(np.round(x), 0, 255).astype(np.uint8)
+    return x
+
+
+def _process(item: BatchItem) -> None:
+    hha = _HHA.convert(_load_depth_m(item.inputs[0]), _K)
+    write_image(item.outputs[0], _to_uint8(hha))
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Compute HHA from depth (m) using camera intrinsics from config")
-    parser.add_argument("--input", required=True, help="Path to depth_filled.png (uint16 mm) or .npy (m)")
+    parser.add_argument("--input", help="Path to depth_filled.png (uint16 mm) or .npy (m)")
+    parser.add_argument("--output", help="Path to output hha.png (uint8)")
+    parser.add_argument("--input_dir", help="Directory (filtered by --pattern) or glob of depth files")
+    parser.add_argument("--output_dir", help="Directory for <name>_hha.png outputs")
     parser.add_argument("--config", required=True, help="Path to YAML config file")
-    parser.add_argument("--output", required=True, help="Path to output hha.png (uint8)")
+    add_batch_arguments(parser, default_pattern="*.png")
     args = parser.parse_args()
 
-    if args.input.endswith(".npy"):
-        depth_m = np.load(args.input).astype(np.float32)
-    else:
-        depth_mm_u16 = cv2.imread(args.input, cv2.IMREAD_UNCHANGED)
-        if depth_mm_u16 is None:
-            raise FileNotFoundError(f"Cannot read depth image: {args.input}")
-        depth_m = depth_mm_u16.astype(np.float32) / 1000.0
-
-    cfg = ConfigService().load_config(args.config)
-    K = cfg.cameras.depth_camera_matrix.to_numpy_array().astype(np.float32)
-
-    hha = HHAService().convert(depth_m, K)
-
-    # Normalize/convert HHA to 8-bit without saturating channels
-    def to_uint8(img: np.ndarray) -> np.ndarray:
-        x = img
-        if x.dtype == np.uint8:
-            return x
-        x = x.astype(np.float32)
-        maxv = float(np.nanmax(x)) if np.isfinite(x).any() else 0.0
-        minv = float(np.nanmin(x)) if np.isfinite(x).any() else 0.0
-        if maxv <= 1.0:  # likely 0..1
-            x = x * 255.0
-        elif maxv <= 255.0 and minv >= 0.0:  # already 0..255 range
-            pass
-        else:
-            # min-max normalize each channel independently to 0..255
-            x_out = np.empty_like(x, dtype=np.float32)
-            for c in range(x.shape[2]):
-                ch = x[..., c]
-                ch_min = float(np.nanmin(ch))
-                ch_max = float(np.nanmax(ch))
-                if ch_max - ch_min < 1e-6:
-                    x_out[..., c] = 0.0
-                else:
-                    x_out[..., c] = (ch - ch_min) * (255.0 / (ch_max - ch_min))
-            x = x_out
-        x = np.clip(np.round(x), 0, 255).astype(np.uint8)
-        return x
-
-    hha_u8 = to_uint8(hha)
-
-    out_path = Path(args.output)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    cv2.imwrite(str(out_path), hha_u8)
+    if args.input_dir is None:
+        if args.input is None or args.output is None:
+            parser.error("either --input/--output or --input_dir/--output_dir is required")
+        _init_worker(args.config)
+        _process(BatchItem(Path(args.input).name, (Path(args.input),), (Path(args.output),)))
+        return
+    if args.output_dir is None:
+        parser.error("--output_dir is required with --input_dir")
+
+    workers = args.workers
+    gravity_mode = ConfigService().load_config(args.config).hha.gravity_mode
+    if gravity_mode in HHAService.STATEFUL_GRAVITY_MODES and workers > 1:
+        # The gravity estimate is carried from frame to frame in input order
+        print(f"hha.gravity_mode '{gravity_mode}' carries state across frames; using a single worker")
+        workers = 1
+
+    out_dir = Path(args.output_dir)
+    items = [
+        BatchItem(path.name, (path,), (out_dir / f"{frame_key(path)}_hha.png",))
+        for path in expand_inputs(args.input_dir, args.pattern)
+    ]
+    failed = run_batch(
+        items,
+        _process,
+        _init_worker,
+        (args.config,),
+        workers,
+        args.force,
+        extra_inputs=(Path(args.config),),
+        desc="HHA",
+    )
+    sys.exit(1 if failed else 0)
 
 
 if __name__ == "__main__":
     main()
-
-
-
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import argparse
 from pathlib import Path
+from typing import Optional
 
 import sys
 
@@ -10,75 +11,76 @@ PROJECT_ROOT = Path(__file__).resolve().parents[1]
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
-import cv2
 import numpy as np
 
+from pipeline.file_service import FileService
 from pipeline.inpainting_service import InpaintingService
-
-
-def read_depth_txt_any(path: str) -> np.ndarray:
-    """Read depth txt either as plain grid or header+sparse triples.
-
-    Supported formats:
-      - Plain whitespace-separated grid of millimeters (H x W)
-      - Header with lines like 'Width: <w>', 'Height: <h>' and sparse lines
-        'row,column,depth_value' following the header.
-    """
-    try:
-        # Fast path: plain grid
-        return np.loadtxt(path, dtype=np.float32)
-    except Exception:
-        # Fallback: parse header + triples
-        height = width = None
-        triples = []
-        with open(path, "r", encoding="utf-8") as f:
-            for line in f:
-                s = line.strip()
-                if not s:
-                    continue
-                if s.startswith("Width:"):
-                    width = int(s.split(":", 1)[1].strip())
-                    continue
-                if s.startswith("Height:"):
-                    height = int(s.split(":", 1)[1].strip())
-                    continue
-                if "," in s:
-                    parts = s.split(",")
-                    if len(parts) == 3 and parts[0].isdigit() and parts[1].isdigit():
-                        try:
-                            r = int(parts[0])
-                            c = int(parts[1])
-                            v = float(parts[2])
-                        except ValueError:
-                            continue
-                        triples.append((r, c, v))
-        if height is None or width is None:
-            raise ValueError("Cannot determine width/height from header and plain grid parsing failed")
-        depth = np.zeros((height, width), dtype=np.float32)
-        for r, c, v in triples:
-            if 0 <= r < height and 0 <= c < width:
-                depth[r, c] = v
-        return depth
+from scripts.batch_utils import (
+    BatchItem,
+    add_batch_arguments,
+    expand_inputs,
+    frame_key,
+    run_batch,
+    settings_stamp,
+    write_image,
+)
+
+# Per-process state, built once by `_init_worker`
+_FILE_SERVICE: Optional[FileService] = None
+_INPAINTING: Optional[InpaintingService] = None
+_METHOD = "linear_nearest"
+
+
+def _init_worker(method: str) -> None:
+    global _FILE_SERVICE, _INPAINTING, _METHOD
+    _FILE_SERVICE, _INPAINTING, _METHOD = FileService(), InpaintingService(), method
+
+
+def _process(item: BatchItem) -> None:
+    depth_mm = _FILE_SERVICE.load_depth_txt(str(item.inputs[0]))
+    filled_m = _INPAINTING.apply(depth_mm, _METHOD)
+    depth_mm_uint16 = np.clip(np.round(filled_m * 1000.0), 0, 65535).astype(np.uint16)
+    write_image(item.outputs[0], depth_mm_uint16)
 
 
 def main() -> None:
-    parser = argparse.ArgumentParser(description="Run inpainting on a depth txt file (mm)")
-    parser.add_argument("--input", required=True, help="Path to depth .txt (mm)")
-    parser.add_argument("--output", required=True, help="Path to output depth_filled.png (uint16 mm)")
+    parser = argparse.ArgumentParser(description="Run inpainting on depth txt files (mm)")
+    parser.add_argument("--input", help="Path to depth .txt or .txt.gz (mm)")
+    parser.add_argument("--output", help="Path to output depth_filled.png (uint16 mm)")
+    parser.add_argument("--input_dir", help="Directory (filtered by --pattern) or glob of depth files")
+    parser.add_argument("--output_dir", help="Directory for <name>_depth_filled.png outputs")
     parser.add_argument("--method", default="linear_nearest", help="Inpainting method")
+    add_batch_arguments(parser, default_pattern="*.txt*")
     args = parser.parse_args()
 
-    depth_mm = read_depth_txt_any(args.input)
-    filled_m = InpaintingService().apply(depth_mm, args.method)
-
-    out_path = Path(args.output)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    depth_mm_uint16 = np.clip(np.round(filled_m * 1000.0), 0, 65535).astype(np.uint16)
-    cv2.imwrite(str(out_path), depth_mm_uint16)
+    if args.input_dir is None:
+        if args.input is None or args.output is None:
+            parser.error("either --input/--output or --input_dir/--output_dir is required")
+        _init_worker(args.method)
+        _process(BatchItem(Path(args.input).name, (Path(args.input),), (Path(args.output),)))
+        return
+    if args.output_dir is None:
+        parser.error("--output_dir is required with --input_dir")
+
+    out_dir = Path(args.output_dir)
+    items = [
+        BatchItem(path.name, (path,), (out_dir / f"{frame_key(path)}_depth_filled.png",))
+        for path in expand_inputs(args.input_dir, args.pattern)
+    ]
+    # Outputs made with another method are stale
+    stamp = settings_stamp(out_dir, "inpainting", f"method={args.method}\n")
+    failed = run_batch(
+        items,
+        _process,
+        _init_worker,
+        (args.method,),
+        args.workers,
+        args.force,
+        extra_inputs=(stamp,),
+        desc="Inpainting",
+    )
+    sys.exit(1 if failed else 0)
 
 
 if __name__ == "__main__":
     main()
-
-
-